@@ -0,0 +1,374 @@
+"""
+Микробенчмарки слоя данных на реалистичных объемах.
+
+Генерирует базу текущего формата (по умолчанию 1 млн сообщений от 10 тыс.
+пользователей за 30 дней; активность пользователей неравномерна) пакетной
+вставкой executemany, минуя ORM и триггеры полнотекстового индекса, который
+строится одним проходом после вставки. Затем замеряет операции HistoryService
+и ThrottlingMiddleware._check_limit так, как их вызывают обработчики:
+отдельная сессия на вызов, случайный пользователь.
+
+Для каждого замера сохраняются статистики времени (в формате, близком к
+pytest-benchmark) и EXPLAIN QUERY PLAN всех выполненных запросов. Результат
+пишется в JSON вместе с коммитом, чтобы сравнивать прогоны между коммитами:
+
+    python -m benchmarks.data_layer --rows 1000000 --users 10000
+    python -m benchmarks.data_layer --db data/bench.sqlite --compare benchmarks/results/<прошлый>.json
+
+Сгенерированная база (--db) переиспользуется между запусками, замеры идут
+на ее временной копии, потому что add_message и clear_user_history меняют данные.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Tuple
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from benchmarks.storage import _text
+from bot.middlewares.throttling import ThrottlingMiddleware
+from bot.migrations import run_migrations
+from bot.models import Base, DIALOG_HISTORY_FTS_DDL
+from bot.services.history import HistoryService
+from bot.storage import ROLE_CODES, encode_content, register_sqlite_functions, to_epoch_ms
+
+RESULTS_DIR = Path(__file__).parent / "results"
+INSERT_BATCH_SIZE = 10000
+
+# Триггеры полнотекстового индекса отключаются на время пакетной вставки
+FTS_TRIGGERS = ("dialog_history_fts_insert", "dialog_history_fts_delete", "dialog_history_fts_update")
+
+INSERT_SQL = (
+    "INSERT INTO dialog_history (user_id, bot_id, conversation_id, role, content, timestamp) "
+    "VALUES (?, 0, 0, ?, ?, ?)"
+)
+
+
+async def create_schema(path: Path) -> None:
+    """Схема текущей версии: те же create_all и миграции, что при запуске бота."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+    await engine.dispose()
+
+
+async def build_db(path: Path, rows: int, users: int, days: int = 30, seed: int = 42) -> float:
+    """
+    Создает базу со сгенерированной историей.
+
+    Returns:
+        Время генерации в секундах
+    """
+    started = time.perf_counter()
+    await create_schema(path)
+
+    rng = random.Random(seed)
+    end = datetime.utcnow()
+    step = timedelta(days=days) / max(rows, 1)
+
+    def generate():
+        for i in range(rows):
+            role = "user" if i % 2 == 0 else "assistant"
+            content = _text(rng, 20, 300) if role == "user" else _text(rng, 200, 1500)
+            # Квадрат равномерного распределения: немногие пользователи пишут больше всех
+            user_id = int(users * rng.random() ** 2)
+            timestamp = end - step * (rows - i)
+            yield user_id, ROLE_CODES[role], encode_content(content), to_epoch_ms(timestamp)
+
+    conn = sqlite3.connect(path)
+    register_sqlite_functions(conn)
+    conn.execute("PRAGMA synchronous = OFF")
+    for trigger in FTS_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    batch = []
+    for row in generate():
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            conn.executemany(INSERT_SQL, batch)
+            batch.clear()
+    conn.executemany(INSERT_SQL, batch)
+    conn.commit()
+
+    for statement in DIALOG_HISTORY_FTS_DDL:
+        conn.execute(statement)
+    conn.execute("INSERT INTO dialog_history_fts(dialog_history_fts) VALUES ('rebuild')")
+    # Статистика для планировщика, как после долгой работы с PRAGMA optimize
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+    # Повторный прогон миграций заполняет счетчики лимитов по сгенерированной истории
+    await create_schema(path)
+    return time.perf_counter() - started
+
+
+def count_rows(path: Path) -> int:
+    try:
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM dialog_history").fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+
+class QueryRecorder:
+    """Собирает SQL-запросы, выполненные движком во время замера."""
+
+    def __init__(self, engine: AsyncEngine) -> None:
+        self.engine = engine.sync_engine
+        self.queries: Dict[str, tuple] = {}
+        self.active = False
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if self.active and statement not in self.queries:
+            self.queries[statement] = tuple(parameters) if parameters else ()
+
+    def __enter__(self) -> "QueryRecorder":
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def explain(path: Path, queries: Dict[str, tuple]) -> List[dict]:
+    """
+    EXPLAIN QUERY PLAN для каждого запроса. full_scan - шаги SCAN без индекса,
+    обычно первое, что ищут при регрессии.
+    """
+    conn = sqlite3.connect(path)
+    register_sqlite_functions(conn)
+    plans = []
+    for statement, parameters in queries.items():
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        except sqlite3.Error as e:
+            plans.append({"sql": statement, "error": str(e)})
+            continue
+        details = [row[3] for row in rows]
+        plans.append({
+            "sql": " ".join(statement.split()),
+            "plan": details,
+            "full_scan": [d for d in details if d.startswith("SCAN ") and " USING " not in d],
+        })
+    conn.close()
+    return plans
+
+
+def summarize(timings: List[float]) -> dict:
+    """Статистики замера в секундах (имена полей как в pytest-benchmark)."""
+    ordered = sorted(timings)
+    quartiles = statistics.quantiles(ordered, n=4) if len(ordered) > 1 else [ordered[0]] * 3
+    mean = statistics.fmean(ordered)
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": mean,
+        "stddev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        "median": statistics.median(ordered),
+        "q1": quartiles[0],
+        "q3": quartiles[2],
+        "iqr": quartiles[2] - quartiles[0],
+        "rounds": len(ordered),
+        "total": sum(ordered),
+        "ops": 1 / mean if mean else 0.0,
+    }
+
+
+class DataLayerBenchmark:
+    """Набор замеров операций слоя данных на одной базе."""
+
+    def __init__(self, path: Path, users: int, rounds: int, warmup: int, seed: int = 7) -> None:
+        self.path = path
+        self.users = users
+        self.rounds = rounds
+        self.warmup = warmup
+        self.rng = random.Random(seed)
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        self.sessions = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    def random_user(self) -> int:
+        # То же распределение активности, что при генерации
+        return int(self.users * self.rng.random() ** 2)
+
+    async def measure(self, name: str, operation: Callable[[AsyncSession, int], Awaitable[object]]) -> dict:
+        """Выполняет operation(session, номер раунда) warmup + rounds раз в отдельных сессиях."""
+        timings = []
+        with QueryRecorder(self.engine) as recorder:
+            for number in range(self.warmup + self.rounds):
+                async with self.sessions() as session:
+                    recorder.active = number >= self.warmup
+                    started = time.perf_counter()
+                    await operation(session, number)
+                    elapsed = time.perf_counter() - started
+                if number >= self.warmup:
+                    timings.append(elapsed)
+
+        stats = summarize(timings)
+        print(f"  {name:<40} {stats['mean'] * 1000:>9.3f} мс  (медиана {stats['median'] * 1000:.3f}, "
+              f"max {stats['max'] * 1000:.3f})")
+        return {
+            "name": name,
+            "group": name.split(".")[0],
+            "stats": stats,
+            "extra_info": {"query_plans": explain(self.path, recorder.queries)},
+        }
+
+    async def run(self) -> List[dict]:
+        # Пользователи для очистки выбираются заранее без повторов: история удаляется
+        cleared = self.rng.sample(range(self.users), min(self.users, self.warmup + self.rounds))
+        throttling = ThrottlingMiddleware()
+
+        async def check_limit_cold(session, number):
+            throttling._cache.clear()
+            await throttling._check_limit(self.random_user(), session)
+
+        benchmarks = [
+            ("history.get_recent_history", lambda session, number: HistoryService.get_recent_history(
+                session, self.random_user())),
+            ("history.add_message", lambda session, number: HistoryService.add_message(
+                session, self.random_user(), "user", _text(self.rng, 20, 300))),
+            ("history.get_message_count", lambda session, number: HistoryService.get_message_count(
+                session, self.random_user())),
+            ("history.clear_user_history", lambda session, number: HistoryService.clear_user_history(
+                session, cleared[number])),
+            ("throttling.check_limit", check_limit_cold),
+            ("throttling.check_limit_cached", lambda session, number: throttling._check_limit(0, session)),
+        ]
+
+        results = []
+        try:
+            for name, operation in benchmarks:
+                results.append(await self.measure(name, operation))
+        finally:
+            await self.engine.dispose()
+        return results
+
+
+def machine_info() -> dict:
+    return {
+        "node": platform.node(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "python_version": platform.python_version(),
+        "sqlite_version": sqlite3.sqlite_version,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def commit_info() -> dict:
+    def git(*args: str) -> str:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+
+    try:
+        return {
+            "id": git("rev-parse", "HEAD"),
+            "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        }
+    except (OSError, subprocess.CalledProcessError):
+        return {"id": None, "branch": None, "dirty": None}
+
+
+def compare(current: dict, previous: dict, threshold: float) -> List[Tuple[str, float]]:
+    """
+    Сравнивает средние времена с прошлым прогоном.
+
+    Returns:
+        Замеры, замедлившиеся больше чем на threshold (доля), и их изменение
+    """
+    before = {item["name"]: item["stats"]["mean"] for item in previous.get("benchmarks", [])}
+    commit = (previous.get("commit_info") or {}).get("id") or "?"
+    print(f"\nСравнение с {commit[:10]} ({previous.get('params')}):")
+
+    regressions = []
+    for item in current["benchmarks"]:
+        name, mean = item["name"], item["stats"]["mean"]
+        if name not in before or not before[name]:
+            print(f"  {name:<40} новый замер")
+            continue
+        change = mean / before[name] - 1
+        mark = "  ⚠️ регрессия" if change > threshold else ""
+        print(f"  {name:<40} {before[name] * 1000:>9.3f} -> {mean * 1000:>9.3f} мс ({change:+.0%}){mark}")
+        if change > threshold:
+            regressions.append((name, change))
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Микробенчмарки истории и лимитов на больших таблицах")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=30, help="За сколько дней распределены сообщения")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--db", type=Path, help="Сгенерированная база: создается, если ее нет, иначе переиспользуется")
+    parser.add_argument("--output", type=Path, help="Файл результатов (по умолчанию benchmarks/results/)")
+    parser.add_argument("--compare", type=Path, help="Результаты прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Допустимое замедление (доля)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.db or Path(directory) / "generated.sqlite"
+        existing = count_rows(source) if source.exists() else 0
+        if existing:
+            print(f"База {source}: {existing} сообщений (переиспользуется)")
+            generation_time = None
+        else:
+            print(f"Генерация {args.rows} сообщений от {args.users} пользователей...")
+            generation_time = asyncio.run(build_db(source, args.rows, args.users, days=args.days))
+            print(f"Готово за {generation_time:.1f} с, {source.stat().st_size / 2**20:.0f} МБ")
+
+        # Замеры меняют данные, поэтому идут на копии
+        working = Path(directory) / "working.sqlite"
+        shutil.copy(source, working)
+        benchmarks = asyncio.run(DataLayerBenchmark(working, args.users, args.rounds, args.warmup).run())
+
+    result = {
+        "version": 1,
+        "datetime": datetime.utcnow().isoformat(timespec="seconds"),
+        "machine_info": machine_info(),
+        "commit_info": commit_info(),
+        "params": {
+            "rows": existing or args.rows,
+            "users": args.users,
+            "rounds": args.rounds,
+            "warmup": args.warmup,
+            "generation_time": generation_time,
+        },
+        "benchmarks": benchmarks,
+    }
+
+    output = args.output
+    if output is None:
+        commit = (result["commit_info"]["id"] or "nogit")[:10]
+        output = RESULTS_DIR / f"{datetime.utcnow():%Y%m%d-%H%M%S}-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты: {output}")
+
+    for item in benchmarks:
+        for plan in item["extra_info"]["query_plans"]:
+            if plan.get("full_scan"):
+                print(f"⚠️ {item['name']}: полный просмотр таблицы {plan['full_scan']}")
+
+    if args.compare:
+        previous = json.loads(args.compare.read_text(encoding="utf-8"))
+        if compare(result, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
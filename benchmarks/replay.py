@@ -0,0 +1,247 @@
+"""
+Офлайн-бенчмарки обращений к OpenRouter по записанному трафику.
+
+Трафик записывается самим ботом (HTTP_RECORD_FILE в .env, см.
+bot/services/recording.py). Запись воспроизводится двумя способами:
+
+    # Замер OpenRouterService.chat_completion и потоковых замеров моделей
+    # на ответах из записи, без сети (--speed 0 - без задержек)
+    python -m benchmarks.replay bench data/recordings/openrouter.jsonl.gz --concurrency 20
+    python -m benchmarks.replay bench <запись> --models model-a,model-b --compare benchmarks/results/<прошлый>.json
+
+    # Локальный сервер с API OpenRouter: бот или другой клиент работает с ним
+    # через OPENROUTER_BASE_URL=http://127.0.0.1:8090/api/v1
+    python -m benchmarks.replay serve <запись> --port 8090 --speed 0.5
+
+Ответы и их задержки берутся из записи, поэтому повторные прогоны на одном
+файле сравнимы между коммитами: меняется только код бота (цепочка моделей,
+повторы, бюджет времени). Ошибки и таймауты воспроизводятся там же, где
+они случились при записи, и запрос переходит к резервной модели так же.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+import httpx
+from aiohttp import web
+from benchmarks.data_layer import RESULTS_DIR, commit_info, compare, machine_info, summarize
+from bot.services.recording import ReplayStore, ReplayTransport, decode_chunk, load_records, sleep_until
+
+CHAT_PATH_SUFFIX = "/chat/completions"
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def recorded_requests(records: List[dict], stream: bool = False) -> List[dict]:
+    """Тела записанных запросов к chat/completions (в порядке записи)."""
+    return [
+        record["body"] for record in records
+        if record["path"].endswith(CHAT_PATH_SUFFIX) and record.get("stream") == stream
+        and isinstance(record.get("body"), dict) and record["body"].get("messages")
+    ]
+
+
+def recorded_models(records: List[dict]) -> List[str]:
+    """Модели в порядке первого появления в записи: обычно это и есть цепочка."""
+    return list(dict.fromkeys(record["model"] for record in records if record.get("model")))
+
+
+class ReplayBenchmark:
+    """Замеры OpenRouterService поверх ReplayTransport."""
+
+    def __init__(self, path: Path, speed: float, concurrency: int, rounds: Optional[int], models: List[str]) -> None:
+        self.records = load_records(str(path))
+        self.speed = speed
+        self.concurrency = concurrency
+        self.rounds = rounds
+        self.models = models or recorded_models(self.records)
+
+    def build_service(self):
+        # Импорт здесь: модуль создает общий клиент бота при импорте
+        from bot.services.openrouter import OpenRouterService
+
+        # Свежий store на каждый замер: записи выдаются по кругу с начала
+        client = httpx.AsyncClient(transport=ReplayTransport(ReplayStore(self.records), speed=self.speed))
+        return OpenRouterService(http_client=client), client
+
+    async def bench_chat(self) -> Optional[dict]:
+        requests = recorded_requests(self.records)
+        if not requests:
+            return None
+        rounds = self.rounds or len(requests)
+        service, client = self.build_service()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def one(number: int) -> tuple:
+            body = requests[number % len(requests)]
+            async with semaphore:
+                started = time.perf_counter()
+                result = await service.chat_completion(
+                    body["messages"],
+                    max_tokens=body.get("max_tokens") or 500,
+                    temperature=body.get("temperature", 0.7),
+                    models=self.models,
+                )
+                return time.perf_counter() - started, result
+
+        try:
+            outcomes = await asyncio.gather(*(one(number) for number in range(rounds)))
+        finally:
+            await client.aclose()
+
+        timings = [elapsed for elapsed, _ in outcomes]
+        results = [result for _, result in outcomes]
+        return {
+            "name": "openrouter.chat_completion",
+            "stats": summarize(timings),
+            "extra_info": {
+                "p95": percentile(timings, 0.95),
+                "p99": percentile(timings, 0.99),
+                "success": sum(1 for result in results if result["success"]),
+                "fallback": sum(1 for result in results if result.get("fallback_used")),
+                "attempts": sum(result["attempts"] for result in results),
+                "models_used": {
+                    model: sum(1 for result in results if result.get("model_used") == model)
+                    for model in self.models
+                },
+            },
+        }
+
+    async def bench_stream(self) -> Optional[dict]:
+        if not recorded_requests(self.records, stream=True):
+            return None
+        from bot.services.probe import ModelProbeService
+
+        service, client = self.build_service()
+        try:
+            results = await ModelProbeService(service).probe_all(self.models)
+        finally:
+            await client.aclose()
+
+        ttft = [result["ttft_ms"] / 1000 for result in results if result.get("ttft_ms") is not None]
+        return {
+            "name": "openrouter.stream_ttft",
+            "stats": summarize(ttft or [0.0]),
+            "extra_info": {
+                "success": sum(1 for result in results if result["success"]),
+                "models": {result["model"]: result.get("ttft_ms") for result in results},
+            },
+        }
+
+    async def run(self) -> List[dict]:
+        benchmarks = []
+        for bench in (self.bench_chat, self.bench_stream):
+            result = await bench()
+            if result is not None:
+                benchmarks.append(result)
+                stats = result["stats"]
+                print(f"  {result['name']:<32} {stats['median'] * 1000:>9.1f} мс (медиана), {stats['rounds']} запросов")
+        return benchmarks
+
+
+def create_replay_app(store: ReplayStore, speed: float) -> web.Application:
+    """Сервер с API OpenRouter, отвечающий записанными ответами."""
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        started = time.perf_counter()
+        record = store.match(request.path, await request.read())
+        if record is None:
+            return web.json_response({"error": {"message": "Нет записи для запроса"}}, status=404)
+
+        error = record.get("error")
+        if error and record.get("status") is None:
+            if error["type"] == "CancelledError":
+                await asyncio.Event().wait()  # Клиент не дождался ответа при записи
+            await sleep_until(started, error.get("after_ms"), speed)
+            request.transport.close()  # Для клиента - обрыв соединения
+            return web.Response(status=502)
+
+        await sleep_until(started, record.get("ttfb_ms"), speed)
+        response = web.StreamResponse(status=record["status"], headers=record.get("headers") or {})
+        await response.prepare(request)
+        for item in record["chunks"]:
+            offset, chunk = decode_chunk(item)
+            await sleep_until(started, offset, speed)
+            await response.write(chunk)
+        if error:
+            await sleep_until(started, error.get("after_ms"), speed)
+            request.transport.close()
+            return response
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handle)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика OpenRouter")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser("bench", help="Замер OpenRouterService на записанных ответах")
+    bench.add_argument("recording", type=Path)
+    bench.add_argument("--speed", type=float, default=1.0, help="Множитель задержек (0 - без задержек)")
+    bench.add_argument("--concurrency", type=int, default=10)
+    bench.add_argument("--rounds", type=int, help="Число запросов (по умолчанию - как в записи)")
+    bench.add_argument("--models", help="Цепочка моделей через запятую (по умолчанию - из записи)")
+    bench.add_argument("--output", type=Path, help="Файл результатов (по умолчанию benchmarks/results/)")
+    bench.add_argument("--compare", type=Path, help="Результаты прошлого прогона для сравнения")
+    bench.add_argument("--threshold", type=float, default=0.10, help="Допустимое замедление (доля)")
+
+    serve = commands.add_parser("serve", help="Локальный сервер с записанными ответами")
+    serve.add_argument("recording", type=Path)
+    serve.add_argument("--speed", type=float, default=1.0, help="Множитель задержек (0 - без задержек)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        store = ReplayStore.load(str(args.recording))
+        print(f"Записей: {len(store.records)}. OPENROUTER_BASE_URL=http://{args.host}:{args.port}/api/v1")
+        web.run_app(create_replay_app(store, args.speed), host=args.host, port=args.port, print=None)
+        return
+
+    models = [model.strip() for model in args.models.split(",")] if args.models else []
+    runner = ReplayBenchmark(args.recording, args.speed, args.concurrency, args.rounds, models)
+    print(f"Записей: {len(runner.records)}, цепочка: {runner.models}, скорость x{args.speed}")
+    benchmarks = asyncio.run(runner.run())
+
+    result = {
+        "version": 1,
+        "datetime": datetime.utcnow().isoformat(timespec="seconds"),
+        "machine_info": machine_info(),
+        "commit_info": commit_info(),
+        "params": {
+            "recording": str(args.recording),
+            "records": len(runner.records),
+            "speed": args.speed,
+            "concurrency": args.concurrency,
+            "models": runner.models,
+        },
+        "benchmarks": benchmarks,
+    }
+
+    output = args.output
+    if output is None:
+        commit = (result["commit_info"]["id"] or "nogit")[:10]
+        output = RESULTS_DIR / f"{datetime.utcnow():%Y%m%d-%H%M%S}-{commit}-replay.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты: {output}")
+
+    if args.compare:
+        previous = json.loads(args.compare.read_text(encoding="utf-8"))
+        if compare(result, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
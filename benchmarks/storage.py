@@ -0,0 +1,144 @@
+"""
+Сравнение старого и компактного формата dialog_history.
+
+Создает базу в старом формате (роль строкой, время текстом, текст без сжатия),
+замеряет размер файла и скорость чтения последних сообщений, затем выполняет
+миграцию и повторяет замеры.
+
+Запуск:
+    python -m benchmarks.storage --rows 50000 --users 500
+"""
+import argparse
+import asyncio
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from sqlalchemy.ext.asyncio import create_async_engine
+from bot.migrations import run_migrations
+from bot.storage import decode_content, from_epoch_ms, register_sqlite_functions
+
+LEGACY_DDL = [
+    "CREATE TABLE dialog_history (id INTEGER PRIMARY KEY, user_id BIGINT NOT NULL, "
+    "bot_id BIGINT NOT NULL DEFAULT 0, role VARCHAR(20) NOT NULL, content TEXT NOT NULL, timestamp DATETIME NOT NULL)",
+    "CREATE INDEX ix_dialog_history_user_id ON dialog_history (user_id)",
+    "CREATE INDEX ix_dialog_history_user_bot_ts ON dialog_history (user_id, bot_id, timestamp)",
+    "CREATE VIRTUAL TABLE dialog_history_fts USING fts5(content, user_id, content='dialog_history', "
+    "content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+]
+
+RECENT_SQL = (
+    "SELECT role, content, timestamp FROM dialog_history "
+    "WHERE user_id = ? AND bot_id = 0 ORDER BY timestamp DESC LIMIT 30"
+)
+
+WORDS = (
+    "модель ответ запрос данные функция пример код python список строка ошибка сервер "
+    "база индекс таблица время память сжатие текст пользователь бот сообщение история "
+    "алгоритм результат значение параметр настройка документация поиск поток задача"
+).split()
+
+
+def _text(rng: random.Random, min_chars: int, max_chars: int) -> str:
+    target = rng.randint(min_chars, max_chars)
+    words, size = [], 0
+    while size < target:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def build_legacy_db(path: Path, rows: int, users: int, seed: int = 42) -> None:
+    """Создает базу старого формата со сгенерированной историей."""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+
+    def generate():
+        for i in range(rows):
+            role = "user" if i % 2 == 0 else "assistant"
+            content = _text(rng, 20, 300) if role == "user" else _text(rng, 300, 4000)
+            timestamp = start + timedelta(seconds=i * 7)
+            yield rng.randrange(users), role, content, timestamp.isoformat(sep=" ")
+
+    with sqlite3.connect(path) as conn:
+        for statement in LEGACY_DDL:
+            conn.execute(statement)
+        conn.executemany(
+            "INSERT INTO dialog_history (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+            generate(),
+        )
+        conn.execute("INSERT INTO dialog_history_fts(dialog_history_fts) VALUES ('rebuild')")
+    _vacuum(path)
+
+
+async def migrate(path: Path) -> float:
+    """Переводит базу в компактный формат, возвращает время миграции в секундах."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    started = time.perf_counter()
+    async with engine.begin() as conn:
+        await run_migrations(conn)
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    _vacuum(path)
+    return elapsed
+
+
+def _vacuum(path: Path) -> None:
+    conn = sqlite3.connect(path)
+    register_sqlite_functions(conn)
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def measure_reads(path: Path, users: int, reads: int, compact: bool, seed: int = 7) -> float:
+    """
+    Читает последние 30 сообщений случайных пользователей и декодирует строки
+    так же, как это делает ORM. Возвращает количество запросов в секунду.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    started = time.perf_counter()
+    for _ in range(reads):
+        for role, content, timestamp in conn.execute(RECENT_SQL, (rng.randrange(users),)):
+            if compact:
+                decode_content(content), from_epoch_ms(timestamp)
+            else:
+                datetime.fromisoformat(timestamp)
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return reads / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Размер и скорость чтения dialog_history до и после миграции")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--reads", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy = Path(directory) / "legacy.sqlite"
+        compact = Path(directory) / "compact.sqlite"
+
+        build_legacy_db(legacy, args.rows, args.users)
+        shutil.copy(legacy, compact)
+        migration_time = asyncio.run(migrate(compact))
+
+        legacy_size = legacy.stat().st_size
+        compact_size = compact.stat().st_size
+        legacy_rate = measure_reads(legacy, args.users, args.reads, compact=False)
+        compact_rate = measure_reads(compact, args.users, args.reads, compact=True)
+
+    print(f"Строк: {args.rows}, пользователей: {args.users}, миграция: {migration_time:.2f} с")
+    print(f"{'Формат':<12} {'Размер, МБ':>12} {'Чтений/с':>12}")
+    print(f"{'старый':<12} {legacy_size / 2**20:>12.2f} {legacy_rate:>12.0f}")
+    print(f"{'компактный':<12} {compact_size / 2**20:>12.2f} {compact_rate:>12.0f}")
+    print(f"Размер: {compact_size / legacy_size * 100:.0f}% от исходного")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Служебные команды бота для администратора.
+
+Использование:
+    python -m bot.cli probe       # Замерить модели и сохранить результаты
+    python -m bot.cli models      # Таблица сравнения моделей по замерам
+    python -m bot.cli export --user 123 --format md --out history.md.gz
+"""
+import argparse
+import asyncio
+from pathlib import Path
+from bot.database import AsyncSessionLocal, init_db, close_db
+from bot.services.http_client import close_http_client
+
+
+async def cmd_probe(args: argparse.Namespace) -> None:
+    from bot.services.probe import ModelProbeService, probe_service
+
+    results = await probe_service.probe_all()
+    async with AsyncSessionLocal() as session:
+        await ModelProbeService.save_results(session, results)
+        summary = await ModelProbeService.get_summary(session, hours=args.hours)
+
+    print(probe_service.format_table(summary))
+
+
+async def cmd_models(args: argparse.Namespace) -> None:
+    from bot.services.probe import ModelProbeService, probe_service
+
+    async with AsyncSessionLocal() as session:
+        summary = await ModelProbeService.get_summary(session, hours=args.hours)
+
+    if not summary:
+        print("Замеров пока нет. Запустите: python -m bot.cli probe")
+        return
+    print(probe_service.format_table(summary))
+
+
+async def cmd_export(args: argparse.Namespace) -> None:
+    from bot.services.export import HistoryExporter
+
+    destination = Path(args.out) if args.out else Path(f"history_{args.user}.{args.format}.gz")
+    async with AsyncSessionLocal() as session:
+        path, count = await HistoryExporter.export_to_file(
+            session, args.user, args.format, destination, bot_id=args.bot
+        )
+
+    print(f"Выгружено сообщений: {count} → {path}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m bot.cli", description="Служебные команды бота")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    probe = subparsers.add_parser("probe", help="Замерить все модели цепочки")
+    probe.add_argument("--hours", type=int, default=None, help="Окно сводки в часах")
+    probe.set_defaults(func=cmd_probe)
+
+    models = subparsers.add_parser("models", help="Сравнение моделей по сохраненным замерам")
+    models.add_argument("--hours", type=int, default=None, help="Окно сводки в часах")
+    models.set_defaults(func=cmd_models)
+
+    export = subparsers.add_parser("export", help="Выгрузить историю пользователя в gzip файл")
+    export.add_argument("--user", type=int, required=True, help="ID пользователя Telegram")
+    export.add_argument("--bot", type=int, default=0, help="Пространство имен бота (0 - бот из BOT_TOKEN)")
+    export.add_argument("--format", choices=["jsonl", "md"], default="jsonl")
+    export.add_argument("--out", default=None, help="Путь к файлу (по умолчанию history_<id>.<format>.gz)")
+    export.set_defaults(func=cmd_export)
+
+    return parser
+
+
+async def run(args: argparse.Namespace) -> None:
+    await init_db()
+    try:
+        await args.func(args)
+    finally:
+        await close_http_client()
+        await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(build_parser().parse_args()))
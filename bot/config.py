@@ -1,17 +1,34 @@
-from typing import Optional, List
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Iterable, Literal, Optional, List, Dict, Set
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import field_validator
+from pydantic import ValidationError, field_validator
+
+logger = logging.getLogger(__name__)
 
 
 class Settings(BaseSettings):
     """Настройки приложения, загружаемые из .env файла."""
 
     # Ключи API
-    BOT_TOKEN: str
+    BOT_TOKEN: Optional[str] = None
     OPENROUTER_API_KEY: str
     OPENROUTER_SITE: Optional[str] = None
     OPENROUTER_TITLE: Optional[str] = None
 
+    # Несколько ботов в одном процессе: путь к JSON-списку профилей
+    # [{"name": "...", "token": "...", "system_prompt": "...", "models": [...],
+    #   "text_daily_limit": 100, "chat_window_limit": 20}]
+    BOTS_CONFIG: Optional[str] = None
+
+    # Системный промпт по умолчанию
+    SYSTEM_PROMPT: str = (
+        "Ты полезный, вежливый и информативный ассистент. "
+        "Отвечай на русском языке. Будь краток, но содержателен. "
+        "Учитывай контекст предыдущих сообщений."
+    )
+
     # Основная модель
     OPENROUTER_MODEL: str = "openai/gpt-oss-20b:free"
 
@@ -22,6 +39,161 @@ class Settings(BaseSettings):
     # Лимиты
     TEXT_DAILY_LIMIT: int = 200
     CHAT_WINDOW_LIMIT: int = 30
+    # Сброс дневного лимита: rolling - через 24 часа после первого запроса окна
+    # (фиксированное окно, не скользящие 24 часа), calendar - в полночь по LIMIT_TIMEZONE
+    LIMIT_RESET_MODE: Literal["rolling", "calendar"] = "rolling"
+    LIMIT_TIMEZONE: str = "UTC"
+    LIMIT_ROLLOVER_INTERVAL: int = 300  # Секунды между сбросами истекших счетчиков
+    LIMIT_PRUNE_DAYS: int = 7  # Удалять счетчики неактивных пользователей без своего лимита
+
+    # Групповые чаты: бот отвечает на команды, упоминания и ответы на свои сообщения.
+    # Контекст и лимит общие для всего чата
+    GROUPS_ENABLED: bool = True
+    GROUP_DAILY_LIMIT: int = 100
+    GROUP_WINDOW_LIMIT: int = 20
+
+    # HTTP-клиент (пул соединений и таймауты)
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    HTTP2_ENABLED: bool = True
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_READ_TIMEOUT: float = 60.0
+    HTTP_WRITE_TIMEOUT: float = 10.0
+    HTTP_POOL_TIMEOUT: float = 5.0
+    HTTP_TOTAL_TIMEOUT: float = 90.0
+    # Таймауты для отдельных моделей, например:
+    # {"openai/gpt-5-mini": {"connect": 3, "read": 30, "total": 40}}
+    OPENROUTER_MODEL_TIMEOUTS: Dict[str, Dict[str, float]] = {}
+    # Адрес API (например, локальный сервер воспроизведения benchmarks/replay.py)
+    OPENROUTER_BASE_URL: str = "https://openrouter.ai/api/v1"
+
+    # Запись трафика к OpenRouter для офлайн-бенчмарков (файл .jsonl или .jsonl.gz)
+    HTTP_RECORD_FILE: Optional[str] = None
+    # Тексты запросов и ответов модели в записи заменяются их длиной
+    HTTP_RECORD_REDACT: bool = True
+    # Ответы из записи вместо сети; задержки умножаются на HTTP_REPLAY_SPEED (0 - без задержек)
+    HTTP_REPLAY_FILE: Optional[str] = None
+    HTTP_REPLAY_SPEED: float = 1.0
+
+    # Маршрутизация запросов по уровням моделей (light/standard/heavy).
+    # Цепочки уровней, например: {"light": ["model-a"], "heavy": ["model-b", "model-c"]};
+    # уровень без цепочки использует OPENROUTER_MODEL и OPENROUTER_FALLBACK_MODELS
+    MODEL_TIERS: Dict[str, List[str]] = {}
+    # Лимит ответа уровня; действует только для уровней с настроенной цепочкой
+    MODEL_TIER_MAX_TOKENS: Dict[str, int] = {"light": 300, "standard": 600, "heavy": 1200}
+    ROUTER_LIGHT_MAX_CHARS: int = 60
+    ROUTER_HEAVY_MIN_CHARS: int = 1500
+    ROUTER_HEAVY_CONTEXT_TOKENS: int = 3000
+    ROUTER_DEEP_HISTORY: int = 12  # Сообщений истории, после которых короткий вопрос не считается простым
+    ROUTER_LOG_FILE: str = "logs/routing.jsonl"  # Журнал решений для настройки порогов ("" - отключен)
+
+    # Политика повторов по цепочке моделей
+    REQUEST_DEADLINE: float = 120.0  # Общий бюджет времени на один запрос пользователя
+    RETRY_MAX_ATTEMPTS: int = 2  # Попыток на одну модель при временных сбоях
+    RETRY_BACKOFF_BASE: float = 0.5
+    RETRY_BACKOFF_MAX: float = 8.0
+    RETRY_MIN_ATTEMPT_TIMEOUT: float = 3.0
+
+    # Администраторы (ID пользователей Telegram), например: ADMIN_IDS=[123456789]
+    ADMIN_IDS: List[int] = []
+
+    # Периодический замер задержки моделей
+    PROBE_INTERVAL: int = 1800  # Секунды между замерами (0 - отключено)
+    PROBE_TIMEOUT: float = 20.0
+    PROBE_RETENTION_HOURS: int = 168
+
+    # Полнотекстовый поиск по истории (/search)
+    SEARCH_PAGE_SIZE: int = 5
+    SEARCH_CANDIDATE_LIMIT: int = 500  # Максимум совпадений, которые ранжируются
+    SEARCH_MAX_TERMS: int = 8
+
+    # Компактное хранение истории: сжатие длинных сообщений
+    HISTORY_COMPRESSION: str = "zstd"  # 'zstd' (если установлен zstandard) или 'zlib'
+    HISTORY_COMPRESS_THRESHOLD: int = 512  # Байт, начиная с которых текст сжимается
+
+    # Фоновое удаление сообщений прошлых эпох диалога (после /new и /start)
+    HISTORY_RECLAIM_INTERVAL: int = 600  # Секунды между запусками (0 - отключено)
+    HISTORY_RECLAIM_BATCH: int = 1000  # Строк за одну транзакцию
+
+    # Ветки диалогов (/threads): сколько указателей на активную ветку держать в памяти
+    THREAD_CACHE_SIZE: int = 10000
+
+    # Долговременная память: релевантные старые сообщения в контексте (нужен NumPy)
+    MEMORY_ENABLED: bool = True
+    MEMORY_TOP_K: int = 3
+    MEMORY_MIN_SCORE: float = 0.2  # Минимальная косинусная близость
+    MEMORY_DIM: int = 512  # Размерность хешированных векторов
+    MEMORY_MAX_ITEMS: int = 1000  # Векторов на пользователя
+    MEMORY_CACHE_USERS: int = 64  # Индексов в памяти, остальные на диске
+    MEMORY_SNIPPET_CHARS: int = 500
+    MEMORY_DIR: str = "data/memory"
+
+    # Защита от повторной обработки обновлений после перезапуска
+    IDEMPOTENCY_TTL: int = 86400  # Секунды хранения ключей (Telegram хранит обновления сутки)
+    IDEMPOTENCY_CACHE_SIZE: int = 10000  # Ключей в памяти
+    # Через сколько секунд незавершенная обработка (сбой или перезапуск посреди
+    # обработчика) считается брошенной и повторная доставка обрабатывается снова
+    IDEMPOTENCY_CLAIM_TIMEOUT: int = 300
+
+    # Inline-режим (@bot вопрос)
+    INLINE_DEBOUNCE: float = 0.8  # Пауза в наборе перед вызовом модели, секунды
+    INLINE_TIMEOUT: float = 8.0  # Сколько ждать ответа модели до ответа Telegram
+    INLINE_MIN_QUERY_LENGTH: int = 3
+    INLINE_MAX_TOKENS: int = 400
+    INLINE_CACHE_SIZE: int = 500
+    INLINE_CACHE_TTL: int = 300  # Секунды жизни ответа в кэше бота
+    INLINE_CACHE_TIME: int = 300  # cache_time для Telegram
+
+    # Документы как контекст диалога
+    ATTACHMENT_EXTENSIONS: List[str] = [".txt", ".md", ".py", ".csv", ".json", ".log"]
+    ATTACHMENT_MAX_FILE_SIZE: int = 20_971_520  # Предел getFile Bot API (20 МБ), проверяется до скачивания
+    ATTACHMENT_MAX_BYTES: int = 1_048_576  # Сколько байт файла читать, остальное не скачивается
+    ATTACHMENT_MAX_TOKENS: int = 4000  # Бюджет текста документа в запросе к модели
+    ATTACHMENT_CHUNK_SIZE: int = 65536  # Размер части при потоковом скачивании
+    ATTACHMENT_DOWNLOAD_TIMEOUT: int = 30
+    ATTACHMENT_CACHE_DAYS: int = 7  # Хранение текста файлов, на которые не ссылается история
+
+    # Трассировка обработки обновлений (спаны в формате OTLP/JSON)
+    TRACING_ENABLED: bool = True
+    TRACE_SLOW_MS: float = 3000.0  # Трассы медленнее порога сохраняются всегда
+    TRACE_SAMPLE_RATE: float = 0.01  # Доля остальных успешных трасс
+    TRACE_FILE: str = "logs/traces.jsonl"  # Пачки OTLP/JSON построчно ("" - не писать)
+    TRACE_COLLECTOR_URL: Optional[str] = None  # Например, http://localhost:4318/v1/traces
+    TRACE_EXPORT_INTERVAL: float = 5.0
+    TRACE_BATCH_SIZE: int = 50  # Трасс в одной пачке
+    TRACE_QUEUE_SIZE: int = 1000  # Трасс в очереди на выгрузку, старые вытесняются
+    TRACE_MAX_SPANS: int = 256  # Спанов в одной трассе
+
+    # Нагрузка event loop и сброс нагрузки при перегрузке
+    USE_UVLOOP: bool = False  # Запускать основной цикл на uvloop (нужен пакет uvloop)
+    LOOP_LAG_INTERVAL: float = 0.25  # Секунды между замерами задержки event loop
+    LOOP_LAG_WINDOW: int = 1200  # Замеров для перцентилей (5 минут при 0.25 с)
+    LOAD_SHED_LAG_MS: float = 500.0  # Порог сглаженной задержки, мс (0 - не учитывать)
+    LOAD_SHED_MAX_IN_FLIGHT: int = 200  # Порог обновлений в обработке (0 - не учитывать)
+    LOAD_DEFER_TIMEOUT: float = 10.0  # Сколько откладывать кнопки и inline-запросы
+    LOAD_SHED_NOTICE_COOLDOWN: float = 30.0  # Пауза между уведомлениями «занято» в одном чате
+
+    # Снимки состояния в памяти для быстрого прогрева после перезапуска
+    SNAPSHOT_ENABLED: bool = True
+    SNAPSHOT_FILE: str = "data/snapshot.json.gz"
+    SNAPSHOT_INTERVAL: int = 60  # Секунды между периодическими снимками (0 - только при остановке)
+    SNAPSHOT_MAX_AGE: int = 900  # Снимок старше этого возраста при запуске игнорируется
+
+    # Перезагрузка настроек без перезапуска (также по SIGHUP)
+    SETTINGS_WATCH_INTERVAL: float = 5.0  # Проверка изменения .env, секунды (0 - только SIGHUP)
+
+    # Выгрузка истории (/export)
+    EXPORT_CHUNK_SIZE: int = 1000
+
+    # Статистика: агрегаты старше срока удаляются фоновой задачей раз в час
+    # (не меньше 7 дней - столько показывает сводка /stats)
+    STATS_RETENTION_DAYS: int = 30
+
+    # Служебный HTTP-сервер (JSON-статистика), 0 - отключен
+    WEB_HOST: str = "127.0.0.1"
+    WEB_PORT: int = 0
+    WEB_AUTH_TOKEN: Optional[str] = None
     """
     @field_validator("OPENROUTER_FALLBACK_MODELS")
     @classmethod
@@ -46,6 +218,17 @@ class Settings(BaseSettings):
 
         return []
 
+    @field_validator("ADMIN_IDS", mode="before")
+    @classmethod
+    def parse_admin_ids(cls, v):
+        if isinstance(v, (list, int)):
+            return v if isinstance(v, list) else [v]
+
+        if isinstance(v, str):
+            return [int(item.strip()) for item in v.split(",") if item.strip()]
+
+        return []
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
@@ -53,7 +236,119 @@ class Settings(BaseSettings):
     )
 
 
+# Настройки, которые используются только при запуске: новое значение
+# вступает в силу после перезапуска, до него остается текущее.
+# Сюда же входят интервалы фоновых задач (планировщик читает их при старте),
+# включение трассировки (задача выгрузки добавляется только при запуске)
+# и размеры очередей, созданных при импорте
+RESTART_REQUIRED = {
+    "BOT_TOKEN", "BOTS_CONFIG", "OPENROUTER_API_KEY", "USE_UVLOOP",
+    "MEMORY_DIR", "SNAPSHOT_FILE", "HTTP2_ENABLED", "HTTP_MAX_CONNECTIONS",
+    "HTTP_MAX_KEEPALIVE_CONNECTIONS", "HTTP_KEEPALIVE_EXPIRY",
+    "OPENROUTER_BASE_URL", "HTTP_RECORD_FILE", "HTTP_RECORD_REDACT", "HTTP_REPLAY_FILE", "HTTP_REPLAY_SPEED",
+    "PROBE_INTERVAL", "HISTORY_RECLAIM_INTERVAL", "LIMIT_ROLLOVER_INTERVAL", "SNAPSHOT_ENABLED",
+    "SNAPSHOT_INTERVAL", "TRACE_EXPORT_INTERVAL", "SETTINGS_WATCH_INTERVAL",
+    "TRACING_ENABLED", "TRACE_QUEUE_SIZE", "LOOP_LAG_INTERVAL", "LOOP_LAG_WINDOW",
+}
+
+SettingsCallback = Callable[[Settings, Settings, Set[str]], Any]
+
+
+class SettingsProxy:
+    """
+    Перезагружаемые настройки. Модули импортируют один объект settings,
+    а он обращается к текущему экземпляру Settings, поэтому новые значения
+    видны везде без повторного импорта.
+
+    reload() читает окружение и .env заново и проверяет их целиком: при
+    ошибке валидации остаются прежние настройки. Новый экземпляр подменяется
+    одним присваиванием, запросы в обработке дочитывают значения уже из него
+    и не прерываются. Затем вызываются подписчики изменившихся полей - для
+    значений, вычисленных один раз (цепочка моделей, кэш лимитов).
+    """
+
+    def __init__(self, factory: Callable[[], Settings], env_file: str = ".env") -> None:
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_current", factory())
+        object.__setattr__(self, "_subscribers", [])
+        object.__setattr__(self, "_env_file", Path(env_file))
+        object.__setattr__(self, "_env_mtime", self._read_mtime())
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._current, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._current, name, value)
+
+    def __delattr__(self, name: str) -> None:
+        # Нужен patch.object в тестах: он удаляет атрибут и затем восстанавливает его
+        delattr(self._current, name)
+
+    @property
+    def current(self) -> Settings:
+        return self._current
+
+    def subscribe(self, callback: SettingsCallback, fields: Optional[Iterable[str]] = None) -> None:
+        """
+        Регистрирует callback(old, new, changed), вызываемый после перезагрузки,
+        если изменилось хотя бы одно из полей fields (None - любое поле).
+        """
+        self._subscribers.append((callback, set(fields) if fields is not None else None))
+
+    def reload(self) -> Optional[Set[str]]:
+        """
+        Перечитывает настройки.
+
+        Returns:
+            Имена изменившихся полей или None, если новые настройки не прошли проверку
+        """
+        try:
+            new = self._factory()
+        except (ValidationError, ValueError) as e:
+            logger.error(f"❌ Новые настройки не применены, остаются прежние: {e}")
+            return None
+
+        old = self._current
+        changed = {name for name in type(old).model_fields if getattr(old, name) != getattr(new, name)}
+
+        pinned = changed & RESTART_REQUIRED
+        if pinned:
+            logger.warning(f"⚠️ Изменения {sorted(pinned)} вступят в силу после перезапуска")
+            new = new.model_copy(update={name: getattr(old, name) for name in pinned})
+            changed -= pinned
+
+        if not changed:
+            logger.info("🔧 Настройки перечитаны, изменений нет")
+            return changed
+
+        object.__setattr__(self, "_current", new)
+        logger.info(f"🔧 Настройки перезагружены: {sorted(changed)}")
+
+        for callback, fields in self._subscribers:
+            if fields is not None and not fields & changed:
+                continue
+            try:
+                callback(old, new, changed)
+            except Exception:
+                logger.exception(f"Ошибка подписчика настроек {getattr(callback, '__qualname__', callback)}")
+        return changed
+
+    def _read_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self._env_file).st_mtime
+        except OSError:
+            return None
+
+    def reload_if_changed(self) -> Optional[Set[str]]:
+        """Перезагружает настройки, если .env изменился с прошлой проверки."""
+        mtime = self._read_mtime()
+        if mtime == self._env_mtime:
+            return None
+        object.__setattr__(self, "_env_mtime", mtime)
+        return self.reload()
+
+
 # Глобальный объект настроек
-settings = Settings()
+settings = SettingsProxy(Settings)
 print(f"✅ Основная модель: {settings.OPENROUTER_MODEL}")
 print(f"✅ Всего моделей в цепочке: {[settings.OPENROUTER_MODEL] + settings.OPENROUTER_FALLBACK_MODELS}")
\ No newline at end of file
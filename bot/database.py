@@ -6,7 +6,8 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 from sqlalchemy import text
-from bot.models import Base
+from bot.models import Base, DIALOG_HISTORY_FTS_DDL
+from bot.migrations import run_migrations
 
 # Создаем асинхронный движок для SQLite
 # Используем aiosqlite в качестве асинхронного драйвера
@@ -41,11 +42,30 @@ async def init_db() -> None:
     async with engine.begin() as conn:
         # Создаем все таблицы, определенные в моделях
         await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+        await ensure_search_index(conn)
         # Проверяем соединение
         await conn.execute(text("SELECT 1"))
     print("✅ База данных успешно инициализирована")
 
 
+async def ensure_search_index(conn) -> None:
+    """
+    Создает полнотекстовый индекс для базы, созданной до его появления,
+    и заполняет его существующими сообщениями.
+    """
+    result = await conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dialog_history_fts'")
+    )
+    if result.scalar() is not None:
+        return
+
+    for statement in DIALOG_HISTORY_FTS_DDL:
+        await conn.execute(text(statement))
+    await conn.execute(text("INSERT INTO dialog_history_fts(dialog_history_fts) VALUES ('rebuild')"))
+    print("✅ Полнотекстовый индекс истории построен")
+
+
 async def close_db() -> None:
     """Корректное закрытие соединений с БД при завершении работы."""
     await engine.dispose()
@@ -0,0 +1,74 @@
+from typing import Optional, Union
+from aiogram import Bot
+from aiogram.filters import BaseFilter
+from aiogram.types import Chat, Message, CallbackQuery, User
+from bot.config import settings
+
+GROUP_CHAT_TYPES = ("group", "supergroup")
+
+
+class IsAdmin(BaseFilter):
+    """Пропускает только пользователей из ADMIN_IDS."""
+
+    async def __call__(self, event: Union[Message, CallbackQuery]) -> bool:
+        return event.from_user is not None and event.from_user.id in settings.ADMIN_IDS
+
+
+def is_group_chat(chat: Optional[Chat]) -> bool:
+    return chat is not None and chat.type in GROUP_CHAT_TYPES
+
+
+def dialog_owner(chat: Optional[Chat], user: User) -> int:
+    """
+    Владелец истории и лимитов: в группах - сам чат (общий контекст
+    для всех участников, ID группы отрицательный и не пересекается с ID
+    пользователей), в личных чатах - пользователь.
+    """
+    return chat.id if is_group_chat(chat) else user.id
+
+
+def strip_bot_mention(text: str, username: Optional[str]) -> str:
+    """Убирает упоминание @бота из текста вопроса в группе."""
+    if not username:
+        return text.strip()
+    mention = f"@{username}".casefold()
+    words = [word for word in text.split(" ") if word.casefold().rstrip(",:") != mention]
+    return " ".join(words).strip()
+
+
+class AddressedToBot(BaseFilter):
+    """
+    Пропускает личные сообщения и сообщения группы, обращенные к боту:
+    команды (без @ или с @ этого бота), ответы на сообщения бота и упоминания.
+    Проверки идут от дешевых к дорогим: большинство сообщений группы
+    отсекается без обращения к сети и БД. Имя бота берется из bot.me(),
+    который aiogram кэширует после первого вызова.
+    """
+
+    async def __call__(self, message: Message, bot: Bot) -> bool:
+        if not is_group_chat(message.chat):
+            return True
+        if not settings.GROUPS_ENABLED:
+            return False
+
+        reply = message.reply_to_message
+        if reply is not None and reply.from_user is not None and reply.from_user.id == bot.id:
+            return True
+
+        # Документ с подписью адресуется боту так же, как текст
+        text = message.text or message.caption or ""
+        entities = message.entities or message.caption_entities
+        if text.startswith("/"):
+            _, _, target = text.split(maxsplit=1)[0].partition("@")
+            return not target or target.casefold() == (await bot.me()).username.casefold()
+
+        if "@" not in text and not entities:
+            return False
+
+        username = (await bot.me()).username.casefold()
+        for entity in entities or []:
+            if entity.type == "mention" and entity.extract_from(text)[1:].casefold() == username:
+                return True
+            if entity.type == "text_mention" and entity.user is not None and entity.user.id == bot.id:
+                return True
+        return False
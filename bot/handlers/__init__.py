@@ -1,3 +1,3 @@
-from . import commands, messages, buttons
+from . import admin, commands, messages, buttons, search, threads, inline, documents
 
-__all__ = ["commands", "messages", "buttons"]
+__all__ = ["admin", "commands", "messages", "buttons", "search", "threads", "inline", "documents"]
@@ -0,0 +1,145 @@
+import html
+from typing import Optional
+from aiogram import Router, types
+from aiogram.filters import Command, CommandObject
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.filters import IsAdmin
+from bot.middlewares.throttling import ThrottlingMiddleware
+from bot.profiles import BotProfile, get_default_profile
+from bot.services.limits import UsageService, format_reset_time
+from bot.services.probe import ModelProbeService, probe_service
+from bot.services.stats import StatsService
+from bot.services.load import load_monitor
+from bot.services import profiling
+
+router = Router()
+# Все команды этого роутера доступны только администраторам
+router.message.filter(IsAdmin())
+
+
+@router.message(Command("models"))
+async def cmd_models(message: types.Message, session: AsyncSession) -> None:
+    """Сравнительная таблица моделей по сохраненным замерам."""
+    summary = await ModelProbeService.get_summary(session)
+
+    if not summary:
+        await message.answer("📭 Замеров пока нет. Запустите /probe")
+        return
+
+    table = probe_service.format_table(summary)
+    await message.answer(f"<pre>{html.escape(table)}</pre>", parse_mode="HTML")
+
+
+@router.message(Command("probe"))
+async def cmd_probe(message: types.Message, session: AsyncSession) -> None:
+    """Немедленный параллельный замер всех моделей цепочки."""
+    await message.answer("🧪 Замеряю модели...")
+
+    results = await probe_service.probe_all()
+    await ModelProbeService.save_results(session, results)
+
+    lines = []
+    for result in results:
+        if result["success"]:
+            lines.append(f"✅ {result['model']}: {result['total_ms']:.0f} мс")
+        else:
+            lines.append(f"❌ {result['model']}: {result['error'][:80]}")
+
+    summary = await ModelProbeService.get_summary(session)
+    table = probe_service.format_table(summary)
+    await message.answer(
+        html.escape("\n".join(lines)) + f"\n\n<pre>{html.escape(table)}</pre>",
+        parse_mode="HTML",
+    )
+
+
+@router.message(Command("stats"))
+async def cmd_stats(
+        message: types.Message,
+        session: AsyncSession,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    """Сводка статистики использования бота из агрегатов."""
+    profile = profile or get_default_profile()
+    dashboard = await StatsService.get_dashboard(session, bot_id=profile.bot_id)
+    text = f"{StatsService.format_dashboard(dashboard)}\n\n{load_monitor.format()}"
+    await message.answer(f"<pre>{html.escape(text)}</pre>", parse_mode="HTML")
+
+
+def _parse_duration(command: CommandObject, default: float = 10.0) -> float:
+    """Длительность замера из аргумента команды (от 1 до 60 секунд)."""
+    try:
+        value = float(command.args) if command.args else default
+    except ValueError:
+        value = default
+    return min(max(value, 1.0), 60.0)
+
+
+@router.message(Command("profile"))
+async def cmd_profile(message: types.Message, command: CommandObject) -> None:
+    """Сэмплирующий CPU-профиль event loop: /profile [секунды]."""
+    if profiling.is_busy():
+        await message.answer("⏳ Уже выполняется другой замер")
+        return
+
+    duration = _parse_duration(command)
+    await message.answer(f"🔬 Снимаю CPU-профиль {duration:.0f} с...")
+    path = await profiling.profile_cpu(duration)
+    await message.answer_document(types.FSInputFile(path), caption="CPU-профиль event loop")
+
+
+@router.message(Command("memtop"))
+async def cmd_memtop(message: types.Message, command: CommandObject) -> None:
+    """Топ аллокаций памяти через tracemalloc: /memtop [секунды]."""
+    if profiling.is_busy():
+        await message.answer("⏳ Уже выполняется другой замер")
+        return
+
+    duration = _parse_duration(command)
+    await message.answer(f"🔬 Отслеживаю аллокации {duration:.0f} с...")
+    path = await profiling.profile_memory(duration)
+    await message.answer_document(types.FSInputFile(path), caption="Топ аллокаций (tracemalloc)")
+
+
+@router.message(Command("memsizes"))
+async def cmd_memsizes(message: types.Message) -> None:
+    """Размеры кэшей и других структур в памяти процесса."""
+    report = profiling.format_structure_sizes(profiling.structure_sizes())
+    await message.answer(f"<pre>{html.escape(report)}</pre>", parse_mode="HTML")
+
+
+@router.message(Command("limit"))
+async def cmd_limit(
+        message: types.Message,
+        command: CommandObject,
+        session: AsyncSession,
+        profile: Optional[BotProfile] = None,
+        throttling: Optional[ThrottlingMiddleware] = None,
+) -> None:
+    """Дневной лимит пользователя или чата: /limit <id> [число|reset]."""
+    profile = profile or get_default_profile()
+    args = (command.args or "").split()
+    try:
+        user_id = int(args[0])
+        limit = None if len(args) < 2 or args[1] == "reset" else int(args[1])
+    except (IndexError, ValueError):
+        await message.answer("Использование: /limit <id> [число|reset]")
+        return
+    if limit is not None and limit < 0:
+        await message.answer("Лимит не может быть отрицательным")
+        return
+
+    if len(args) > 1:
+        await UsageService.set_override(session, user_id, limit, bot_id=profile.bot_id)
+        if throttling is not None:
+            throttling.forget(user_id, bot_id=profile.bot_id)
+
+    usage = await UsageService.get(session, user_id, bot_id=profile.bot_id)
+    # Отрицательные ID - групповые чаты
+    default = profile.group_daily_limit if user_id < 0 else profile.daily_limit
+    if usage.limit_override is not None:
+        limit_text = f"{usage.limit_override} (индивидуальный, по умолчанию {default})"
+    else:
+        limit_text = f"{default}"
+    reset_text = f", сброс в {format_reset_time(usage.reset_at)}" if usage.reset_at else ""
+    await message.answer(f"📊 {user_id}: использовано {usage.count}, лимит {limit_text}{reset_text}")
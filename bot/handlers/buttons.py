@@ -1,4 +1,5 @@
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from typing import Optional
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
 # Основная reply-клавиатура бота.
 def get_main_reply_keyboard() -> ReplyKeyboardMarkup:
@@ -11,3 +12,27 @@ def get_main_reply_keyboard() -> ReplyKeyboardMarkup:
         one_time_keyboard=False,
         input_field_placeholder="Напишите сообщение или нажмите кнопку"
     )
+
+
+# Inline-клавиатура для постраничного просмотра результатов поиска.
+def get_search_pagination_keyboard(page: int, has_more: bool) -> Optional[InlineKeyboardMarkup]:
+
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"search:{page - 1}"))
+    if has_more:
+        row.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"search:{page + 1}"))
+
+    return InlineKeyboardMarkup(inline_keyboard=[row]) if row else None
+
+
+# Inline-клавиатура для быстрого переключения между ветками диалога.
+def get_threads_keyboard(threads: list, current: int) -> Optional[InlineKeyboardMarkup]:
+
+    rows = [
+        [InlineKeyboardButton(text=f"💬 {thread.title}", callback_data=f"thread:{thread.conversation_id}")]
+        for thread in threads
+        if thread.conversation_id != current
+    ]
+
+    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
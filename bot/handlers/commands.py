@@ -1,23 +1,34 @@
+import logging
+from typing import Optional
 from aiogram import Router, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from sqlalchemy.ext.asyncio import AsyncSession
-from bot.services.history import HistoryService
+from bot.profiles import BotProfile, get_default_profile
+from bot.services.conversations import ConversationService
+from bot.services.export import HistoryExporter, EXPORT_FORMATS
 from bot.handlers.buttons import get_main_reply_keyboard
+from bot.filters import dialog_owner, is_group_chat
 
 router = Router()
+logger = logging.getLogger(__name__)
 
 
 @router.message(Command("start"))
-async def cmd_start(message: types.Message, session: AsyncSession) -> None:
-    user_id = message.from_user.id
-    deleted_count = await HistoryService.clear_user_history(session, user_id)
+async def cmd_start(
+        message: types.Message,
+        session: AsyncSession,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    user_id = dialog_owner(message.chat, message.from_user)
+    await ConversationService.start_new(session, user_id, bot_id=profile.bot_id)
 
     welcome_text = (
         f"👋 Привет, {message.from_user.first_name}!\n\n"
         "Я — интеллектуальный бот с поддержкой ChatGPT через OpenRouter.\n"
         "Просто напиши мне сообщение, и я постараюсь помочь!\n\n"
-        f"✅ История диалога очищена (удалено сообщений: {deleted_count})\n"
-        "Теперь мы начинаем новый разговор."
+        "✅ Контекст диалога сброшен, начинаем новый разговор.\n"
+        "Вернуть предыдущий диалог: /restore"
     )
 
     await message.answer(welcome_text, reply_markup=get_main_reply_keyboard())
@@ -29,7 +40,12 @@ async def cmd_help(message: types.Message) -> None:
         "📚 *Справка по командам бота:*\n\n"
         "*/start* — Начать новый диалог (очищает историю)\n"
         "*/help* — Показать эту справку\n"
-        "*/new* — Начать новый запрос (аналогично кнопке)\n\n"
+        "*/new* — Начать новый запрос (аналогично кнопке)\n"
+        "*/restore* — Вернуть предыдущий диалог после сброса\n"
+        "*/threads* — Ветки диалога, */rename* название — сохранить текущую, "
+        "*/switch* номер — переключиться\n"
+        "*/search* текст — Найти сообщения в истории диалога\n"
+        "*/export* — Выгрузить историю диалога файлом (jsonl или md)\n\n"
         "Нажмите кнопку '🔄 Новый запрос' внизу экрана, "
         "чтобы сбросить контекст нашего разговора.\n\n"
         "*Как использовать:*\n" 
@@ -45,14 +61,77 @@ async def cmd_help(message: types.Message) -> None:
 
 
 @router.message(Command("new"))
-async def cmd_new(message: types.Message, session: AsyncSession) -> None:
-    user_id = message.from_user.id
-    deleted_count = await HistoryService.clear_user_history(session, user_id)
+async def cmd_new(
+        message: types.Message,
+        session: AsyncSession,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    user_id = dialog_owner(message.chat, message.from_user)
+    await ConversationService.start_new(session, user_id, bot_id=profile.bot_id)
 
     response_text = (
         f"🔄 Контекст диалога сброшен.\n"
-        f"Удалено сообщений: {deleted_count}\n\n"
+        "Вернуть предыдущий диалог: /restore\n\n"
         "Можете задать новый вопрос!"
     )
 
-    await message.answer(response_text, reply_markup=get_main_reply_keyboard())
\ No newline at end of file
+    await message.answer(response_text, reply_markup=get_main_reply_keyboard())
+
+
+@router.message(Command("restore"))
+async def cmd_restore(
+        message: types.Message,
+        session: AsyncSession,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    owner_id = dialog_owner(message.chat, message.from_user)
+    restored = await ConversationService.restore(session, owner_id, bot_id=profile.bot_id)
+
+    if restored is None:
+        await message.answer("🤷 Нет предыдущего диалога для восстановления.")
+        return
+
+    await message.answer(
+        "↩️ Предыдущий диалог восстановлен, продолжаем с того же места.\n"
+        "Повторная команда /restore вернет диалог, который был до восстановления.",
+        reply_markup=get_main_reply_keyboard(),
+    )
+
+
+@router.message(Command("export"))
+async def cmd_export(
+        message: types.Message,
+        session: AsyncSession,
+        command: CommandObject,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    # Файл с историей группы ушел бы в общий чат вместе с сообщениями,
+    # написанными до вступления участника
+    if is_group_chat(message.chat):
+        await message.answer("🔒 Выгрузка истории доступна только в личном чате с ботом.")
+        return
+
+    fmt = (command.args or "jsonl").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        await message.answer(f"Использование: /export [{'|'.join(EXPORT_FORMATS)}]")
+        return
+
+    user_id = message.from_user.id
+    await message.bot.send_chat_action(chat_id=message.chat.id, action="upload_document")
+
+    path, count = await HistoryExporter.export_to_file(session, user_id, fmt, bot_id=profile.bot_id)
+    try:
+        if count == 0:
+            await message.answer("📭 История диалога пуста.")
+            return
+
+        await message.answer_document(
+            types.FSInputFile(path, filename=f"history_{user_id}.{fmt}.gz"),
+            caption=f"📦 Выгружено сообщений: {count}",
+        )
+        logger.info(f"📦 История пользователя {user_id} выгружена ({count} сообщений)")
+    finally:
+        path.unlink(missing_ok=True)
@@ -0,0 +1,59 @@
+import logging
+from typing import Optional
+from aiogram import Router, types, F
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.filters import dialog_owner, is_group_chat
+from bot.profiles import BotProfile, get_default_profile
+from bot.services.attachments import AttachmentService, UnsupportedDocument
+from bot.services.conversations import ConversationService
+from bot.services.history import HistoryService
+from bot.handlers.buttons import get_main_reply_keyboard
+from bot.handlers.messages import answer_message
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+
+@router.message(F.document)
+async def handle_document(
+        message: types.Message,
+        session: AsyncSession,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    """
+    Документ как контекст диалога. С подписью - сразу ответ на вопрос
+    по файлу, без подписи - файл сохраняется в истории до следующего вопроса.
+    """
+    profile = profile or get_default_profile()
+    user_id = dialog_owner(message.chat, message.from_user)
+
+    await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
+    try:
+        attachment, cached = await AttachmentService.get_or_extract(session, message.bot, message.document)
+    except UnsupportedDocument as e:
+        await message.reply(f"📎 {e}")
+        return
+    except Exception:
+        logger.exception(f"Не удалось обработать документ от {user_id}")
+        await message.reply("⚠️ Не удалось прочитать файл. Попробуйте позже.")
+        return
+
+    if cached:
+        logger.debug(f"📎 Текст {attachment.file_name} взят из кэша")
+
+    if message.caption:
+        await answer_message(message, session, profile, message.caption, attachment=attachment)
+        return
+
+    conversation_id = await ConversationService.get_current(session, user_id, bot_id=profile.bot_id)
+    await HistoryService.add_message(
+        session, user_id, "user", "", bot_id=profile.bot_id,
+        conversation_id=conversation_id, attachment_id=attachment.id, author_id=message.from_user.id,
+    )
+
+    note = " Файл большой, прочитано только начало." if attachment.truncated else ""
+    text = f"📎 Файл «{attachment.file_name}» получен.{note} Задайте вопрос по нему."
+    if is_group_chat(message.chat):
+        await message.reply(text)
+    else:
+        await message.answer(text, reply_markup=get_main_reply_keyboard())
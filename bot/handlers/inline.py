@@ -0,0 +1,62 @@
+import hashlib
+import logging
+from typing import Optional
+from aiogram import Router, types
+from bot.config import settings
+from bot.profiles import BotProfile, get_default_profile
+from bot.services.formatting import format_reply
+from bot.services.inline import inline_service, normalize_query
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+
+def build_article(title: str, text: str, query: str) -> types.InlineQueryResultArticle:
+    """Результат inline-запроса: первая часть ответа в Telegram HTML."""
+    return types.InlineQueryResultArticle(
+        id=hashlib.md5(normalize_query(query).encode("utf-8")).hexdigest(),
+        title=title,
+        description=text[:100],
+        input_message_content=types.InputTextMessageContent(
+            message_text=format_reply(text)[0],
+            parse_mode="HTML",
+        ),
+    )
+
+
+@router.inline_query()
+async def handle_inline_query(
+        inline_query: types.InlineQuery,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    query = inline_query.query.strip()
+
+    if len(query) < settings.INLINE_MIN_QUERY_LENGTH:
+        await inline_query.answer([], cache_time=settings.INLINE_CACHE_TIME)
+        return
+
+    answer = inline_service.get_cached(profile.bot_id, query)
+    if answer is None:
+        response = await inline_service.answer(
+            inline_query.from_user.id, query, profile.prompt, profile.model_chain, bot_id=profile.bot_id
+        )
+        if response is None:
+            # Пользователь продолжил печатать: ответ на этот запрос уже не нужен
+            return
+
+        if not response["success"]:
+            text = (
+                "⏳ Ответ еще готовится, повторите запрос через пару секунд."
+                if response.get("pending") else response.get("content") or "❌ Не удалось получить ответ."
+            )
+            await inline_query.answer([build_article("Ответ не готов", text, query)], cache_time=0, is_personal=True)
+            return
+
+        # Вопрос и ответ уже учтены в истории и статистике (InlineAnswerService._record)
+        answer = response["content"]
+
+    await inline_query.answer(
+        [build_article(query[:64], answer, query)],
+        cache_time=settings.INLINE_CACHE_TIME,
+    )
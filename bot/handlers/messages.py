@@ -1,9 +1,21 @@
+from typing import Optional
 from aiogram import Router, types, F
 from sqlalchemy.ext.asyncio import AsyncSession
+from bot.models import Attachment
+from bot.profiles import BotProfile, get_default_profile
+from bot.services.attachments import render_attachment
 from bot.services.history import HistoryService
+from bot.services.conversations import ConversationService
+from bot.services.memory import memory_service
 from bot.services.openrouter import openrouter_service
+from bot.services.routing import model_router
+from bot.services.tracing import tracer
+from bot.services.stats import StatsService
+from bot.services.formatting import format_reply
 from bot.handlers.buttons import get_main_reply_keyboard
+from bot.filters import dialog_owner, is_group_chat, strip_bot_mention
 import logging
+import time
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -12,17 +24,19 @@ logger = logging.getLogger(__name__)
 async def handle_new_request(
     message: types.Message,
     session: AsyncSession,
+    profile: Optional[BotProfile] = None,
 ):
 
     # Обработка кнопки 'Новый запрос'.
 
-    user_id = message.from_user.id
+    profile = profile or get_default_profile()
+    user_id = dialog_owner(message.chat, message.from_user)
 
-    deleted_count = await HistoryService.clear_user_history(session, user_id)
+    await ConversationService.start_new(session, user_id, bot_id=profile.bot_id)
 
     await message.answer(
         f"✅ Контекст диалога сброшен.\n"
-        f"Удалено сообщений: {deleted_count}\n\n"
+        "Вернуть предыдущий диалог: /restore\n\n"
         "Можешь задать новый вопрос 🙂",
         reply_markup=get_main_reply_keyboard()
     )
@@ -31,12 +45,37 @@ async def handle_new_request(
 async def handle_text_message(
         message: types.Message,
         session: AsyncSession,
+        profile: Optional[BotProfile] = None,
 ) -> None:
 
     # Обрабатывает все текстовые сообщения пользователя
 
-    user_id = message.from_user.id
-    user_message = message.text
+    await answer_message(message, session, profile or get_default_profile(), message.text)
+
+
+async def answer_message(
+        message: types.Message,
+        session: AsyncSession,
+        profile: BotProfile,
+        user_message: str,
+        attachment: Optional[Attachment] = None,
+) -> None:
+    """
+    Отвечает на сообщение через модель и сохраняет обмен в истории.
+    attachment - документ, приложенный к этому сообщению: его текст
+    подставляется в запрос целиком, а в истории остается ссылка на него.
+    """
+    # В группе контекст общий: история и лимит принадлежат чату
+    group = is_group_chat(message.chat)
+    user_id = dialog_owner(message.chat, message.from_user)
+    window_limit = profile.window_limit
+
+    if group:
+        user_message = strip_bot_mention(user_message, (await message.bot.me()).username)
+        if not user_message and attachment is None:
+            await message.reply("Задайте вопрос после упоминания 🙂")
+            return
+        window_limit = profile.group_window_limit
 
     logger.info(f"Новое сообщение от {user_id}: {user_message[:50]}...")
 
@@ -44,24 +83,48 @@ async def handle_text_message(
     await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
 
     try:
-        # 1. Получаем историю диалога
-        history = await HistoryService.get_recent_history(session, user_id)
+        # 1. Получаем историю текущей эпохи диалога
+        conversation_id = await ConversationService.get_current(session, user_id, bot_id=profile.bot_id)
+        history = await HistoryService.get_recent_history(
+            session, user_id, limit=window_limit, bot_id=profile.bot_id,
+            conversation_id=conversation_id, expand_attachments=attachment is None,
+        )
         logger.debug(f"История для {user_id}: {len(history)} сообщений")
 
-        # 2. Сохраняем сообщение пользователя в историю
+        # Релевантные сообщения старше окна контекста
+        memories = await memory_service.recall(
+            session, user_id, user_message, bot_id=profile.bot_id, exclude=history
+        )
+
+        # Уровень модели по длине, коду, письменности и глубине истории
+        # (текст приложенного документа учитывается как часть запроса)
+        route = model_router.route(
+            profile,
+            user_message if attachment is None else f"{user_message}\n{attachment.text}",
+            history,
+        )
+
+        # В общем контексте группы модель должна видеть, кто задал вопрос
+        if group:
+            user_message = f"{message.from_user.full_name}: {user_message}"
+
+        # 2. Сохраняем сообщение пользователя в историю (документ - ссылкой)
         await HistoryService.add_message(
-            session, user_id, "user", user_message
+            session, user_id, "user", user_message, bot_id=profile.bot_id,
+            conversation_id=conversation_id,
+            attachment_id=attachment.id if attachment is not None else None,
+            author_id=message.from_user.id,
         )
+        prompt_message = user_message
+        if attachment is not None:
+            prompt_message = render_attachment(user_message, attachment.file_name, attachment.text, attachment.truncated)
 
         # 3. Форматируем сообщения для API (теперь метод существует!)
         formatted_messages = openrouter_service.format_messages_from_history(
             history=history,
-            user_message=user_message,
-            system_prompt=(
-                "Ты полезный, вежливый и информативный ассистент. "
-                "Отвечай на русском языке. Будь краток, но содержателен. "
-                "Учитывай контекст предыдущих сообщений."
-            )
+            user_message=prompt_message,
+            system_prompt=profile.prompt,
+            memories=memories,
         )
 
         # Логируем, что отправляем в API (для отладки)
@@ -71,12 +134,16 @@ async def handle_text_message(
             content_preview = msg["content"][:50] + "..." if len(msg["content"]) > 50 else msg["content"]
             logger.debug(f"  {role}: {content_preview}")
 
-        # 4. Получаем ответ от OpenRouter
+        # 4. Получаем ответ от OpenRouter (цепочка моделей выбранного уровня)
+        started = time.perf_counter()
         response = await openrouter_service.chat_completion(
             messages=formatted_messages,
-            max_tokens=600,
+            max_tokens=route.max_tokens,
             temperature=0.8,
+            models=route.models,
         )
+        model_router.record(route, response, time.perf_counter() - started, bot_id=profile.bot_id)
+        await StatsService.record_completion(session, response, bot_id=profile.bot_id)
 
         # 5. Обрабатываем ответ
         if response["success"]:
@@ -84,19 +151,27 @@ async def handle_text_message(
 
             # Сохраняем ответ ассистента в историю
             await HistoryService.add_message(
-                session, user_id, "assistant", bot_response
+                session, user_id, "assistant", bot_response, bot_id=profile.bot_id,
+                conversation_id=conversation_id,
             )
 
             # Добавляем информацию о модели, если использовалась резервная
             if response.get("fallback_used"):
-                bot_response += f"\n\n🔁 *Примечание:* использована резервная модель ({response['model_used']})"
-
-            # Отправляем ответ пользователю
-            await message.answer(
-                bot_response,
-                parse_mode="Markdown" if response.get("fallback_used") else None,
-                reply_markup=get_main_reply_keyboard()
-            )
+                bot_response += f"\n\n🔁 **Примечание:** использована резервная модель (`{response['model_used']}`)"
+
+            # Отправляем ответ пользователю: Markdown модели -> HTML, части по 4096 символов
+            # В группе отвечаем ответом на вопрос и без клавиатуры (она видна всем участникам)
+            chunks = format_reply(bot_response)
+            with tracer.span("telegram.send", chunks=len(chunks)):
+                for number, chunk in enumerate(chunks, start=1):
+                    if group:
+                        await message.reply(chunk, parse_mode="HTML")
+                        continue
+                    await message.answer(
+                        chunk,
+                        parse_mode="HTML",
+                        reply_markup=get_main_reply_keyboard() if number == len(chunks) else None,
+                    )
 
             logger.info(f"✅ Ответ пользователю {user_id} от модели {response['model_used']}")
 
@@ -0,0 +1,96 @@
+import html
+from typing import Optional
+from aiogram import Router, types, F
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.profiles import BotProfile, get_default_profile
+from bot.services.search import SearchService, HIGHLIGHT_START, HIGHLIGHT_END
+from bot.handlers.buttons import get_search_pagination_keyboard
+from bot.filters import is_group_chat
+
+router = Router()
+
+
+def format_search_results(query: str, results: list, page: int) -> str:
+    """Форматирует страницу результатов поиска в HTML."""
+    lines = [f"🔎 Результаты по запросу «{html.escape(query)}» (стр. {page + 1}):\n"]
+
+    for number, result in enumerate(results, start=page * settings.SEARCH_PAGE_SIZE + 1):
+        icon = "👤" if result.role == "user" else "🤖"
+        date = result.timestamp.strftime("%d.%m.%Y %H:%M") if result.timestamp else ""
+        snippet = (
+            html.escape(result.snippet)
+            .replace(HIGHLIGHT_START, "<b>")
+            .replace(HIGHLIGHT_END, "</b>")
+        )
+        lines.append(f"{number}. {icon} <i>{date}</i>\n{snippet}\n")
+
+    return "\n".join(lines)
+
+
+@router.message(Command("search"))
+async def cmd_search(
+        message: types.Message,
+        session: AsyncSession,
+        state: FSMContext,
+        command: CommandObject,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    # История группы общая: поиск открыл бы участникам сообщения,
+    # написанные до их вступления в чат
+    if is_group_chat(message.chat):
+        await message.answer("🔒 Поиск по истории доступен только в личном чате с ботом.")
+        return
+
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Использование: /search <i>текст</i>", parse_mode="HTML")
+        return
+
+    results, has_more = await SearchService.search(session, message.from_user.id, query, bot_id=profile.bot_id)
+    if not results:
+        await message.answer(f"🔎 По запросу «{html.escape(query)}» ничего не найдено.", parse_mode="HTML")
+        return
+
+    # Запрос сохраняем в FSM: в callback_data он может не поместиться
+    await state.update_data(search_query=query)
+
+    await message.answer(
+        format_search_results(query, results, page=0),
+        parse_mode="HTML",
+        reply_markup=get_search_pagination_keyboard(0, has_more),
+    )
+
+
+@router.callback_query(F.data.startswith("search:"))
+async def handle_search_page(
+        callback: types.CallbackQuery,
+        session: AsyncSession,
+        state: FSMContext,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    if is_group_chat(callback.message.chat):
+        await callback.answer("Поиск доступен только в личном чате с ботом", show_alert=True)
+        return
+
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел, повторите /search", show_alert=True)
+        return
+
+    page = int(callback.data.split(":", 1)[1])
+    results, has_more = await SearchService.search(
+        session, callback.from_user.id, query, page=page, bot_id=profile.bot_id
+    )
+
+    if results:
+        await callback.message.edit_text(
+            format_search_results(query, results, page),
+            parse_mode="HTML",
+            reply_markup=get_search_pagination_keyboard(page, has_more),
+        )
+    await callback.answer()
@@ -0,0 +1,130 @@
+import html
+from typing import List, Optional
+from aiogram import Router, types, F
+from aiogram.filters import Command, CommandObject
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.models import ConversationThread
+from bot.profiles import BotProfile, get_default_profile
+from bot.services.conversations import ConversationService
+from bot.handlers.buttons import get_threads_keyboard
+from bot.filters import dialog_owner
+
+router = Router()
+
+
+def format_threads(threads: List[ConversationThread], current: int) -> str:
+    """Форматирует список веток пользователя в HTML."""
+    lines = ["🗂 <b>Ваши ветки диалога:</b>\n"]
+
+    for number, thread in enumerate(threads, start=1):
+        marker = " — <i>текущая</i>" if thread.conversation_id == current else ""
+        lines.append(f"{number}. {html.escape(thread.title)}{marker}")
+
+    if all(thread.conversation_id != current for thread in threads):
+        lines.append("\nТекущий диалог без названия, сохранить его: /rename <i>название</i>")
+
+    lines.append("\nПереключиться: /switch <i>номер или название</i>")
+    return "\n".join(lines)
+
+
+def find_thread(threads: List[ConversationThread], query: str) -> Optional[ConversationThread]:
+    """Ищет ветку по номеру из /threads или по названию (без учета регистра)."""
+    query = query.strip()
+    if query.isdigit() and 1 <= int(query) <= len(threads):
+        return threads[int(query) - 1]
+
+    for thread in threads:
+        if thread.title.casefold() == query.casefold():
+            return thread
+    return None
+
+
+@router.message(Command("threads"))
+async def cmd_threads(
+        message: types.Message,
+        session: AsyncSession,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    user_id = dialog_owner(message.chat, message.from_user)
+
+    threads = await ConversationService.list_threads(session, user_id, bot_id=profile.bot_id)
+    if not threads:
+        await message.answer(
+            "🗂 Веток пока нет. Назовите текущий диалог командой /rename <i>название</i>, "
+            "чтобы вернуться к нему после /new.",
+            parse_mode="HTML",
+        )
+        return
+
+    current = await ConversationService.get_current(session, user_id, bot_id=profile.bot_id)
+    await message.answer(
+        format_threads(threads, current),
+        parse_mode="HTML",
+        reply_markup=get_threads_keyboard(threads, current),
+    )
+
+
+@router.message(Command("rename"))
+async def cmd_rename(
+        message: types.Message,
+        session: AsyncSession,
+        command: CommandObject,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    title = (command.args or "").strip()
+    if not title:
+        await message.answer("Использование: /rename <i>название</i>", parse_mode="HTML")
+        return
+
+    owner_id = dialog_owner(message.chat, message.from_user)
+    await ConversationService.rename(session, owner_id, title, bot_id=profile.bot_id)
+    await message.answer(f"🏷 Текущий диалог сохранен как «{html.escape(title)}».", parse_mode="HTML")
+
+
+@router.message(Command("switch"))
+async def cmd_switch(
+        message: types.Message,
+        session: AsyncSession,
+        command: CommandObject,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    user_id = dialog_owner(message.chat, message.from_user)
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Использование: /switch <i>номер или название</i>", parse_mode="HTML")
+        return
+
+    threads = await ConversationService.list_threads(session, user_id, bot_id=profile.bot_id)
+    thread = find_thread(threads, query)
+    if thread is None:
+        await message.answer("🤷 Ветка не найдена. Список веток: /threads")
+        return
+
+    await ConversationService.switch(session, user_id, thread.conversation_id, bot_id=profile.bot_id)
+    await message.answer(f"💬 Переключено на ветку «{html.escape(thread.title)}».", parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("thread:"))
+async def handle_thread_switch(
+        callback: types.CallbackQuery,
+        session: AsyncSession,
+        profile: Optional[BotProfile] = None,
+) -> None:
+    profile = profile or get_default_profile()
+    conversation_id = int(callback.data.split(":", 1)[1])
+    owner_id = dialog_owner(callback.message.chat, callback.from_user)
+
+    if not await ConversationService.switch(session, owner_id, conversation_id, bot_id=profile.bot_id):
+        await callback.answer("Ветка не найдена", show_alert=True)
+        return
+
+    threads = await ConversationService.list_threads(session, owner_id, bot_id=profile.bot_id)
+    await callback.message.edit_text(
+        format_threads(threads, conversation_id),
+        parse_mode="HTML",
+        reply_markup=get_threads_keyboard(threads, conversation_id),
+    )
+    await callback.answer("Ветка переключена")
@@ -0,0 +1,25 @@
+from typing import Callable, Dict, Any, Awaitable, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from bot.filters import AddressedToBot
+
+
+# Middleware, отбрасывающее сообщения групп, обращенные не к боту.
+# Подключается к dp.update первым: проигнорированное сообщение не открывает
+# сессию БД, не проверяет лимиты и не записывается в хранилище идемпотентности.
+class GroupFilterMiddleware(BaseMiddleware):
+
+    def __init__(self, message_filter: Optional[AddressedToBot] = None) -> None:
+        self.message_filter = message_filter or AddressedToBot()
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update) and event.message is not None:
+            if not await self.message_filter(event.message, data["bot"]):
+                return None
+
+        return await handler(event, data)
@@ -0,0 +1,63 @@
+import logging
+from typing import Callable, Dict, Any, Awaitable, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from bot.database import AsyncSessionLocal
+from bot.services.idempotency import IdempotencyStore, idempotency_store
+
+logger = logging.getLogger(__name__)
+
+
+def update_key(bot_id: int, update: Update) -> Optional[str]:
+    """
+    Ключ идемпотентности: (бот, чат, сообщение) для новых сообщений,
+    (бот, update_id) для остальных обновлений. Inline-запросы приходят на
+    каждое нажатие клавиши и не меняют состояние, поэтому не отслеживаются.
+    """
+    if update.inline_query is not None or update.chosen_inline_result is not None:
+        return None
+    if update.message is not None:
+        return f"msg:{bot_id}:{update.message.chat.id}:{update.message.message_id}"
+    return f"upd:{bot_id}:{update.update_id}"
+
+
+# Middleware, отбрасывающее повторно доставленные обновления.
+# Подключается к dp.update раньше DBSessionMiddleware, поэтому дубликат
+# не открывает сессию истории и не вызывает модель. Обновление, обработка
+# которого завершилась ошибкой, не считается принятым.
+class IdempotencyMiddleware(BaseMiddleware):
+
+    def __init__(self, store: Optional[IdempotencyStore] = None, session_factory=AsyncSessionLocal) -> None:
+        self.store = store or idempotency_store
+        self.session_factory = session_factory
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+
+        key = update_key(data["bot"].id, event)
+        if key is None:
+            return await handler(event, data)
+
+        async with self.session_factory() as session:
+            is_new = await self.store.claim(session, key)
+
+        if not is_new:
+            logger.info(f"♻️ Повторная доставка обновления {key} пропущена")
+            return None
+
+        try:
+            result = await handler(event, data)
+        except Exception:
+            async with self.session_factory() as session:
+                await self.store.release(session, key)
+            raise
+
+        async with self.session_factory() as session:
+            await self.store.complete(session, key)
+        return result
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Awaitable, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from bot.config import settings
+from bot.services.load import LoadMonitor, load_monitor
+
+logger = logging.getLogger(__name__)
+
+BUSY_TEXT = "⏳ Сейчас много запросов, попробуйте через минуту."
+
+# Приоритеты обновлений при перегрузке
+PRIORITY_HIGH = "high"  # Команды: дешевые и управляют диалогом, обрабатываются всегда
+PRIORITY_LOW = "low"    # Кнопки и inline-запросы: откладываются до снижения нагрузки
+PRIORITY_SHED = "shed"  # Сообщения и документы для модели: сразу получают ответ «занято»
+
+# Сколько чатов помнить для паузы между уведомлениями «занято»
+NOTICE_CACHE_SIZE = 10000
+
+
+def update_priority(update: Update) -> str:
+    if update.callback_query is not None or update.inline_query is not None:
+        return PRIORITY_LOW
+    message = update.message
+    if message is not None and message.text and not message.text.startswith("/"):
+        return PRIORITY_SHED
+    if message is not None and message.document is not None:
+        return PRIORITY_SHED  # Скачивание и разбор файла, затем запрос к модели
+    return PRIORITY_HIGH
+
+
+# Middleware сброса нагрузки. Подключается к dp.update раньше
+# идемпотентности и сессии БД: отклоненное обновление не делает
+# ни одного запроса к БД и модели.
+class LoadSheddingMiddleware(BaseMiddleware):
+
+    def __init__(self, monitor: Optional[LoadMonitor] = None) -> None:
+        self.monitor = monitor or load_monitor
+        # chat_id -> время последнего уведомления «занято»
+        self._notified: "OrderedDict[int, float]" = OrderedDict()
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+
+        if self.monitor.overloaded:
+            priority = update_priority(event)
+            if priority == PRIORITY_LOW:
+                priority = await self._defer()
+            if priority == PRIORITY_SHED:
+                self.monitor.shed += 1
+                await self._reject(event, data["bot"])
+                return None
+
+        self.monitor.in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.monitor.in_flight -= 1
+
+    async def _defer(self) -> str:
+        """Ждет снижения нагрузки не дольше LOAD_DEFER_TIMEOUT секунд."""
+        self.monitor.deferred += 1
+        deadline = time.monotonic() + settings.LOAD_DEFER_TIMEOUT
+        while self.monitor.overloaded:
+            if time.monotonic() >= deadline:
+                return PRIORITY_SHED
+            await asyncio.sleep(settings.LOOP_LAG_INTERVAL)
+        return PRIORITY_HIGH
+
+    async def _reject(self, update: Update, bot) -> None:
+        """Быстрый ответ без обращения к БД (не чаще раза в LOAD_SHED_NOTICE_COOLDOWN на чат)."""
+        try:
+            if update.callback_query is not None:
+                await bot.answer_callback_query(update.callback_query.id, text=BUSY_TEXT)
+            elif update.message is not None and self._should_notify(update.message.chat.id):
+                await bot.send_message(update.message.chat.id, BUSY_TEXT)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось отправить уведомление о перегрузке: {e}")
+
+    def _should_notify(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        last = self._notified.get(chat_id)
+        if last is not None and now - last < settings.LOAD_SHED_NOTICE_COOLDOWN:
+            return False
+        self._notified[chat_id] = now
+        self._notified.move_to_end(chat_id)
+        while len(self._notified) > NOTICE_CACHE_SIZE:
+            self._notified.popitem(last=False)
+        return True
@@ -0,0 +1,17 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from bot.profiles import get_profile
+
+
+# Middleware, передающее обработчикам профиль бота, получившего обновление.
+class BotProfileMiddleware(BaseMiddleware):
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        data["profile"] = get_profile(data["bot"].id)
+        return await handler(event, data)
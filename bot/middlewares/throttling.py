@@ -1,22 +1,57 @@
 import logging
-from datetime import datetime, timedelta
-from typing import Callable, Dict, Any, Awaitable
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram import BaseMiddleware
-from aiogram.types import Message
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent, Message
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
 from bot.config import settings
-from bot.models import DialogHistory
+from bot.filters import dialog_owner, is_group_chat
+from bot.profiles import BotProfile, get_default_profile
+from bot.services.limits import ROLLING_WINDOW, UsageService, format_reset_time
+from bot.services.profiling import register_structure
+from bot.services.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
 # Middleware для ограничения количества запросов пользователя.
 class ThrottlingMiddleware(BaseMiddleware):
 
-    def __init__(self, limit_period_hours: int = 24) -> None:
-        self.limit_period_hours = limit_period_hours
-        # Кэш для быстрой проверки (user_id -> [count, last_check])
-        self._cache: Dict[int, Dict[str, Any]] = {}
+    def __init__(self) -> None:
+        # Кэш для быстрой проверки ((bot_id, user_id) -> count, limit, reset_at, last_check)
+        self._cache: Dict[tuple, Dict[str, Any]] = {}
+        register_structure("ThrottlingMiddleware._cache", lambda: self._cache)
+
+    def reset_cache(self, old=None, new=None, changed=None) -> None:
+        """Сбрасывает кэш после изменения лимитов: решения в нем приняты по старым значениям."""
+        self._cache.clear()
+
+    def forget(self, user_id: int, bot_id: int = 0) -> None:
+        """Удаляет решение из кэша (например, после изменения индивидуального лимита)."""
+        self._cache.pop((bot_id, user_id), None)
+
+    def dump_state(self) -> list:
+        """Актуальные записи кэша для снимка состояния."""
+        threshold = datetime.now() - timedelta(seconds=300)
+        return [
+            [
+                bot_id, user_id, entry["can_proceed"], entry["count"], entry["timestamp"].timestamp(),
+                entry.get("limit"),
+                entry["reset_at"].replace(tzinfo=timezone.utc).timestamp() if entry.get("reset_at") else None,
+            ]
+            for (bot_id, user_id), entry in list(self._cache.items())
+            if entry["timestamp"] >= threshold
+        ]
+
+    def load_state(self, records: list) -> None:
+        for bot_id, user_id, can_proceed, count, timestamp, *rest in records:
+            limit, reset_at = (rest + [None, None])[:2]
+            self._cache[(bot_id, user_id)] = {
+                "can_proceed": can_proceed,
+                "count": count,
+                "timestamp": datetime.fromtimestamp(timestamp),
+                "limit": limit,
+                "reset_at": datetime.utcfromtimestamp(reset_at) if reset_at is not None else None,
+            }
 
     async def __call__(
             self,
@@ -24,77 +59,124 @@ class ThrottlingMiddleware(BaseMiddleware):
             event: Message,
             data: Dict[str, Any]
     ) -> Any:
-        # Проверяем только текстовые сообщения (не команды)
-        if not event.text or event.text.startswith('/'):
+        # Обработчики получают middleware, например чтобы сбросить кэш после /limit
+        data["throttling"] = self
+
+        # Проверяем текстовые сообщения (не команды и не нажатия кнопок), документы и inline-запросы
+        if isinstance(event, InlineQuery):
+            if len(event.query.strip()) < settings.INLINE_MIN_QUERY_LENGTH:
+                return await handler(event, data)
+        elif (
+                not isinstance(event, Message)
+                or not (event.text or event.document)
+                or (event.text or "").startswith('/')
+        ):
             return await handler(event, data)
 
-        user_id = event.from_user.id
         session: AsyncSession = data.get("session")
+        profile: BotProfile = data.get("profile") or get_default_profile()
+
+        # В группах лимит общий для чата
+        if isinstance(event, Message) and is_group_chat(event.chat):
+            user_id = dialog_owner(event.chat, event.from_user)
+            daily_limit = profile.group_daily_limit
+        else:
+            user_id = event.from_user.id
+            daily_limit = profile.daily_limit
 
         if not session:
             logger.warning(f"Сессия БД не найдена для пользователя {user_id}")
             return await handler(event, data)
 
         # Проверяем лимит
-        can_proceed, count = await self._check_limit(user_id, session)
+        with tracer.span("throttling.check", limit=daily_limit) as span:
+            can_proceed, count = await self._check_limit(user_id, session, profile, daily_limit)
+            if span is not None:
+                span.set_attribute("count", count)
+                span.set_attribute("allowed", can_proceed)
 
         if not can_proceed:
-            await self._send_limit_message(event, count)
+            # Индивидуальный лимит и точное время сброса сохранены в кэше проверкой
+            entry = self._cache.get((profile.bot_id, user_id), {})
+            limit = entry["limit"] if entry.get("limit") is not None else daily_limit
+            if isinstance(event, InlineQuery):
+                await self._send_inline_limit_message(event, count, limit)
+            else:
+                await self._send_limit_message(event, count, limit, entry.get("reset_at"))
             return
 
         # Если лимит не превышен, продолжаем обработку
         return await handler(event, data)
 
-    async def _check_limit(self, user_id: int, session: AsyncSession) -> tuple[bool, int]:
-        """Проверяет, не превысил ли пользователь лимит запросов."""
-
-        # Проверяем кэш (обновляем каждые 5 минут)
-        cache_key = user_id
+    async def _check_limit(
+            self,
+            user_id: int,
+            session: AsyncSession,
+            profile: BotProfile = None,
+            daily_limit: int = None,
+    ) -> tuple[bool, int]:
+        """Проверяет, не превысил ли пользователь (или групповой чат) лимит запросов в боте профиля."""
+        profile = profile or get_default_profile()
+        daily_limit = daily_limit if daily_limit is not None else profile.daily_limit
+
+        # Проверяем кэш (обновляем каждые 5 минут и сразу после сброса окна)
+        cache_key = (profile.bot_id, user_id)
         if cache_key in self._cache:
             cache_data = self._cache[cache_key]
-            if (datetime.now() - cache_data["timestamp"]).seconds < 300:  # 5 минут
+            reset_at = cache_data.get("reset_at")
+            if (datetime.now() - cache_data["timestamp"]).seconds < 300 and (  # 5 минут
+                    reset_at is None or datetime.utcnow() < reset_at
+            ):
                 return cache_data["can_proceed"], cache_data["count"]
 
-        # Рассчитываем период
-        period_start = datetime.utcnow() - timedelta(hours=self.limit_period_hours)
-
-        # Считаем запросы пользователя за период
-        stmt = select(func.count(DialogHistory.id)).where(
-            and_(
-                DialogHistory.user_id == user_id,
-                DialogHistory.role == "user",
-                DialogHistory.timestamp >= period_start
-            )
-        )
-
-        result = await session.execute(stmt)
-        request_count = result.scalar() or 0
-
-        can_proceed = request_count < settings.TEXT_DAILY_LIMIT
+        # Счетчик текущего окна - чтение по первичному ключу
+        usage = await UsageService.get(session, user_id, profile.bot_id)
+        limit = usage.limit_override if usage.limit_override is not None else daily_limit
+        can_proceed = usage.count < limit
 
         # Обновляем кэш
         self._cache[cache_key] = {
             "can_proceed": can_proceed,
-            "count": request_count,
-            "timestamp": datetime.now()
+            "count": usage.count,
+            "timestamp": datetime.now(),
+            "limit": usage.limit_override,
+            "reset_at": usage.reset_at,
         }
 
-        logger.debug(f"Пользователь {user_id}: {request_count}/{settings.TEXT_DAILY_LIMIT} запросов")
-        return can_proceed, request_count
+        logger.debug(f"Пользователь {user_id} ({profile.name}): {usage.count}/{limit} запросов")
+        return can_proceed, usage.count
 
-    async def _send_limit_message(self, event: Message, count: int) -> None:
+    async def _send_limit_message(
+            self,
+            event: Message,
+            count: int,
+            limit: int = None,
+            reset_at: Optional[datetime] = None,
+    ) -> None:
         """Отправляет сообщение о превышении лимита."""
-        from datetime import datetime, timedelta
-
-        # Примерное время сброса (через 24 часа после первого запроса)
-        reset_time = datetime.now() + timedelta(hours=24)
-        reset_str = reset_time.strftime("%H:%M %d.%m.%Y")
+        # Время сброса известно из счетчика; без него - оценка по окну
+        reset_str = format_reset_time(reset_at or datetime.utcnow() + ROLLING_WINDOW)
 
+        limit = limit if limit is not None else settings.TEXT_DAILY_LIMIT
         message = (
             f"⚠️ *Достигнут дневной лимит запросов!*\n\n"
-            f"Вы использовали {count} из {settings.TEXT_DAILY_LIMIT} доступных запросов.\n"
-            f"Лимит обновится примерно в {reset_str}\n\n"
+            f"Вы использовали {count} из {limit} доступных запросов.\n"
+            f"Лимит обновится в {reset_str}\n\n"
             f"Чтобы увеличить лимит, обратитесь к администратору."
         )
 
-        await event.answer(message, parse_mode="Markdown")
\ No newline at end of file
+        await event.answer(message, parse_mode="Markdown")
+
+    async def _send_inline_limit_message(self, event: InlineQuery, count: int, limit: int) -> None:
+        """Отвечает на inline-запрос сообщением о превышении лимита."""
+        text = f"⚠️ Достигнут дневной лимит запросов: {count} из {limit}."
+        await event.answer(
+            [InlineQueryResultArticle(
+                id="limit",
+                title="Дневной лимит исчерпан",
+                description=text,
+                input_message_content=InputTextMessageContent(message_text=text),
+            )],
+            cache_time=0,
+            is_personal=True,
+        )
@@ -0,0 +1,28 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from bot.services.tracing import tracer
+
+
+# Middleware, открывающее корневой спан трассы на каждое обновление.
+# Спаны middleware, запросов к БД и попыток моделей становятся его потомками.
+class TracingMiddleware(BaseMiddleware):
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        if not tracer.enabled or not isinstance(event, Update):
+            return await handler(event, data)
+
+        with tracer.span(
+            "telegram.update",
+            **{"update.id": event.update_id, "update.type": event.event_type, "bot.id": data["bot"].id},
+        ) as span:
+            result = await handler(event, data)
+            profile = data.get("profile")
+            if profile is not None:
+                span.set_attribute("bot.profile", profile.name)
+            return result
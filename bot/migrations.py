@@ -0,0 +1,194 @@
+"""
+Легкие миграции схемы для баз, созданных предыдущими версиями бота.
+create_all создает только отсутствующие таблицы, поэтому новые колонки
+и индексы существующих таблиц добавляются здесь. Все шаги идемпотентны.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, Set
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from bot.models import Attachment, DialogHistory, ProcessedUpdate, StatsActiveUser, StatsRollup, UsageCounter
+from bot.storage import EPOCH
+
+MIGRATION_BATCH_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+
+async def get_columns(conn: AsyncConnection, table: str) -> Set[str]:
+    """Имена колонок таблицы SQLite."""
+    return set(await get_column_types(conn, table))
+
+
+async def get_column_types(conn: AsyncConnection, table: str) -> Dict[str, str]:
+    """Объявленные типы колонок таблицы SQLite."""
+    result = await conn.execute(text(f"PRAGMA table_info({table})"))
+    return {row.name: row.type.upper() for row in result}
+
+
+async def add_column(conn: AsyncConnection, table: str, column: str, ddl: str) -> bool:
+    """Добавляет колонку, если ее еще нет. Возвращает True, если колонка добавлена."""
+    if column in await get_columns(conn, table):
+        return False
+
+    await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    logger.info(f"🛠 Миграция: добавлена колонка {table}.{column}")
+    return True
+
+
+async def create_indexes(conn: AsyncConnection, table) -> None:
+    """Создает недостающие индексы таблицы из метаданных модели."""
+    for index in table.indexes:
+        await conn.run_sync(lambda sync_conn, index=index: index.create(sync_conn, checkfirst=True))
+
+
+async def migrate_compact_history(conn: AsyncConnection) -> int:
+    """
+    Переводит dialog_history в компактный формат (см. bot/storage.py).
+    Типы колонок в SQLite не меняются через ALTER TABLE, поэтому таблица
+    пересоздается, а строки переносятся порциями. Полнотекстовый индекс
+    и его триггеры создаются заново вместе с новой таблицей.
+
+    Returns:
+        Количество перенесенных строк (0, если база уже в новом формате)
+    """
+    if (await get_column_types(conn, "dialog_history")).get("role") == "SMALLINT":
+        return 0
+
+    for statement in (
+        "DROP TRIGGER IF EXISTS dialog_history_fts_insert",
+        "DROP TRIGGER IF EXISTS dialog_history_fts_delete",
+        "DROP TRIGGER IF EXISTS dialog_history_fts_update",
+        "DROP TABLE IF EXISTS dialog_history_fts",
+        "DROP VIEW IF EXISTS dialog_history_text",
+    ):
+        await conn.execute(text(statement))
+
+    # Имена индексов освобождаются для новой таблицы
+    result = await conn.execute(text(
+        "SELECT name FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = 'dialog_history' AND sql IS NOT NULL"
+    ))
+    for name in result.scalars().all():
+        await conn.execute(text(f'DROP INDEX "{name}"'))
+
+    await conn.execute(text("ALTER TABLE dialog_history RENAME TO dialog_history_legacy"))
+    await conn.run_sync(lambda sync_conn: DialogHistory.__table__.create(sync_conn))
+
+    moved, last_id = 0, 0
+    while True:
+        result = await conn.execute(text(
+            "SELECT id, user_id, bot_id, role, content, timestamp FROM dialog_history_legacy "
+            "WHERE id > :last_id ORDER BY id LIMIT :batch"
+        ), {"last_id": last_id, "batch": MIGRATION_BATCH_SIZE})
+        rows = result.fetchall()
+        if not rows:
+            break
+
+        await conn.execute(insert(DialogHistory.__table__), [
+            {
+                "id": row.id,
+                "user_id": row.user_id,
+                "bot_id": row.bot_id,
+                "role": row.role,
+                "content": row.content,
+                # Строки без времени (схемы до NOT NULL) относятся к началу эпохи
+                "timestamp": datetime.fromisoformat(row.timestamp) if row.timestamp else EPOCH,
+            }
+            for row in rows
+        ])
+        moved += len(rows)
+        last_id = rows[-1].id
+
+    await conn.execute(text("DROP TABLE dialog_history_legacy"))
+    logger.info(f"🛠 Миграция: {moved} сообщений переведено в компактный формат")
+    return moved
+
+
+async def migrate_stats_namespaces(conn: AsyncConnection) -> int:
+    """
+    Добавляет bot_id в первичный ключ таблиц статистики. Первичный ключ
+    в SQLite не меняется через ALTER TABLE, поэтому таблицы пересоздаются.
+    Прежние агрегаты общие для всех ботов и относятся к пространству имен 0
+    (бот из .env). Таблицы статистики невелики, строки переносятся одним запросом.
+
+    Returns:
+        Количество пересозданных таблиц
+    """
+    migrated = 0
+    for model in (StatsRollup, StatsActiveUser):
+        table = model.__tablename__
+        columns = await get_columns(conn, table)
+        if not columns or "bot_id" in columns:
+            continue
+
+        names = ", ".join(sorted(columns))
+        await conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_legacy"))
+        await conn.run_sync(lambda sync_conn, model=model: model.__table__.create(sync_conn))
+        await conn.execute(text(f"INSERT INTO {table} (bot_id, {names}) SELECT 0, {names} FROM {table}_legacy"))
+        await conn.execute(text(f"DROP TABLE {table}_legacy"))
+        logger.info(f"🛠 Миграция: статистика {table} разделена по ботам")
+        migrated += 1
+    return migrated
+
+
+async def backfill_usage_counters(conn: AsyncConnection) -> int:
+    """
+    Заполняет пустую таблицу счетчиков лимита по истории текущего окна,
+    чтобы после обновления пользователи не получили лимит заново.
+
+    Returns:
+        Количество созданных счетчиков
+    """
+    from bot.services.limits import window_bounds
+
+    if (await conn.execute(select(UsageCounter.user_id).limit(1))).first() is not None:
+        return 0
+
+    threshold, start = window_bounds()
+    result = await conn.execute(
+        select(DialogHistory.bot_id, DialogHistory.user_id, func.count(), func.min(DialogHistory.timestamp))
+        .where(DialogHistory.role == "user", DialogHistory.timestamp >= threshold)
+        .group_by(DialogHistory.bot_id, DialogHistory.user_id)
+    )
+    rows = [
+        # В режиме rolling окно открыто первым запросом, в calendar - с полуночи
+        {"bot_id": bot_id, "user_id": user_id, "count": count, "window_start": min(first, start)}
+        for bot_id, user_id, count, first in result
+    ]
+    if rows:
+        await conn.execute(insert(UsageCounter.__table__), rows)
+        logger.info(f"🛠 Миграция: счетчики лимитов созданы для {len(rows)} пользователей")
+    return len(rows)
+
+
+async def run_migrations(conn: AsyncConnection) -> None:
+    """Приводит схему существующей базы к текущим моделям."""
+
+    # Пространства имен ботов (запуск нескольких ботов в одном процессе)
+    await add_column(conn, "dialog_history", "bot_id", "BIGINT NOT NULL DEFAULT 0")
+
+    # Компактное хранение: роль числом, время в миллисекундах, сжатие текста
+    await migrate_compact_history(conn)
+
+    # Эпохи диалогов (сброс контекста без массового DELETE)
+    await add_column(conn, "dialog_history", "conversation_id", "BIGINT NOT NULL DEFAULT 0")
+
+    # Ссылки на документы (текст хранится в attachments, запрос истории
+    # соединяется с этой таблицей, поэтому она нужна и без create_all)
+    await add_column(conn, "dialog_history", "attachment_id", "INTEGER")
+    await conn.run_sync(lambda sync_conn: Attachment.__table__.create(sync_conn, checkfirst=True))
+
+    await create_indexes(conn, DialogHistory.__table__)
+
+    # Статус обработки обновлений: ключи прежних версий считаются обработанными
+    await conn.run_sync(lambda sync_conn: ProcessedUpdate.__table__.create(sync_conn, checkfirst=True))
+    await add_column(conn, "processed_updates", "done", "BOOLEAN NOT NULL DEFAULT 1")
+
+    # Статистика по ботам
+    await migrate_stats_namespaces(conn)
+
+    # Счетчики дневного лимита вместо подсчета по истории
+    await conn.run_sync(lambda sync_conn: UsageCounter.__table__.create(sync_conn, checkfirst=True))
+    await backfill_usage_counters(conn)
@@ -1,6 +1,8 @@
 from datetime import datetime
-from sqlalchemy import String, Text, BigInteger, DateTime
+from typing import Optional
+from sqlalchemy import String, Text, BigInteger, DateTime, Boolean, Float, Integer, DDL, Index, event, inspect
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from bot.storage import CompressedText, EpochMillis, RoleType
 
 
 class Base(DeclarativeBase):
@@ -12,15 +14,252 @@ class DialogHistory(Base):
     """
     Модель для хранения истории диалогов с пользователем.
     Каждая запись - одно сообщение от пользователя или ассистента.
+    Строки хранятся компактно (см. bot/storage.py): роль - числом,
+    время - миллисекундами Unix-времени, длинный текст - в сжатом виде.
     """
 
     __tablename__ = "dialog_history"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
-    role: Mapped[str] = mapped_column(String(20), nullable=False)  # 'user' или 'assistant'
-    content: Mapped[str] = mapped_column(Text, nullable=False)
-    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Пространство имен бота (0 - единственный бот из BOT_TOKEN)
+    bot_id: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    # Эпоха диалога пользователя (см. UserState): сброс контекста начинает новую эпоху
+    conversation_id: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    role: Mapped[str] = mapped_column(RoleType, nullable=False)  # 'user' или 'assistant'
+    content: Mapped[str] = mapped_column(CompressedText, nullable=False)
+    timestamp: Mapped[datetime] = mapped_column(EpochMillis, default=datetime.utcnow)
+    # Приложенный документ (см. Attachment): текст хранится один раз, а не в каждом сообщении
+    attachment_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, index=True)
+
+    __table_args__ = (
+        Index("ix_dialog_history_user_bot_ts", "user_id", "bot_id", "timestamp"),
+        Index("ix_dialog_history_conversation", "user_id", "bot_id", "conversation_id", "timestamp"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<DialogHistory(user_id={self.user_id}, role={self.role}, timestamp={self.timestamp})>"
+
+
+# Полнотекстовый индекс по истории (SQLite FTS5 с внешним содержимым).
+# Текст хранится только в dialog_history, индекс синхронизируется триггерами.
+# user_id индексируется как отдельная колонка, чтобы поиск сразу сужался до пользователя.
+# Содержимое может быть сжато, поэтому FTS5 читает его через представление
+# с функцией history_text() (регистрируется на каждом соединении в bot/storage.py).
+DIALOG_HISTORY_FTS_DDL = [
+    """
+    CREATE VIEW IF NOT EXISTS dialog_history_text AS
+    SELECT id, history_text(content) AS content, user_id FROM dialog_history
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS dialog_history_fts USING fts5(
+        content, user_id,
+        content='dialog_history_text', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS dialog_history_fts_insert AFTER INSERT ON dialog_history BEGIN
+        INSERT INTO dialog_history_fts(rowid, content, user_id)
+        VALUES (new.id, history_text(new.content), new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS dialog_history_fts_delete AFTER DELETE ON dialog_history BEGIN
+        INSERT INTO dialog_history_fts(dialog_history_fts, rowid, content, user_id)
+        VALUES ('delete', old.id, history_text(old.content), old.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS dialog_history_fts_update AFTER UPDATE ON dialog_history BEGIN
+        INSERT INTO dialog_history_fts(dialog_history_fts, rowid, content, user_id)
+        VALUES ('delete', old.id, history_text(old.content), old.user_id);
+        INSERT INTO dialog_history_fts(rowid, content, user_id)
+        VALUES (new.id, history_text(new.content), new.user_id);
+    END
+    """,
+]
+
+for _statement in DIALOG_HISTORY_FTS_DDL:
+    event.listen(
+        DialogHistory.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="sqlite"),
+    )
+
+
+class ModelProbeResult(Base):
+    """
+    Результат одного замера модели из цепочки.
+    Хранится скользящее окно замеров для сравнения моделей по задержке.
+    """
+
+    __tablename__ = "model_probe_results"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    model: Mapped[str] = mapped_column(String(200), nullable=False, index=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    success: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    ttft_ms: Mapped[Optional[float]] = mapped_column(Float)  # Время до первого токена
+    total_ms: Mapped[float] = mapped_column(Float, nullable=False)
+    completion_tokens: Mapped[Optional[int]] = mapped_column(Integer)
+    tokens_per_sec: Mapped[Optional[float]] = mapped_column(Float)
+    error: Mapped[Optional[str]] = mapped_column(Text)
 
     def __repr__(self) -> str:
-        return f"<DialogHistory(user_id={self.user_id}, role={self.role}, timestamp={self.timestamp})>"
\ No newline at end of file
+        return f"<ModelProbeResult(model={self.model}, success={self.success}, total_ms={self.total_ms})>"
+
+
+class StatsRollup(Base):
+    """
+    Инкрементально обновляемые агрегаты для статистики.
+    Одна строка - значение метрики бота за час или за день.
+    """
+
+    __tablename__ = "stats_rollup"
+
+    bot_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, default=0)
+    period: Mapped[str] = mapped_column(String(5), primary_key=True)  # 'hour' или 'day'
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)  # Начало периода (UTC)
+    metric: Mapped[str] = mapped_column(String(255), primary_key=True)
+    value: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class UsageCounter(Base):
+    """
+    Счетчик дневного лимита: одна строка на пользователя (или групповой чат)
+    в пространстве имен бота. Хранит число запросов текущего окна и его начало,
+    поэтому проверка лимита - чтение по первичному ключу. Окно сбрасывается
+    при первом запросе после истечения и фоновой задачей (см. bot/services/limits.py).
+    """
+
+    __tablename__ = "usage_counters"
+
+    bot_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    window_start: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # UTC
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Индивидуальный лимит, назначенный администратором (/setlimit)
+    limit_override: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+
+class StatsActiveUser(Base):
+    """
+    Отметка активности пользователя в периоде (для подсчета уникальных пользователей).
+    В группах отмечается автор сообщения, а не чат.
+    """
+
+    __tablename__ = "stats_active_users"
+
+    bot_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, default=0)
+    period: Mapped[str] = mapped_column(String(5), primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+
+
+class UserState(Base):
+    """
+    Указатель на текущую эпоху диалога пользователя.
+    Сброс контекста - обновление одной строки: сообщения прошлых эпох
+    остаются в таблице и удаляются фоновой задачей, а предыдущую эпоху
+    можно вернуть командой /restore.
+    """
+
+    __tablename__ = "user_states"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    bot_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    conversation_id: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    previous_conversation_id: Mapped[Optional[int]] = mapped_column(BigInteger)
+    next_conversation_id: Mapped[int] = mapped_column(BigInteger, nullable=False, default=1)
+
+
+class ConversationThread(Base):
+    """
+    Именованная ветка диалога: эпоха пользователя с названием.
+    Сообщения веток не удаляются фоновой очисткой, между ветками можно переключаться.
+    """
+
+    __tablename__ = "conversation_threads"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    bot_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    conversation_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    title: Mapped[str] = mapped_column(String(64), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class RetiredConversation(Base):
+    """
+    Очередь очистки: эпоха, которую уже нельзя вернуть. Добавляется при сбросе
+    контекста и переключении веток, когда предыдущая эпоха перестает быть
+    предыдущей; фоновая задача удаляет ее сообщения по индексу эпохи
+    и убирает строку из очереди.
+    """
+
+    __tablename__ = "retired_conversations"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    bot_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    conversation_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+
+
+def _has_legacy_epochs(ddl, target, bind, **kw) -> bool:
+    inspector = inspect(bind)
+    return (
+        inspector.has_table("user_states")
+        and inspector.has_table("dialog_history")
+        and "conversation_id" in {column["name"] for column in inspector.get_columns("dialog_history")}
+    )
+
+
+# База, где эпохи появились раньше очереди: старые сброшенные эпохи ставятся
+# в очередь один раз, при создании таблицы (ветки отсеиваются при очистке)
+event.listen(
+    RetiredConversation.__table__,
+    "after_create",
+    DDL("""
+        INSERT OR IGNORE INTO retired_conversations (user_id, bot_id, conversation_id)
+        SELECT DISTINCT h.user_id, h.bot_id, h.conversation_id
+        FROM dialog_history AS h
+        LEFT JOIN user_states AS s ON s.user_id = h.user_id AND s.bot_id = h.bot_id
+        WHERE h.conversation_id >= 0
+          AND h.conversation_id != coalesce(s.conversation_id, 0)
+          AND h.conversation_id IS NOT s.previous_conversation_id
+    """).execute_if(dialect="sqlite", callable_=_has_legacy_epochs),
+)
+
+
+class ProcessedUpdate(Base):
+    """
+    Ключ уже принятого обновления Telegram (защита от повторной доставки).
+    Пока done = False, обновление обрабатывается; незавершенную обработку
+    старше IDEMPOTENCY_CLAIM_TIMEOUT (сбой посреди обработчика) можно
+    начать заново. Строки старше IDEMPOTENCY_TTL удаляются фоновой задачей.
+    """
+
+    __tablename__ = "processed_updates"
+
+    key: Mapped[str] = mapped_column(String(100), primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    done: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+class Attachment(Base):
+    """
+    Текст, извлеченный из документа пользователя.
+    Ключ кэша - file_unique_id Telegram (одинаков для одного файла у всех
+    пользователей и ботов), поэтому повторно присланный файл не скачивается.
+    Сообщения истории ссылаются на запись через DialogHistory.attachment_id.
+    """
+
+    __tablename__ = "attachments"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    file_unique_id: Mapped[str] = mapped_column(String(64), nullable=False, unique=True)
+    file_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    file_size: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    text: Mapped[str] = mapped_column(CompressedText, nullable=False)
+    # Текст обрезан бюджетом байт или токенов
+    truncated: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
@@ -0,0 +1,110 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from bot.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Пространство имен истории и лимитов для конфигурации с одним ботом из .env
+LEGACY_NAMESPACE = 0
+
+
+class BotProfile(BaseModel):
+    """
+    Настройки одного бота при запуске нескольких ботов в одном процессе.
+    Незаданные значения берутся из общих настроек.
+    """
+
+    name: str
+    token: str
+    system_prompt: Optional[str] = None
+    models: List[str] = []
+    # Цепочки моделей по уровням маршрутизации (см. bot.services.routing)
+    model_tiers: Dict[str, List[str]] = {}
+    text_daily_limit: Optional[int] = None
+    chat_window_limit: Optional[int] = None
+    group_text_daily_limit: Optional[int] = None
+    group_chat_window_limit: Optional[int] = None
+    # Пространство имен истории и лимитов в общей БД (по умолчанию ID бота из токена)
+    namespace: Optional[int] = None
+
+    @property
+    def bot_id(self) -> int:
+        """Пространство имен бота в таблицах истории."""
+        if self.namespace is not None:
+            return self.namespace
+        return int(self.token.split(":", 1)[0])
+
+    @property
+    def model_chain(self) -> List[str]:
+        return self.models or [settings.OPENROUTER_MODEL] + settings.OPENROUTER_FALLBACK_MODELS
+
+    @property
+    def prompt(self) -> str:
+        return self.system_prompt or settings.SYSTEM_PROMPT
+
+    @property
+    def daily_limit(self) -> int:
+        return self.text_daily_limit if self.text_daily_limit is not None else settings.TEXT_DAILY_LIMIT
+
+    @property
+    def window_limit(self) -> int:
+        return self.chat_window_limit if self.chat_window_limit is not None else settings.CHAT_WINDOW_LIMIT
+
+    @property
+    def group_daily_limit(self) -> int:
+        if self.group_text_daily_limit is not None:
+            return self.group_text_daily_limit
+        return settings.GROUP_DAILY_LIMIT
+
+    @property
+    def group_window_limit(self) -> int:
+        if self.group_chat_window_limit is not None:
+            return self.group_chat_window_limit
+        return settings.GROUP_WINDOW_LIMIT
+
+
+def get_default_profile() -> BotProfile:
+    """Профиль бота из .env (BOT_TOKEN) для запуска одного бота."""
+    return BotProfile(name="default", token=settings.BOT_TOKEN or "0:", namespace=LEGACY_NAMESPACE)
+
+
+def load_profiles() -> List[BotProfile]:
+    """
+    Загружает профили ботов из BOTS_CONFIG (JSON-список) или,
+    если он не задан, возвращает единственный профиль из BOT_TOKEN.
+    """
+    if not settings.BOTS_CONFIG:
+        if not settings.BOT_TOKEN:
+            raise ValueError("Не задан ни BOT_TOKEN, ни BOTS_CONFIG")
+        return [get_default_profile()]
+
+    data = json.loads(Path(settings.BOTS_CONFIG).read_text(encoding="utf-8"))
+    profiles = [BotProfile(**item) for item in data]
+
+    namespaces = [profile.bot_id for profile in profiles]
+    if len(set(namespaces)) != len(namespaces):
+        raise ValueError("Пространства имен ботов в BOTS_CONFIG должны быть уникальны")
+
+    logger.info(f"📋 Загружено профилей ботов: {[profile.name for profile in profiles]}")
+    return profiles
+
+
+# Реестр профилей запущенных ботов: ID бота Telegram -> профиль
+_registry: Dict[int, BotProfile] = {}
+
+
+def register_profile(telegram_bot_id: int, profile: BotProfile) -> None:
+    _registry[telegram_bot_id] = profile
+
+
+def get_profiles() -> List[BotProfile]:
+    """Профили запущенных ботов в порядке регистрации."""
+    return list(_registry.values())
+
+
+def get_profile(telegram_bot_id: int) -> BotProfile:
+    """Профиль по ID бота Telegram (профиль по умолчанию, если бот не зарегистрирован)."""
+    return _registry.get(telegram_bot_id) or get_default_profile()
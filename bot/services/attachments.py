@@ -0,0 +1,203 @@
+"""
+Документы пользователя как контекст диалога.
+
+Файл скачивается потоком по ATTACHMENT_CHUNK_SIZE байт, и текст
+извлекается по мере поступления частей. Скачивание прекращается, как
+только исчерпан бюджет байт (ATTACHMENT_MAX_BYTES) или токенов
+(ATTACHMENT_MAX_TOKENS): большой файл не загружается в память целиком.
+
+Извлеченный текст хранится один раз в таблице attachments (ключ -
+file_unique_id Telegram), а сообщение истории ссылается на него через
+attachment_id. Полный текст попадает в запрос к модели только для
+последнего документа в окне контекста, более ранние упоминаются одной строкой.
+"""
+import codecs
+import logging
+from datetime import datetime, timedelta
+from pathlib import PurePosixPath
+from typing import Optional, Tuple
+from aiogram import Bot
+from aiogram.types import Document
+from sqlalchemy import delete, exists, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.models import Attachment, DialogHistory
+from bot.services.routing import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedDocument(ValueError):
+    """Документ нельзя использовать как текст (формат, размер или двоичное содержимое)."""
+
+
+class TextExtractor:
+    """
+    Инкрементальное декодирование текста с жесткими бюджетами.
+    Кодировка определяется по первой части: UTF-8 (с BOM или без), иначе cp1251.
+    """
+
+    def __init__(self, max_bytes: int, max_chars: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.received = 0
+        self.chars = 0
+        self.truncated = False
+        self._parts = []
+        self._decoder = None
+
+    def _detect(self, chunk: bytes) -> None:
+        if b"\x00" in chunk[:4096]:
+            raise UnsupportedDocument("Файл выглядит двоичным")
+        try:
+            chunk.decode("utf-8")
+            encoding = "utf-8-sig"
+        except UnicodeDecodeError as e:
+            # Ошибка только в последних байтах - символ разрезан границей части
+            encoding = "utf-8-sig" if e.start >= len(chunk) - 3 else "cp1251"
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    def _append(self, text: str) -> None:
+        room = self.max_chars - self.chars
+        if len(text) > room:
+            text = text[:room]
+            self.truncated = True
+        self._parts.append(text)
+        self.chars += len(text)
+
+    def feed(self, chunk: bytes) -> bool:
+        """
+        Добавляет очередную часть файла.
+
+        Returns:
+            False, если бюджет исчерпан и скачивание нужно прекратить
+        """
+        if self._decoder is None:
+            self._detect(chunk)
+
+        room = self.max_bytes - self.received
+        if len(chunk) > room:
+            chunk = chunk[:room]
+            self.truncated = True
+        self.received += len(chunk)
+
+        self._append(self._decoder.decode(chunk))
+        return not self.truncated
+
+    def finish(self) -> str:
+        if self._decoder is not None and not self.truncated:
+            self._append(self._decoder.decode(b"", final=True))
+        return "".join(self._parts)
+
+
+def check_document(document: Document) -> None:
+    """Проверяет расширение и размер до скачивания."""
+    extension = PurePosixPath(document.file_name or "").suffix.lower()
+    if extension not in settings.ATTACHMENT_EXTENSIONS:
+        raise UnsupportedDocument(
+            f"Поддерживаются только текстовые файлы: {', '.join(settings.ATTACHMENT_EXTENSIONS)}"
+        )
+    if document.file_size and document.file_size > settings.ATTACHMENT_MAX_FILE_SIZE:
+        raise UnsupportedDocument("Файл слишком большой")
+
+
+def render_attachment(content: str, file_name: str, text: Optional[str] = None, truncated: bool = False) -> str:
+    """
+    Сообщение с документом для запроса к модели: с текстом файла
+    или (text=None) только с упоминанием, что файл был приложен.
+    """
+    if text is None:
+        note = f"[Ранее приложен файл «{file_name}»]"
+        return f"{content}\n{note}" if content else note
+
+    suffix = " (начало, файл обрезан)" if truncated else ""
+    block = f"[Файл «{file_name}»{suffix}]\n{text}\n[Конец файла «{file_name}»]"
+    return f"{content}\n\n{block}" if content else block
+
+
+class AttachmentService:
+    """Извлечение, кэширование и хранение текста документов."""
+
+    @staticmethod
+    async def stream_text(bot: Bot, document: Document) -> Tuple[str, bool, int]:
+        """
+        Скачивает документ потоком и извлекает текст в пределах бюджетов.
+
+        Returns:
+            (текст, обрезан ли он, сколько байт прочитано)
+        """
+        extractor = TextExtractor(
+            max_bytes=settings.ATTACHMENT_MAX_BYTES,
+            max_chars=settings.ATTACHMENT_MAX_TOKENS * CHARS_PER_TOKEN,
+        )
+        file = await bot.get_file(document.file_id)
+        stream = bot.session.stream_content(
+            url=bot.session.api.file_url(bot.token, file.file_path),
+            timeout=settings.ATTACHMENT_DOWNLOAD_TIMEOUT,
+            chunk_size=settings.ATTACHMENT_CHUNK_SIZE,
+        )
+        try:
+            async for chunk in stream:
+                if not extractor.feed(chunk):
+                    break
+        finally:
+            # Закрывает соединение, если чтение прервано бюджетом
+            await stream.aclose()
+
+        return extractor.finish(), extractor.truncated, extractor.received
+
+    @staticmethod
+    async def get_or_extract(session: AsyncSession, bot: Bot, document: Document) -> Tuple[Attachment, bool]:
+        """
+        Текст документа из кэша по file_unique_id или из скачанного файла.
+
+        Returns:
+            (запись вложения, взята ли она из кэша)
+        """
+        cached = await session.scalar(
+            select(Attachment).where(Attachment.file_unique_id == document.file_unique_id)
+        )
+        if cached is not None:
+            return cached, True
+
+        check_document(document)
+        text, truncated, received = await AttachmentService.stream_text(bot, document)
+        if not text.strip():
+            raise UnsupportedDocument("В файле нет текста")
+
+        await session.execute(
+            insert(Attachment).values(
+                file_unique_id=document.file_unique_id,
+                file_name=(document.file_name or "document")[:255],
+                file_size=document.file_size or received,
+                text=text,
+                truncated=truncated,
+            ).on_conflict_do_nothing(index_elements=[Attachment.file_unique_id])
+        )
+        await session.commit()
+        logger.info(
+            f"📎 Извлечен текст из {document.file_name}: {len(text)} символов из {received} байт"
+            + (" (обрезан)" if truncated else "")
+        )
+
+        attachment = await session.scalar(
+            select(Attachment).where(Attachment.file_unique_id == document.file_unique_id)
+        )
+        return attachment, False
+
+    @staticmethod
+    async def cleanup(session: AsyncSession, max_age_days: Optional[int] = None) -> int:
+        """
+        Удаляет вложения, на которые больше не ссылается история
+        и которые не использовались как кэш дольше max_age_days.
+        """
+        threshold = datetime.utcnow() - timedelta(days=max_age_days or settings.ATTACHMENT_CACHE_DAYS)
+        result = await session.execute(
+            delete(Attachment).where(
+                Attachment.created_at < threshold,
+                ~exists().where(DialogHistory.attachment_id == Attachment.id),
+            )
+        )
+        await session.commit()
+        return result.rowcount
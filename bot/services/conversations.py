@@ -0,0 +1,280 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.database import AsyncSessionLocal
+from bot.models import ConversationThread, DialogHistory, RetiredConversation, UserState
+from bot.services.attachments import AttachmentService
+from bot.services.profiling import register_structure
+from bot.services.snapshot import snapshot_service
+
+logger = logging.getLogger(__name__)
+
+TITLE_MAX_LENGTH = 64
+
+# Кэш активной эпохи: (bot_id, user_id) -> conversation_id, вытеснение LRU.
+# Обновляется при каждом переключении, поэтому обычное сообщение не читает UserState.
+_active: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+register_structure("ConversationService._active", lambda: _active)
+
+
+def _remember(user_id: int, bot_id: int, conversation_id: int) -> int:
+    key = (bot_id, user_id)
+    _active[key] = conversation_id
+    _active.move_to_end(key)
+    while len(_active) > settings.THREAD_CACHE_SIZE:
+        _active.popitem(last=False)
+    return conversation_id
+
+
+def _dump_active() -> list:
+    return [[bot_id, user_id, conversation_id] for (bot_id, user_id), conversation_id in list(_active.items())]
+
+
+def _load_active(records: list) -> None:
+    for bot_id, user_id, conversation_id in records:
+        _remember(user_id, bot_id, conversation_id)
+
+
+def _retire_previous(user_id: int, bot_id: int):
+    """Предыдущая эпоха перестает восстанавливаться: она ставится в очередь очистки."""
+    return insert(RetiredConversation).from_select(
+        ["user_id", "bot_id", "conversation_id"],
+        select(UserState.user_id, UserState.bot_id, UserState.previous_conversation_id).where(
+            UserState.user_id == user_id,
+            UserState.bot_id == bot_id,
+            UserState.previous_conversation_id.is_not(None),
+        ),
+    ).on_conflict_do_nothing()
+
+
+# Устаревший указатель направил бы сообщения в сброшенную эпоху,
+# поэтому кэш восстанавливается только после штатной остановки
+snapshot_service.register("conversations", _dump_active, _load_active, clean_only=True)
+
+
+class ConversationService:
+    """
+    Эпохи диалогов пользователя.
+    Сброс контекста не удаляет сообщения, а переключает указатель в UserState
+    на новую эпоху. Эпоха, вытесненная из предыдущих, попадает в очередь
+    RetiredConversation, и ее сообщения (если это не именованная ветка)
+    удаляются фоновой задачей небольшими порциями.
+    """
+
+    @staticmethod
+    async def get_current(session: AsyncSession, user_id: int, bot_id: int = 0) -> int:
+        """Текущая эпоха диалога (0 - пользователь еще не сбрасывал контекст)."""
+        cached = _active.get((bot_id, user_id))
+        if cached is not None:
+            _active.move_to_end((bot_id, user_id))
+            return cached
+
+        result = await session.execute(
+            select(UserState.conversation_id)
+            .where(UserState.user_id == user_id, UserState.bot_id == bot_id)
+        )
+        return _remember(user_id, bot_id, result.scalar() or 0)
+
+    @staticmethod
+    async def start_new(session: AsyncSession, user_id: int, bot_id: int = 0) -> int:
+        """
+        Начинает новую эпоху одним UPSERT по первичному ключу.
+        Текущая эпоха становится предыдущей.
+
+        Returns:
+            Номер новой эпохи
+        """
+        stmt = insert(UserState).values(
+            user_id=user_id,
+            bot_id=bot_id,
+            conversation_id=1,
+            previous_conversation_id=0,
+            next_conversation_id=2,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserState.user_id, UserState.bot_id],
+            set_={
+                "previous_conversation_id": UserState.conversation_id,
+                "conversation_id": UserState.next_conversation_id,
+                "next_conversation_id": UserState.next_conversation_id + 1,
+            },
+        ).returning(UserState.conversation_id)
+
+        # В той же транзакции, до обновления указателя
+        await session.execute(_retire_previous(user_id, bot_id))
+        result = await session.execute(stmt)
+        conversation_id = result.scalar_one()
+        await session.commit()
+        return _remember(user_id, bot_id, conversation_id)
+
+    @staticmethod
+    async def restore(session: AsyncSession, user_id: int, bot_id: int = 0) -> Optional[int]:
+        """
+        Возвращает предыдущую эпоху (меняет местами текущую и предыдущую,
+        поэтому повторный вызов отменяет восстановление).
+
+        Returns:
+            Номер восстановленной эпохи или None, если восстанавливать нечего
+        """
+        stmt = (
+            update(UserState)
+            .where(
+                UserState.user_id == user_id,
+                UserState.bot_id == bot_id,
+                UserState.previous_conversation_id.is_not(None),
+            )
+            .values(
+                conversation_id=UserState.previous_conversation_id,
+                previous_conversation_id=UserState.conversation_id,
+            )
+            .returning(UserState.conversation_id)
+        )
+        result = await session.execute(stmt)
+        conversation_id = result.scalar()
+        await session.commit()
+        if conversation_id is not None:
+            _remember(user_id, bot_id, conversation_id)
+        return conversation_id
+
+    @staticmethod
+    async def rename(session: AsyncSession, user_id: int, title: str, bot_id: int = 0) -> int:
+        """
+        Дает название текущей эпохе, превращая ее в ветку.
+
+        Returns:
+            Номер эпохи ветки
+        """
+        title = title.strip()[:TITLE_MAX_LENGTH]
+        if not title:
+            raise ValueError("Название ветки не может быть пустым")
+
+        conversation_id = await ConversationService.get_current(session, user_id, bot_id)
+        stmt = insert(ConversationThread).values(
+            user_id=user_id, bot_id=bot_id, conversation_id=conversation_id, title=title,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ConversationThread.user_id, ConversationThread.bot_id, ConversationThread.conversation_id],
+            set_={"title": stmt.excluded.title},
+        )
+        await session.execute(stmt)
+        await session.commit()
+        return conversation_id
+
+    @staticmethod
+    async def list_threads(session: AsyncSession, user_id: int, bot_id: int = 0) -> List[ConversationThread]:
+        """Именованные ветки пользователя в порядке создания."""
+        result = await session.execute(
+            select(ConversationThread)
+            .where(ConversationThread.user_id == user_id, ConversationThread.bot_id == bot_id)
+            .order_by(ConversationThread.created_at, ConversationThread.conversation_id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def switch(session: AsyncSession, user_id: int, conversation_id: int, bot_id: int = 0) -> bool:
+        """
+        Делает ветку активной. Текущая эпоха становится предыдущей,
+        поэтому безымянный диалог можно вернуть через /restore.
+
+        Returns:
+            False, если у пользователя нет такой ветки
+        """
+        thread = await session.get(ConversationThread, (user_id, bot_id, conversation_id))
+        if thread is None:
+            return False
+
+        if conversation_id == await ConversationService.get_current(session, user_id, bot_id):
+            return True
+
+        stmt = insert(UserState).values(
+            user_id=user_id,
+            bot_id=bot_id,
+            conversation_id=conversation_id,
+            previous_conversation_id=0,
+            next_conversation_id=conversation_id + 1,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserState.user_id, UserState.bot_id],
+            set_={
+                "previous_conversation_id": UserState.conversation_id,
+                "conversation_id": stmt.excluded.conversation_id,
+            },
+        )
+        await session.execute(_retire_previous(user_id, bot_id))
+        await session.execute(stmt)
+        await session.commit()
+        _remember(user_id, bot_id, conversation_id)
+        return True
+
+    @staticmethod
+    async def reclaim(session: AsyncSession, batch_size: Optional[int] = None) -> int:
+        """
+        Удаляет сообщения эпох из очереди очистки. Сообщения эпохи выбираются
+        по индексу (user_id, bot_id, conversation_id), поэтому стоимость
+        зависит от числа сброшенных эпох, а не от размера истории.
+        Каждая порция удаляется в отдельной транзакции, чтобы не держать
+        блокировку записи SQLite дольше нескольких миллисекунд.
+
+        Returns:
+            Количество удаленных сообщений
+        """
+        batch_size = batch_size or settings.HISTORY_RECLAIM_BATCH
+        deleted = 0
+
+        while True:
+            result = await session.execute(select(RetiredConversation).limit(1))
+            retired = result.scalar()
+            if retired is None:
+                break
+            user_id, bot_id, conversation_id = retired.user_id, retired.bot_id, retired.conversation_id
+
+            state = (await session.execute(
+                select(UserState.conversation_id, UserState.previous_conversation_id)
+                .where(UserState.user_id == user_id, UserState.bot_id == bot_id)
+            )).first()
+            kept = (
+                # Эпоху вернули (/switch на ветку) или она сама ветка
+                (state is not None and conversation_id in tuple(state))
+                or await session.get(ConversationThread, (user_id, bot_id, conversation_id)) is not None
+            )
+
+            count = 0
+            if not kept:
+                batch = (
+                    select(DialogHistory.id)
+                    .where(
+                        DialogHistory.user_id == user_id,
+                        DialogHistory.bot_id == bot_id,
+                        DialogHistory.conversation_id == conversation_id,
+                    )
+                    .limit(batch_size)
+                )
+                result = await session.execute(delete(DialogHistory).where(DialogHistory.id.in_(batch)))
+                count = result.rowcount
+            if count < batch_size:
+                await session.delete(retired)
+            await session.commit()
+            deleted += count
+
+            # Даем обработчикам пользователей выполниться между порциями
+            await asyncio.sleep(0)
+
+        return deleted
+
+
+async def run_scheduled_reclaim() -> None:
+    """Фоновая задача: удаление сообщений сброшенных эпох диалогов и ненужных вложений."""
+    async with AsyncSessionLocal() as session:
+        deleted = await ConversationService.reclaim(session)
+        # Вложения, на которые после удаления истории никто не ссылается
+        attachments = await AttachmentService.cleanup(session)
+
+    if deleted:
+        logger.info(f"🧹 Удалено сообщений из сброшенных диалогов: {deleted}")
+    if attachments:
+        logger.info(f"🧹 Удалено неиспользуемых вложений: {attachments}")
@@ -0,0 +1,125 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.models import DialogHistory
+
+EXPORT_FORMATS = ("jsonl", "md")
+
+
+class HistoryExporter:
+    """
+    Потоковая выгрузка истории пользователя.
+    Строки читаются порциями по ключу (id > последний id) через серверный курсор
+    и пишутся в сжатый файл теми же порциями, поэтому память не зависит от объема
+    истории. Сжатие и запись выполняются в потоке, чтобы не блокировать event loop.
+    """
+
+    @staticmethod
+    async def iter_messages(
+            session: AsyncSession,
+            user_id: int,
+            chunk_size: Optional[int] = None,
+            bot_id: int = 0,
+    ) -> AsyncIterator:
+        """
+        Перебирает сообщения пользователя от старых к новым.
+
+        Args:
+            session: Асинхронная сессия БД
+            user_id: ID пользователя Telegram
+            chunk_size: Размер порции (по умолчанию из настроек)
+            bot_id: Пространство имен бота
+        """
+        chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+        last_id = 0
+
+        while True:
+            stmt = (
+                select(DialogHistory.id, DialogHistory.role, DialogHistory.content, DialogHistory.timestamp)
+                .where(
+                    DialogHistory.user_id == user_id,
+                    DialogHistory.bot_id == bot_id,
+                    DialogHistory.id > last_id,
+                )
+                .order_by(DialogHistory.id)
+                .limit(chunk_size)
+            )
+
+            fetched = 0
+            result = await session.stream(stmt)
+            async for row in result:
+                fetched += 1
+                last_id = row.id
+                yield row
+
+            if fetched < chunk_size:
+                break
+
+    @staticmethod
+    def _format_row(row, fmt: str) -> str:
+        timestamp = row.timestamp.isoformat() if row.timestamp else None
+
+        if fmt == "jsonl":
+            record = {"id": row.id, "role": row.role, "content": row.content, "timestamp": timestamp}
+            return json.dumps(record, ensure_ascii=False) + "\n"
+
+        author = "👤 Пользователь" if row.role == "user" else "🤖 Ассистент"
+        return f"### {author} · {timestamp}\n\n{row.content}\n\n"
+
+    @staticmethod
+    async def export_to_file(
+            session: AsyncSession,
+            user_id: int,
+            fmt: str = "jsonl",
+            destination: Optional[Path] = None,
+            bot_id: int = 0,
+    ) -> Tuple[Path, int]:
+        """
+        Выгружает историю пользователя в сжатый gzip файл.
+
+        Args:
+            session: Асинхронная сессия БД
+            user_id: ID пользователя Telegram
+            fmt: Формат: 'jsonl' или 'md'
+            destination: Путь к файлу (по умолчанию временный файл)
+            bot_id: Пространство имен бота
+
+        Returns:
+            Путь к файлу и количество выгруженных сообщений
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Формат должен быть одним из: {', '.join(EXPORT_FORMATS)}")
+
+        if destination is None:
+            fd, name = tempfile.mkstemp(prefix=f"history_{user_id}_", suffix=f".{fmt}.gz")
+            os.close(fd)
+            destination = Path(name)
+
+        count = 0
+        batch = [f"# История диалога пользователя {user_id}\n\n"] if fmt == "md" else []
+        try:
+            file = await asyncio.to_thread(gzip.open, destination, "wt", encoding="utf-8", compresslevel=6)
+            try:
+                async for row in HistoryExporter.iter_messages(session, user_id, bot_id=bot_id):
+                    batch.append(HistoryExporter._format_row(row, fmt))
+                    count += 1
+                    if len(batch) >= settings.EXPORT_CHUNK_SIZE:
+                        await asyncio.to_thread(file.write, "".join(batch))
+                        batch.clear()
+                if batch:
+                    await asyncio.to_thread(file.write, "".join(batch))
+            finally:
+                await asyncio.to_thread(file.close)
+        except BaseException:
+            # Недописанный файл не оставляем: вызывающий код получает только исключение
+            destination.unlink(missing_ok=True)
+            raise
+
+        return destination, count
@@ -0,0 +1,242 @@
+"""
+Преобразование Markdown из ответов моделей в HTML для Telegram.
+
+Ответ разбирается за один проход по строкам: блоки кода, заголовки,
+списки и строчная разметка (**жирный**, *курсив*, ~~зачеркнутый~~,
+`код`, [ссылки](https://...)). Непарные маркеры остаются обычным текстом,
+а весь текст экранируется, поэтому Telegram никогда не отклоняет разметку.
+
+Длинные ответы делятся на части не длиннее лимита Telegram с учетом тегов:
+открытые теги закрываются в конце части и открываются заново в следующей.
+"""
+import html
+import re
+from typing import List, Tuple
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+_FENCE_RE = re.compile(r"^\s*```\s*([\w+#.-]*)\s*$")
+_HEADING_RE = re.compile(r"^#{1,6}\s+(.*)$")
+_LIST_RE = re.compile(r"^(\s*)[-*+]\s+")
+_LINK_RE = re.compile(r"\[([^\]\n]+)\]\((https?://[^\s)]+)\)")
+
+# Маркер -> тег Telegram HTML (двухсимвольные проверяются раньше)
+_MARKERS = {"**": "b", "__": "b", "~~": "s", "*": "i", "_": "i"}
+
+Token = Tuple[str, ...]
+
+
+def _text_len(text: str) -> int:
+    """Длина в единицах UTF-16: так Telegram считает лимит сообщения."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum()
+
+
+def _parse_inline(line: str, tokens: List[Token]) -> None:
+    """Разбирает строчную разметку одной строки и добавляет токены."""
+    stack: List[Tuple[str, int]] = []  # (маркер, индекс токена-заглушки)
+    text: List[str] = []
+    i, length = 0, len(line)
+
+    def flush() -> None:
+        if text:
+            tokens.append(("text", "".join(text)))
+            text.clear()
+
+    while i < length:
+        char = line[i]
+
+        if char == "`":
+            end = line.find("`", i + 1)
+            if end > i + 1:
+                flush()
+                tokens.extend([("open", "code", ""), ("text", line[i + 1:end]), ("close", "code")])
+                i = end + 1
+                continue
+
+        if char == "[":
+            match = _LINK_RE.match(line, i)
+            if match:
+                flush()
+                href = html.escape(match.group(2), quote=True)
+                tokens.extend([("open", "a", f' href="{href}"'), ("text", match.group(1)), ("close", "a")])
+                i = match.end()
+                continue
+
+        marker = line[i:i + 2] if line[i:i + 2] in _MARKERS else char if char in _MARKERS else None
+        if marker:
+            before = line[i - 1] if i > 0 else " "
+            after = line[i + len(marker)] if i + len(marker) < length else " "
+            opened = [entry[0] for entry in stack]
+
+            # Подчеркивание внутри слова (snake_case) - не разметка
+            intraword = marker[0] == "_" and (_is_word(before) and _is_word(after))
+            can_close = marker in opened and not before.isspace() and not intraword
+            can_open = not after.isspace() and not intraword
+
+            if can_close:
+                flush()
+                # Маркеры, открытые позже и не закрытые, становятся текстом
+                while stack[-1][0] != marker:
+                    stale, position = stack.pop()
+                    tokens[position] = ("text", stale)
+                _, position = stack.pop()
+                tokens[position] = ("open", _MARKERS[marker], "")
+                tokens.append(("close", _MARKERS[marker]))
+                i += len(marker)
+                continue
+
+            if can_open:
+                flush()
+                stack.append((marker, len(tokens)))
+                tokens.append(("text", marker))  # Заглушка до закрывающего маркера
+                i += len(marker)
+                continue
+
+        text.append(char)
+        i += 1
+
+    flush()
+    # Незакрытые маркеры уже записаны как текст-заглушки
+
+
+def markdown_to_tokens(source: str) -> List[Token]:
+    """
+    Разбирает Markdown в плоский список токенов:
+    ("text", текст), ("open", тег, атрибуты), ("close", тег).
+    """
+    tokens: List[Token] = []
+    lines = source.replace("\r\n", "\n").split("\n")
+    in_code = False
+
+    for number, line in enumerate(lines):
+        newline = number < len(lines) - 1
+
+        fence = _FENCE_RE.match(line)
+        if fence:
+            if in_code:
+                tokens.extend([("close", "code"), ("close", "pre")])
+            else:
+                language = fence.group(1)
+                attrs = f' class="language-{html.escape(language, quote=True)}"' if language else ""
+                tokens.extend([("open", "pre", ""), ("open", "code", attrs)])
+            in_code = not in_code
+            continue
+
+        if in_code:
+            tokens.append(("text", line + ("\n" if newline else "")))
+            continue
+
+        heading = _HEADING_RE.match(line)
+        if heading:
+            tokens.append(("open", "b", ""))
+            _parse_inline(heading.group(1), tokens)
+            tokens.append(("close", "b"))
+        else:
+            bullet = _LIST_RE.match(line)
+            if bullet:
+                tokens.append(("text", f"{bullet.group(1)}• "))
+                line = line[bullet.end():]
+            _parse_inline(line, tokens)
+
+        if newline:
+            tokens.append(("text", "\n"))
+
+    if in_code:
+        tokens.extend([("close", "code"), ("close", "pre")])
+    return tokens
+
+
+def _render(token: Token) -> str:
+    kind = token[0]
+    if kind == "text":
+        return html.escape(token[1], quote=False)
+    if kind == "open":
+        return f"<{token[1]}{token[2]}>"
+    return f"</{token[1]}>"
+
+
+def markdown_to_html(source: str) -> str:
+    """Преобразует Markdown в Telegram HTML одной строкой (без разбиения)."""
+    return "".join(_render(token) for token in markdown_to_tokens(source))
+
+
+def _split_point(text: str, space: int) -> Tuple[int, bool]:
+    """
+    Позиция разреза текста не дальше space единиц UTF-16.
+    Предпочитается граница абзаца, затем строки, затем пробел.
+
+    Returns:
+        Позиция и признак того, что разрез пришелся на естественную границу
+    """
+    cut, units = 0, 0
+    for char in text:
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > space:
+            break
+        cut += 1
+
+    for separator in ("\n\n", "\n", " "):
+        position = text.rfind(separator, 0, cut)
+        if position > 0:
+            return position + len(separator), True
+    return cut, False
+
+
+def split_tokens(tokens: List[Token], limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Собирает HTML-части, в каждой не больше limit видимых символов.
+    Теги, открытые на границе, закрываются и переоткрываются в следующей части.
+    """
+    chunks: List[str] = []
+    stack: List[Token] = []
+    parts: List[str] = []
+    size = 0
+
+    def finish() -> None:
+        nonlocal parts, size
+        if size:
+            closing = "".join(f"</{token[1]}>" for token in reversed(stack))
+            chunks.append("".join(parts) + closing)
+        parts = [_render(token) for token in stack]
+        size = 0
+
+    for token in tokens:
+        if token[0] == "open":
+            stack.append(token)
+            parts.append(_render(token))
+            continue
+        if token[0] == "close":
+            stack.pop()
+            parts.append(_render(token))
+            continue
+
+        text = token[1]
+        while text:
+            length = _text_len(text)
+            if length <= limit - size:
+                parts.append(_render(("text", text)))
+                size += length
+                break
+
+            cut, natural = _split_point(text, limit - size)
+            # Лучше начать новую часть, чем резать слово посередине
+            if size and (cut == 0 or not natural):
+                finish()
+                continue
+
+            parts.append(_render(("text", text[:cut])))
+            size += _text_len(text[:cut])
+            finish()
+            text = text[cut:]
+
+    finish()
+    return chunks
+
+
+def format_reply(source: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Markdown ответа модели -> список HTML-сообщений для отправки по порядку."""
+    return split_tokens(markdown_to_tokens(source), limit) or [html.escape(source or "…", quote=False)]
@@ -1,19 +1,28 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from sqlalchemy import select, desc, delete
 from sqlalchemy.ext.asyncio import AsyncSession
-from bot.models import DialogHistory
+from bot.models import Attachment, DialogHistory
 from bot.config import settings
+from bot.services.attachments import render_attachment
+from bot.services.limits import UsageService
+from bot.services.stats import StatsService
+from bot.services.tracing import traced
 
 
 class HistoryService:
     """Сервис для управления историей диалогов пользователя."""
 
     @staticmethod
+    @traced("history.add_message")
     async def add_message(
             session: AsyncSession,
             user_id: int,
             role: str,
             content: str,
+            bot_id: int = 0,
+            conversation_id: int = 0,
+            attachment_id: Optional[int] = None,
+            author_id: Optional[int] = None,
     ) -> DialogHistory:
         """
         Сохраняет одно сообщение в истории диалога.
@@ -23,6 +32,10 @@ class HistoryService:
             user_id: ID пользователя Telegram
             role: Роль отправителя ('user' или 'assistant')
             content: Текст сообщения
+            bot_id: Пространство имен бота
+            conversation_id: Эпоха диалога (см. ConversationService)
+            attachment_id: Приложенный документ (см. AttachmentService)
+            author_id: Автор сообщения для статистики, если он не владелец истории (группы)
 
         Returns:
             Созданная запись в истории
@@ -34,32 +47,51 @@ class HistoryService:
         # Создаем новую запись
         message = DialogHistory(
             user_id=user_id,
+            bot_id=bot_id,
+            conversation_id=conversation_id,
             role=role,
             content=content,
+            attachment_id=attachment_id,
         )
 
-        # Сохраняем в БД
+        # Сохраняем в БД вместе с обновлением агрегатов статистики и счетчика лимита
         session.add(message)
+        await StatsService.record_message(
+            session, author_id if author_id is not None else user_id, role, bot_id=bot_id
+        )
+        if role == "user":
+            await UsageService.increment(session, user_id, bot_id)
         await session.commit()
         await session.refresh(message)
 
         return message
 
     @staticmethod
+    @traced("history.get_recent_history")
     async def get_recent_history(
             session: AsyncSession,
             user_id: int,
             limit: int = None,
+            bot_id: int = 0,
+            conversation_id: int = 0,
+            expand_attachments: bool = True,
     ) -> List[Tuple[str, str]]:
         """
         Получает последние сообщения пользователя для формирования контекста.
         Возвращает список кортежей (role, content).
 
+        Текст документа подставляется только для последнего вложения в окне
+        (expand_attachments=False - ни для одного, когда документ приложен
+        к текущему сообщению), остальные вложения упоминаются по имени.
+
         Args:
             session: Асинхронная сессия БД
             user_id: ID пользователя Telegram
             limit: Максимальное количество возвращаемых сообщений
                    (по умолчанию из настроек)
+            bot_id: Пространство имен бота
+            conversation_id: Эпоха диалога (см. ConversationService)
+            expand_attachments: Подставлять ли текст последнего документа
 
         Returns:
             Список последних сообщений в формате для OpenAI API
@@ -71,8 +103,13 @@ class HistoryService:
 
         # Запрос последних сообщений пользователя
         stmt = (
-            select(DialogHistory.role, DialogHistory.content)
-            .where(DialogHistory.user_id == user_id)
+            select(DialogHistory.role, DialogHistory.content, DialogHistory.attachment_id, Attachment.file_name)
+            .outerjoin(Attachment, Attachment.id == DialogHistory.attachment_id)
+            .where(
+                DialogHistory.user_id == user_id,
+                DialogHistory.bot_id == bot_id,
+                DialogHistory.conversation_id == conversation_id,
+            )
             .order_by(desc(DialogHistory.timestamp))
             .limit(limit)
         )
@@ -80,22 +117,41 @@ class HistoryService:
         result = await session.execute(stmt)
         rows = result.fetchall()
 
+        # Текст загружается только для самого нового вложения в окне
+        expanded = None
+        if expand_attachments:
+            latest_id = next((row.attachment_id for row in rows if row.file_name is not None), None)
+            if latest_id is not None:
+                expanded = await session.get(Attachment, latest_id)
+
         # Переворачиваем порядок (от старых к новым) для корректного контекста
-        history = [(row.role, row.content) for row in rows[::-1]]
+        history = []
+        for row in rows[::-1]:
+            content = row.content
+            if row.file_name is not None:
+                if expanded is not None and row.attachment_id == expanded.id:
+                    content = render_attachment(content, row.file_name, expanded.text, expanded.truncated)
+                else:
+                    content = render_attachment(content, row.file_name)
+            history.append((row.role, content))
         return history
 
     @staticmethod
+    @traced("history.clear_user_history")
     async def clear_user_history(
             session: AsyncSession,
             user_id: int,
+            bot_id: int = 0,
     ) -> int:
         """
-        Полностью очищает историю диалогов для указанного пользователя.
-        Используется по команде /start и кнопке "Новый запрос".
+        Полностью удаляет историю диалогов пользователя (все эпохи).
+        Для сброса контекста используется ConversationService.start_new,
+        который не блокирует базу массовым DELETE.
 
         Args:
             session: Асинхронная сессия БД
             user_id: ID пользователя Telegram
+            bot_id: Пространство имен бота
 
         Returns:
             Количество удаленных записей
@@ -103,7 +159,7 @@ class HistoryService:
         
         stmt = (
             delete(DialogHistory)
-            .where(DialogHistory.user_id == user_id)
+            .where(DialogHistory.user_id == user_id, DialogHistory.bot_id == bot_id)
         )
 
         result = await session.execute(stmt)
@@ -113,10 +169,12 @@ class HistoryService:
         return deleted_count
 
     @staticmethod
+    @traced("history.get_message_count")
     async def get_message_count(
             session: AsyncSession,
             user_id: int,
             role: str = None,
+            bot_id: int = 0,
     ) -> int:
         """
         Подсчитывает количество сообщений пользователя.
@@ -125,11 +183,12 @@ class HistoryService:
             session: Асинхронная сессия БД
             user_id: ID пользователя Telegram
             role: Фильтр по роли ('user', 'assistant' или None)
+            bot_id: Пространство имен бота
 
         Returns:
             Количество сообщений
         """
-        stmt = select(DialogHistory).where(DialogHistory.user_id == user_id)
+        stmt = select(DialogHistory).where(DialogHistory.user_id == user_id, DialogHistory.bot_id == bot_id)
 
         if role:
             stmt = stmt.where(DialogHistory.role == role)
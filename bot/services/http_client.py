@@ -0,0 +1,114 @@
+import importlib.util
+import logging
+from typing import Optional
+import httpx
+from bot.config import settings
+from bot.services.recording import RecordingTransport, ReplayStore, ReplayTransport, TrafficRecorder
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_BASE_URL = settings.OPENROUTER_BASE_URL
+
+
+def _http2_available() -> bool:
+    """Проверяет, установлен ли пакет h2, необходимый httpx для HTTP/2."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def build_timeout(model: Optional[str] = None) -> httpx.Timeout:
+    """
+    Собирает таймауты httpx для модели.
+    Значения из OPENROUTER_MODEL_TIMEOUTS перекрывают общие настройки.
+    """
+    overrides = settings.OPENROUTER_MODEL_TIMEOUTS.get(model, {}) if model else {}
+
+    return httpx.Timeout(
+        connect=overrides.get("connect", settings.HTTP_CONNECT_TIMEOUT),
+        read=overrides.get("read", settings.HTTP_READ_TIMEOUT),
+        write=overrides.get("write", settings.HTTP_WRITE_TIMEOUT),
+        pool=overrides.get("pool", settings.HTTP_POOL_TIMEOUT),
+    )
+
+
+def get_total_timeout(model: Optional[str] = None) -> float:
+    """Возвращает общий таймаут (в секундах) на один запрос к модели."""
+    overrides = settings.OPENROUTER_MODEL_TIMEOUTS.get(model, {}) if model else {}
+    return overrides.get("total", settings.HTTP_TOTAL_TIMEOUT)
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """
+    Создает общий httpx-клиент с пулом соединений и keep-alive.
+    С HTTP_REPLAY_FILE ответы берутся из записи, с HTTP_RECORD_FILE - записываются.
+    """
+    if settings.HTTP_REPLAY_FILE:
+        logger.warning(f"📼 Запросы к OpenRouter обслуживаются из записи {settings.HTTP_REPLAY_FILE}")
+        transport = ReplayTransport(ReplayStore.load(settings.HTTP_REPLAY_FILE), speed=settings.HTTP_REPLAY_SPEED)
+        return httpx.AsyncClient(transport=transport, timeout=build_timeout())
+
+    http2 = settings.HTTP2_ENABLED and _http2_available()
+    if settings.HTTP2_ENABLED and not http2:
+        logger.warning("⚠️ HTTP/2 включен, но пакет h2 не установлен. Используется HTTP/1.1")
+
+    limits = httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+    transport: httpx.AsyncBaseTransport = httpx.AsyncHTTPTransport(http2=http2, limits=limits)
+    if settings.HTTP_RECORD_FILE:
+        logger.info(f"📼 Трафик к OpenRouter записывается в {settings.HTTP_RECORD_FILE}")
+        recorder = TrafficRecorder(settings.HTTP_RECORD_FILE, redact=settings.HTTP_RECORD_REDACT)
+        transport = RecordingTransport(transport, recorder, OPENROUTER_BASE_URL)
+
+    return httpx.AsyncClient(transport=transport, timeout=build_timeout())
+
+
+# Общий HTTP-клиент для всех исходящих запросов бота (кроме Telegram API)
+http_client: httpx.AsyncClient = build_http_client()
+
+
+async def warmup_http_client(url: str = OPENROUTER_BASE_URL) -> bool:
+    """
+    Прогревает пул: заранее устанавливает TCP/TLS соединение с OpenRouter,
+    чтобы первый запрос пользователя не платил за handshake.
+    """
+    if settings.HTTP_REPLAY_FILE:
+        return True  # Соединений нет: ответы берутся из записи
+    try:
+        response = await http_client.head(url, timeout=settings.HTTP_CONNECT_TIMEOUT * 2)
+        logger.info(f"🔥 Соединение с {url} прогрето (HTTP {response.status_code}, {response.http_version})")
+        return True
+    except httpx.HTTPError as e:
+        logger.warning(f"⚠️ Не удалось прогреть соединение с {url}: {e}")
+        return False
+
+
+def get_pool_stats() -> dict:
+    """Возвращает метрики использования пула соединений."""
+
+    # httpx не предоставляет публичного API для пула, поэтому читаем его осторожно
+    transport = getattr(http_client, "_transport", None)
+    transport = getattr(transport, "inner", transport)  # RecordingTransport
+    pool = getattr(transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+
+    idle = sum(1 for conn in connections if conn.is_idle())
+    active = len(connections) - idle
+
+    return {
+        "connections": len(connections),
+        "active": active,
+        "idle": idle,
+        "max_connections": settings.HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        "utilization": round(active / settings.HTTP_MAX_CONNECTIONS, 3) if settings.HTTP_MAX_CONNECTIONS else 0.0,
+        "http2": settings.HTTP2_ENABLED and _http2_available(),
+    }
+
+
+async def close_http_client() -> None:
+    """Закрывает общий HTTP-клиент и все соединения пула."""
+    await http_client.aclose()
+    print("✅ HTTP-соединения закрыты")
@@ -0,0 +1,103 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.database import AsyncSessionLocal
+from bot.models import ProcessedUpdate
+from bot.services.profiling import register_structure
+from bot.services.snapshot import snapshot_service
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyStore:
+    """
+    Хранилище ключей принятых обновлений.
+    Недавние обработанные ключи проверяются в ограниченном наборе в памяти,
+    а таблица processed_updates переживает перезапуск: обновление, доставленное
+    повторно, отбрасывается до обращения к БД истории и к модели.
+
+    Ключ захватывается до обработчика и отмечается обработанным после него.
+    Если обработчик упал, захват снимается; если процесс остановился посреди
+    обработки, захват считается брошенным через IDEMPOTENCY_CLAIM_TIMEOUT.
+    Так повторная доставка после сбоя все же получает ответ.
+    """
+
+    def __init__(self, max_size: Optional[int] = None) -> None:
+        self.max_size = max_size or settings.IDEMPOTENCY_CACHE_SIZE
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        register_structure("IdempotencyStore._recent", lambda: self._recent)
+
+    def dump_state(self) -> list:
+        return list(self._recent)
+
+    def load_state(self, keys: list) -> None:
+        for key in keys:
+            self._remember(key)
+
+    def _remember(self, key: str) -> None:
+        self._recent[key] = None
+        while len(self._recent) > self.max_size:
+            self._recent.popitem(last=False)
+
+    async def claim(self, session: AsyncSession, key: str, timeout: Optional[int] = None) -> bool:
+        """
+        Атомарно захватывает обновление для обработки.
+
+        Returns:
+            True, если обновление пришло впервые (или прежняя обработка
+            брошена) и его нужно обработать
+        """
+        if key in self._recent:
+            return False
+
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=timeout if timeout is not None else settings.IDEMPOTENCY_CLAIM_TIMEOUT)
+        stmt = insert(ProcessedUpdate).values(key=key, created_at=now, done=False)
+        result = await session.execute(stmt.on_conflict_do_update(
+            index_elements=[ProcessedUpdate.key],
+            set_={"created_at": now},
+            where=ProcessedUpdate.done.is_(False) & (ProcessedUpdate.created_at < stale),
+        ))
+        await session.commit()
+        return bool(result.rowcount)
+
+    async def complete(self, session: AsyncSession, key: str) -> None:
+        """Отмечает обновление обработанным: повторные доставки отбрасываются."""
+        await session.execute(update(ProcessedUpdate).where(ProcessedUpdate.key == key).values(done=True))
+        await session.commit()
+        self._remember(key)
+
+    @staticmethod
+    async def release(session: AsyncSession, key: str) -> None:
+        """Снимает захват после ошибки обработчика: повторная доставка будет обработана."""
+        await session.execute(
+            delete(ProcessedUpdate).where(ProcessedUpdate.key == key, ProcessedUpdate.done.is_(False))
+        )
+        await session.commit()
+
+    @staticmethod
+    async def cleanup(session: AsyncSession, ttl: Optional[int] = None) -> int:
+        """Удаляет ключи старше ttl секунд. Возвращает количество удаленных строк."""
+        threshold = datetime.utcnow() - timedelta(seconds=ttl or settings.IDEMPOTENCY_TTL)
+        result = await session.execute(delete(ProcessedUpdate).where(ProcessedUpdate.created_at < threshold))
+        await session.commit()
+        return result.rowcount
+
+
+# Глобальный экземпляр хранилища
+idempotency_store = IdempotencyStore()
+snapshot_service.register("idempotency", idempotency_store.dump_state, idempotency_store.load_state)
+
+
+async def run_idempotency_cleanup() -> None:
+    """Фоновая задача: удаление устаревших ключей обновлений."""
+    async with AsyncSessionLocal() as session:
+        deleted = await IdempotencyStore.cleanup(session)
+
+    if deleted:
+        logger.info(f"🧹 Удалено устаревших ключей обновлений: {deleted}")
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from bot.config import settings
+from bot.database import AsyncSessionLocal
+from bot.services.history import HistoryService
+from bot.services.openrouter import openrouter_service
+from bot.services.profiling import register_structure
+from bot.services.snapshot import snapshot_service
+from bot.services.stats import StatsService
+
+logger = logging.getLogger(__name__)
+
+# Эпоха истории для вопросов из inline-режима: не попадает в контекст чата
+# и не удаляется фоновой очисткой, но учитывается в дневном лимите.
+INLINE_CONVERSATION_ID = -1
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Нормализует запрос для ключа кэша: регистр, пробелы, финальная пунктуация."""
+    return _SPACES_RE.sub(" ", query.lower()).strip().rstrip("?!.…")
+
+
+class InlineAnswerService:
+    """
+    Ответы на inline-запросы (@bot вопрос).
+    Telegram присылает запрос на каждое нажатие клавиши, поэтому:
+    - модель вызывается только после паузы в наборе (INLINE_DEBOUNCE);
+    - тот же запрос, пока ответ готовится, ждет уже запущенную задачу;
+    - новый запрос отменяет устаревшую задачу пользователя, в том числе
+      уже отправленный в модель запрос;
+    - готовые ответы хранятся в LRU-кэше с коротким TTL;
+    - вопрос и ответ записываются в историю (дневной лимит) и статистику
+      самой задачей, даже если ответ готов уже после INLINE_TIMEOUT
+      и пользователь получит его из кэша.
+    """
+
+    def __init__(self) -> None:
+        # (bot_id, нормализованный запрос) -> (момент устаревания, ответ)
+        self._cache: "OrderedDict[Tuple[int, str], Tuple[float, str]]" = OrderedDict()
+        # (bot_id, user_id) -> (ключ запроса, задача)
+        self._pending: Dict[Tuple[int, int], Tuple[Tuple[int, str], asyncio.Task]] = {}
+        register_structure("InlineAnswerService._cache", lambda: self._cache)
+
+    def get_cached(self, bot_id: int, query: str) -> Optional[str]:
+        key = (bot_id, normalize_query(query))
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry[1]
+
+    def dump_state(self) -> list:
+        """Неустаревшие ответы; срок жизни переводится в Unix-время."""
+        now_monotonic, now = time.monotonic(), time.time()
+        return [
+            [bot_id, query, now + (expires - now_monotonic), answer]
+            for (bot_id, query), (expires, answer) in list(self._cache.items())
+            if expires > now_monotonic
+        ]
+
+    def load_state(self, records: list) -> None:
+        now_monotonic, now = time.monotonic(), time.time()
+        for bot_id, query, expires_at, answer in records:
+            if expires_at > now:
+                self._cache[(bot_id, query)] = (now_monotonic + (expires_at - now), answer)
+
+    def _store(self, key: Tuple[int, str], answer: str) -> None:
+        self._cache[key] = (time.monotonic() + settings.INLINE_CACHE_TTL, answer)
+        self._cache.move_to_end(key)
+        while len(self._cache) > settings.INLINE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    async def _complete(
+            self,
+            key: Tuple[int, str],
+            user_id: int,
+            query: str,
+            system_prompt: str,
+            models: List[str],
+    ) -> dict:
+        # Пауза в наборе: если пользователь продолжит печатать, задача будет отменена
+        await asyncio.sleep(settings.INLINE_DEBOUNCE)
+
+        messages = openrouter_service.format_messages_from_history([], query, system_prompt=system_prompt)
+        response = await openrouter_service.chat_completion(
+            messages=messages,
+            max_tokens=settings.INLINE_MAX_TOKENS,
+            temperature=0.7,
+            models=models,
+        )
+        if response["success"]:
+            self._store(key, response["content"])
+            # Учет не прерывается более новым запросом: ответ уже в кэше
+            await asyncio.shield(self._record(key[0], user_id, query, response))
+        return response
+
+    @staticmethod
+    async def _record(bot_id: int, user_id: int, query: str, response: dict) -> None:
+        """Inline-вопросы учитываются в дневном лимите так же, как сообщения в чате."""
+        try:
+            async with AsyncSessionLocal() as session:
+                await HistoryService.add_message(
+                    session, user_id, "user", query, bot_id=bot_id, conversation_id=INLINE_CONVERSATION_ID
+                )
+                await HistoryService.add_message(
+                    session, user_id, "assistant", response["content"],
+                    bot_id=bot_id, conversation_id=INLINE_CONVERSATION_ID,
+                )
+                await StatsService.record_completion(session, response, bot_id=bot_id)
+        except Exception:
+            logger.exception(f"Не удалось учесть inline-ответ пользователю {user_id}")
+            return
+        logger.info(f"✅ Inline-ответ пользователю {user_id} от модели {response['model_used']}")
+
+    async def answer(
+            self,
+            user_id: int,
+            query: str,
+            system_prompt: str,
+            models: List[str],
+            bot_id: int = 0,
+    ) -> Optional[dict]:
+        """
+        Получает ответ модели на inline-запрос с учетом паузы в наборе.
+
+        Returns:
+            Результат chat_completion; {"success": False, "pending": True}, если
+            ответ не успел подготовиться за INLINE_TIMEOUT (он продолжает
+            готовиться и попадет в кэш); None, если запрос вытеснен более новым
+        """
+        key = (bot_id, normalize_query(query))
+        user_key = (bot_id, user_id)
+
+        pending = self._pending.get(user_key)
+        if pending is not None and pending[0] == key and not pending[1].done():
+            task = pending[1]
+        else:
+            if pending is not None:
+                pending[1].cancel()
+            task = asyncio.create_task(self._complete(key, user_id, query, system_prompt, models), name=f"inline:{user_id}")
+            task.add_done_callback(lambda done: self._forget(user_key, done))
+            self._pending[user_key] = (key, task)
+
+        try:
+            # shield: таймаут ответа Telegram не отменяет подготовку ответа для кэша
+            response = await asyncio.wait_for(asyncio.shield(task), settings.INLINE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return {"success": False, "pending": True}
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            # Задачу отменил более новый запрос пользователя
+            return None
+        return response
+
+    def _forget(self, user_key: Tuple[int, int], task: asyncio.Task) -> None:
+        pending = self._pending.get(user_key)
+        if pending is not None and pending[1] is task:
+            del self._pending[user_key]
+
+
+# Глобальный экземпляр сервиса
+inline_service = InlineAnswerService()
+snapshot_service.register("inline_cache", inline_service.dump_state, inline_service.load_state)
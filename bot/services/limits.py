@@ -0,0 +1,162 @@
+"""
+Счетчики дневного лимита запросов.
+
+Вместо подсчета сообщений пользователя за 24 часа в dialog_history при
+каждой проверке лимит хранится в таблице usage_counters: одна строка на
+пользователя (или групповой чат) с числом запросов текущего окна и его
+началом. Счетчик увеличивается в той же транзакции, что и запись сообщения
+пользователя в историю, поэтому проверка - чтение по первичному ключу,
+а время сброса известно точно.
+
+Окно истекает в зависимости от LIMIT_RESET_MODE: rolling - через 24 часа
+после первого запроса окна, calendar - в полночь по LIMIT_TIMEZONE. Режим
+rolling - фиксированное окно, а не скользящие 24 часа, как при подсчете по
+истории: на стыке двух окон за сутки можно потратить до двух лимитов. Это
+осознанная плата за проверку одним чтением. Истекшее
+окно сбрасывается при следующем запросе, а фоновая задача обнуляет истекшие
+счетчики и удаляет строки давно неактивных пользователей. В той же строке
+хранится индивидуальный лимит, назначенный администратором.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.database import AsyncSessionLocal
+from bot.models import UsageCounter
+from bot.storage import EPOCH
+
+logger = logging.getLogger(__name__)
+
+ROLLING_WINDOW = timedelta(hours=24)
+
+
+class Usage(NamedTuple):
+    """Состояние лимита пользователя."""
+
+    count: int
+    limit_override: Optional[int]
+    reset_at: Optional[datetime]  # UTC; None - окно не открыто
+
+
+def _local_midnight(moment: datetime, days: int = 0) -> datetime:
+    """Полночь (в UTC) дня moment по LIMIT_TIMEZONE, сдвинутого на days дней."""
+    zone = ZoneInfo(settings.LIMIT_TIMEZONE)
+    local = moment.replace(tzinfo=timezone.utc).astimezone(zone)
+    midnight = datetime.combine(local.date() + timedelta(days=days), datetime.min.time(), tzinfo=zone)
+    return midnight.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def window_bounds(now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """
+    Returns:
+        (порог, начало нового окна): окно, начатое раньше порога, истекло
+    """
+    now = now or datetime.utcnow()
+    if settings.LIMIT_RESET_MODE == "calendar":
+        start = _local_midnight(now)
+        return start, start
+    return now - ROLLING_WINDOW, now
+
+
+def reset_time(window_start: datetime) -> datetime:
+    """Момент сброса окна (UTC)."""
+    if settings.LIMIT_RESET_MODE == "calendar":
+        return _local_midnight(window_start, days=1)
+    return window_start + ROLLING_WINDOW
+
+
+def format_reset_time(reset_at: datetime) -> str:
+    """Время сброса для пользователя в LIMIT_TIMEZONE."""
+    local = reset_at.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(settings.LIMIT_TIMEZONE))
+    return local.strftime("%H:%M %d.%m.%Y")
+
+
+class UsageService:
+    """Чтение и обновление счетчиков дневного лимита."""
+
+    @staticmethod
+    async def get(session: AsyncSession, user_id: int, bot_id: int = 0) -> Usage:
+        result = await session.execute(
+            select(UsageCounter.count, UsageCounter.window_start, UsageCounter.limit_override)
+            .where(UsageCounter.bot_id == bot_id, UsageCounter.user_id == user_id)
+        )
+        row = result.one_or_none()
+        if row is None:
+            return Usage(0, None, None)
+
+        count, window_start, limit_override = row
+        threshold, _ = window_bounds()
+        if window_start < threshold:
+            return Usage(0, limit_override, None)
+        return Usage(count, limit_override, reset_time(window_start))
+
+    @staticmethod
+    async def increment(session: AsyncSession, user_id: int, bot_id: int = 0, now: Optional[datetime] = None) -> None:
+        """
+        Учитывает запрос пользователя. Не делает commit: вызывается в той же
+        транзакции, что и запись сообщения в историю. Истекшее окно
+        начинается заново одним и тем же запросом.
+        """
+        threshold, start = window_bounds(now)
+        expired = UsageCounter.window_start < threshold
+        stmt = insert(UsageCounter).values(bot_id=bot_id, user_id=user_id, window_start=start, count=1)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[UsageCounter.bot_id, UsageCounter.user_id],
+            set_={
+                # В SET обе ветки видят прежнее window_start
+                "count": case((expired, 1), else_=UsageCounter.count + 1),
+                "window_start": case((expired, start), else_=UsageCounter.window_start),
+            },
+        ))
+
+    @staticmethod
+    async def set_override(session: AsyncSession, user_id: int, limit: Optional[int], bot_id: int = 0) -> None:
+        """Назначает индивидуальный лимит (None - вернуть лимит профиля)."""
+        # Новая строка без открытого окна: EPOCH всегда раньше порога
+        stmt = insert(UsageCounter).values(
+            bot_id=bot_id, user_id=user_id, window_start=EPOCH, count=0, limit_override=limit,
+        )
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[UsageCounter.bot_id, UsageCounter.user_id],
+            set_={"limit_override": limit},
+        ))
+        await session.commit()
+
+    @staticmethod
+    async def rollover(session: AsyncSession, now: Optional[datetime] = None) -> Tuple[int, int]:
+        """
+        Обнуляет истекшие счетчики и удаляет строки пользователей, неактивных
+        дольше LIMIT_PRUNE_DAYS и без индивидуального лимита.
+
+        Returns:
+            (сброшено, удалено)
+        """
+        now = now or datetime.utcnow()
+        threshold, _ = window_bounds(now)
+
+        reset = await session.execute(
+            update(UsageCounter)
+            .where(UsageCounter.window_start < threshold, UsageCounter.count > 0)
+            .values(count=0)
+        )
+        pruned = await session.execute(
+            delete(UsageCounter).where(
+                UsageCounter.window_start < now - timedelta(days=settings.LIMIT_PRUNE_DAYS),
+                UsageCounter.limit_override.is_(None),
+            )
+        )
+        await session.commit()
+        return reset.rowcount, pruned.rowcount
+
+
+async def run_scheduled_rollover() -> None:
+    """Фоновая задача: сброс истекших окон дневного лимита."""
+    async with AsyncSessionLocal() as session:
+        reset, pruned = await UsageService.rollover(session)
+
+    if reset or pruned:
+        logger.info(f"🔄 Счетчики лимитов: сброшено {reset}, удалено {pruned}")
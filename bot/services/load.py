@@ -0,0 +1,100 @@
+"""
+Мониторинг нагрузки event loop.
+
+Фоновая задача просыпается каждые LOOP_LAG_INTERVAL секунд и измеряет,
+насколько позже запланированного она получила управление: это задержка
+(lag) event loop - сколько ждет любая готовая к выполнению корутина.
+Вместе с числом обновлений в обработке она определяет, перегружен ли бот.
+Перцентили задержки за последние LOOP_LAG_WINDOW замеров доступны в /stats.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Optional
+from bot.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Коэффициент сглаживания задержки: один выброс не включает сброс нагрузки
+LAG_SMOOTHING = 0.3
+
+
+def percentile(values, fraction: float) -> float:
+    """Перцентиль по отсортированному списку (ближайший ранг)."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+class LoadMonitor:
+    """Задержка event loop и число обновлений в обработке."""
+
+    def __init__(self) -> None:
+        self._samples: Deque[float] = deque(maxlen=settings.LOOP_LAG_WINDOW)
+        self._task: Optional[asyncio.Task] = None
+        self.lag_ms = 0.0  # Сглаженная задержка
+        self.in_flight = 0
+        self.shed = 0
+        self.deferred = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._sample(), name="loop_lag_monitor")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _sample(self) -> None:
+        interval = settings.LOOP_LAG_INTERVAL
+        while True:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            self.record_lag(max(0.0, (time.perf_counter() - expected) * 1000))
+
+    def record_lag(self, lag_ms: float) -> None:
+        self._samples.append(lag_ms)
+        self.lag_ms = LAG_SMOOTHING * lag_ms + (1 - LAG_SMOOTHING) * self.lag_ms
+
+    @property
+    def overloaded(self) -> bool:
+        """Превышен ли хотя бы один из порогов нагрузки."""
+        if settings.LOAD_SHED_LAG_MS and self.lag_ms >= settings.LOAD_SHED_LAG_MS:
+            return True
+        return bool(settings.LOAD_SHED_MAX_IN_FLIGHT) and self.in_flight >= settings.LOAD_SHED_MAX_IN_FLIGHT
+
+    def stats(self) -> dict:
+        samples = sorted(self._samples)
+        return {
+            "lag_ms": {
+                "current": round(self.lag_ms, 1),
+                "p50": round(percentile(samples, 0.50), 1),
+                "p95": round(percentile(samples, 0.95), 1),
+                "p99": round(percentile(samples, 0.99), 1),
+                "max": round(samples[-1], 1) if samples else 0.0,
+                "samples": len(samples),
+            },
+            "in_flight": self.in_flight,
+            "overloaded": self.overloaded,
+            "shed": self.shed,
+            "deferred": self.deferred,
+            "loop": type(asyncio.get_running_loop()).__module__.split(".")[0],
+        }
+
+    def format(self) -> str:
+        """Строка для /stats администратора."""
+        stats = self.stats()
+        lag = stats["lag_ms"]
+        return (
+            f"Event loop ({stats['loop']}): задержка p50 {lag['p50']} мс, p95 {lag['p95']} мс, "
+            f"p99 {lag['p99']} мс; в обработке {stats['in_flight']}, "
+            f"отклонено {stats['shed']}, отложено {stats['deferred']}"
+        )
+
+
+# Глобальный монитор нагрузки
+load_monitor = LoadMonitor()
@@ -0,0 +1,315 @@
+"""
+Долговременная память: поиск релевантных старых сообщений пользователя.
+
+Каждое сообщение превращается в TF-вектор фиксированной размерности через
+хеширование слов (hashing trick), поэтому словарь не нужен и индекс
+обновляется инкрементально. При запросе векторы взвешиваются IDF по
+частотам в индексе пользователя и ранжируются по косинусной близости.
+Все вычисления локальные (NumPy), внешний сервис эмбеддингов не нужен.
+
+Память ограничена: не больше MEMORY_MAX_ITEMS векторов на пользователя
+(float16) и не больше MEMORY_CACHE_USERS индексов в памяти, вытесненные
+индексы сохраняются на диск и загружаются при следующем обращении.
+Чтение и запись файлов индексов (около мегабайта каждый) выполняются
+в потоке, чтобы не блокировать event loop.
+"""
+import asyncio
+import logging
+import re
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.models import DialogHistory
+from bot.services.profiling import register_structure
+
+try:
+    import numpy as np
+except ImportError:  # Без NumPy долговременная память отключается
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Слова обрезаются до префикса: грубая замена стемминга для русских окончаний
+STEM_LENGTH = 6
+
+
+def tokenize(text: str) -> List[str]:
+    return [token[:STEM_LENGTH] for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+
+def vectorize(text: str, dim: int):
+    """Сублинейный TF-вектор (1 + log tf) с хешированием слов в dim корзин."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokenize(text):
+        vector[zlib.crc32(token.encode("utf-8")) % dim] += 1.0
+    nonzero = vector > 0
+    vector[nonzero] = 1.0 + np.log(vector[nonzero])
+    return vector
+
+
+class UserMemoryIndex:
+    """Векторный индекс сообщений одного пользователя."""
+
+    def __init__(self, dim: int, max_items: int) -> None:
+        self.dim = dim
+        self.max_items = max_items
+        self.size = 0
+        self.last_id = 0
+        self.ids = np.zeros(64, dtype=np.int64)
+        self.vectors = np.zeros((64, dim), dtype=np.float16)
+        # Количество сообщений, в которых встречается признак (для IDF)
+        self.df = np.zeros(dim, dtype=np.int32)
+
+    def add(self, message_id: int, text: str) -> None:
+        # Параллельные синхронизации одного пользователя читают одни и те же
+        # новые сообщения: уже проиндексированные пропускаются
+        if message_id <= self.last_id:
+            return
+        if self.size == self.max_items:
+            self._drop_oldest(max(self.max_items // 4, 1))
+        if self.size == len(self.ids):
+            self._grow()
+
+        vector = vectorize(text, self.dim)
+        self.ids[self.size] = message_id
+        self.vectors[self.size] = vector
+        self.df += vector > 0
+        self.size += 1
+        self.last_id = max(self.last_id, message_id)
+
+    def _grow(self) -> None:
+        capacity = min(len(self.ids) * 2, self.max_items)
+        ids = np.zeros(capacity, dtype=np.int64)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float16)
+        ids[:self.size] = self.ids[:self.size]
+        vectors[:self.size] = self.vectors[:self.size]
+        self.ids, self.vectors = ids, vectors
+
+    def _drop_oldest(self, count: int) -> None:
+        # Сдвиг раз в count добавлений: амортизированно O(1) на сообщение
+        self.df -= (self.vectors[:count] > 0).sum(axis=0, dtype=np.int32)
+        self.ids[:self.size - count] = self.ids[count:self.size]
+        self.vectors[:self.size - count] = self.vectors[count:self.size]
+        self.size -= count
+
+    def query(self, text: str, limit: int, min_score: float) -> List[Tuple[int, float]]:
+        """Ближайшие сообщения: список (id, косинусная близость) по убыванию."""
+        if self.size == 0:
+            return []
+
+        idf = np.log((self.size + 1) / (self.df + 1)).astype(np.float32) + 1.0
+        query = vectorize(text, self.dim) * idf
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return []
+
+        matrix = self.vectors[:self.size].astype(np.float32) * idf
+        norms = np.linalg.norm(matrix, axis=1) * query_norm
+        scores = (matrix @ query) / np.maximum(norms, 1e-9)
+
+        limit = min(limit, self.size)
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[i]), float(scores[i])) for i in top if scores[i] >= min_score]
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as file:
+            np.savez_compressed(
+                file,
+                ids=self.ids[:self.size],
+                vectors=self.vectors[:self.size],
+                df=self.df,
+                last_id=np.array(self.last_id),
+            )
+
+    @classmethod
+    def load(cls, path: Path, dim: int, max_items: int) -> Optional["UserMemoryIndex"]:
+        """Загружает индекс с диска (None, если файла нет или он от другой размерности)."""
+        if not path.exists():
+            return None
+
+        with np.load(path) as data:
+            if data["df"].shape != (dim,):
+                return None
+            index = cls(dim, max_items)
+            index.last_id = int(data["last_id"])
+            for message_id, vector in zip(data["ids"][-max_items:], data["vectors"][-max_items:]):
+                if index.size == len(index.ids):
+                    index._grow()
+                index.ids[index.size] = message_id
+                index.vectors[index.size] = vector
+                index.size += 1
+        index.df = (index.vectors[:index.size] > 0).sum(axis=0, dtype=np.int32)
+        return index
+
+
+class MemoryService:
+    """Подбор релевантных старых сообщений для контекста модели."""
+
+    def __init__(self, directory: Optional[Path] = None) -> None:
+        self.directory = Path(directory or settings.MEMORY_DIR)
+        self._indexes: "OrderedDict[Tuple[int, int], UserMemoryIndex]" = OrderedDict()
+        # Вытесненные индексы, которые еще сохраняются, и загрузки в процессе
+        self._evicted: Dict[Tuple[int, int], UserMemoryIndex] = {}
+        self._loading: Dict[Tuple[int, int], asyncio.Task] = {}
+        self._writes: Set[asyncio.Task] = set()
+        self._write_lock: Optional[asyncio.Lock] = None
+        register_structure("MemoryService._indexes", lambda: self._indexes)
+
+        if settings.MEMORY_ENABLED and np is None:
+            logger.warning("⚠️ Долговременная память включена, но NumPy не установлен. Память отключена")
+
+    @property
+    def enabled(self) -> bool:
+        return settings.MEMORY_ENABLED and np is not None
+
+    def _path(self, user_id: int, bot_id: int) -> Path:
+        return self.directory / f"{bot_id}_{user_id}.npz"
+
+    async def _get_index(self, user_id: int, bot_id: int) -> UserMemoryIndex:
+        key = (bot_id, user_id)
+        index = self._indexes.get(key)
+        if index is not None:
+            self._indexes.move_to_end(key)
+            return index
+
+        # Вытесненный индекс, который еще сохраняется, берется из памяти, а не с диска
+        index = self._evicted.get(key)
+        if index is None:
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = asyncio.create_task(self._load(user_id, bot_id))
+                self._loading[key] = loading
+                loading.add_done_callback(lambda _: self._loading.pop(key, None))
+            index = await asyncio.shield(loading)
+
+            # Пока файл читался, индекс мог загрузить параллельный запрос
+            existing = self._indexes.get(key)
+            if existing is not None:
+                self._indexes.move_to_end(key)
+                return existing
+
+        self._indexes[key] = index
+        while len(self._indexes) > settings.MEMORY_CACHE_USERS:
+            old_key, old_index = self._indexes.popitem(last=False)
+            self._evicted[old_key] = old_index
+            task = asyncio.create_task(self._save_evicted(old_key, old_index))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+        return index
+
+    async def _load(self, user_id: int, bot_id: int) -> UserMemoryIndex:
+        path = self._path(user_id, bot_id)
+        try:
+            index = await asyncio.to_thread(UserMemoryIndex.load, path, settings.MEMORY_DIM, settings.MEMORY_MAX_ITEMS)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось загрузить индекс памяти {path}: {e}")
+            index = None
+        return index or UserMemoryIndex(settings.MEMORY_DIM, settings.MEMORY_MAX_ITEMS)
+
+    async def _save(self, key: Tuple[int, int], index: UserMemoryIndex) -> None:
+        # Запись по одной: один и тот же файл не пишется из двух потоков
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        bot_id, user_id = key
+        async with self._write_lock:
+            await asyncio.to_thread(index.save, self._path(user_id, bot_id))
+
+    async def _save_evicted(self, key: Tuple[int, int], index: UserMemoryIndex) -> None:
+        try:
+            await self._save(key, index)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить индекс памяти {key}: {e}")
+        finally:
+            if self._evicted.get(key) is index:
+                del self._evicted[key]
+
+    async def _sync(self, session: AsyncSession, index: UserMemoryIndex, user_id: int, bot_id: int) -> None:
+        """Добавляет в индекс новые сообщения (id больше последнего проиндексированного)."""
+        # Старше последних MEMORY_MAX_ITEMS сообщений индекс все равно не хранит
+        result = await session.execute(
+            select(DialogHistory.id, DialogHistory.content)
+            .where(
+                DialogHistory.user_id == user_id,
+                DialogHistory.bot_id == bot_id,
+                DialogHistory.id > index.last_id,
+            )
+            .order_by(DialogHistory.id.desc())
+            .limit(index.max_items)
+        )
+        for row in reversed(result.fetchall()):
+            index.add(row.id, row.content)
+
+    async def recall(
+            self,
+            session: AsyncSession,
+            user_id: int,
+            query: str,
+            bot_id: int = 0,
+            exclude: Iterable[Tuple[str, str]] = (),
+            top_k: Optional[int] = None,
+    ) -> List[Tuple[str, str]]:
+        """
+        Находит старые сообщения пользователя, релевантные запросу.
+
+        Args:
+            session: Асинхронная сессия БД
+            user_id: ID пользователя Telegram
+            query: Текст нового сообщения
+            bot_id: Пространство имен бота
+            exclude: Сообщения (role, content), которые уже есть в контексте
+            top_k: Сколько сообщений вернуть (по умолчанию из настроек)
+
+        Returns:
+            Список (role, content) от более релевантных к менее релевантным
+        """
+        if not self.enabled:
+            return []
+
+        top_k = top_k or settings.MEMORY_TOP_K
+        index = await self._get_index(user_id, bot_id)
+        await self._sync(session, index, user_id, bot_id)
+
+        excluded = {content for _, content in exclude}
+        matches = index.query(query, top_k + len(excluded), settings.MEMORY_MIN_SCORE)
+        if not matches:
+            return []
+
+        # Текст не хранится в индексе: читаем найденные сообщения по первичному ключу.
+        # Удаленные фоновой очисткой сообщения просто не найдутся.
+        ids = list(dict.fromkeys(message_id for message_id, _ in matches))
+        result = await session.execute(
+            select(DialogHistory.id, DialogHistory.role, DialogHistory.content)
+            .where(DialogHistory.id.in_(ids))
+        )
+        rows = {row.id: row for row in result}
+
+        memories = []
+        for message_id in ids:
+            row = rows.get(message_id)
+            if row is None or row.content in excluded:
+                continue
+            memories.append((row.role, row.content))
+            if len(memories) == top_k:
+                break
+        return memories
+
+    async def save_all(self) -> None:
+        """Дожидается записи вытесненных индексов и сохраняет загруженные на диск."""
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        for key, index in list(self._indexes.items()):
+            await self._save(key, index)
+        if self._indexes:
+            logger.info(f"💾 Индексы долговременной памяти сохранены: {len(self._indexes)}")
+
+
+# Глобальный экземпляр сервиса
+memory_service = MemoryService()
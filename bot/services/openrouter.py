@@ -1,7 +1,12 @@
+import asyncio
 import logging
 from typing import List, Optional
-from openai import AsyncOpenAI, APIError
+import httpx
+from openai import AsyncOpenAI, RateLimitError
 from bot.config import settings
+from bot.services import http_client as http
+from bot.services.retry import Deadline, ErrorKind, retry_policy
+from bot.services.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -9,11 +14,20 @@ logger = logging.getLogger(__name__)
 class OpenRouterService:
     """Сервис для взаимодействия с OpenRouter API."""
 
-    def __init__(self):
-        """Инициализация асинхронного клиента OpenRouter."""
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        """
+        Инициализация асинхронного клиента OpenRouter.
+
+        Args:
+            http_client: httpx-клиент с настроенным пулом соединений
+                         (по умолчанию общий клиент бота)
+        """
         self.client = AsyncOpenAI(
-            base_url="https://openrouter.ai/api/v1",
+            base_url=http.OPENROUTER_BASE_URL,
             api_key=settings.OPENROUTER_API_KEY,
+            http_client=http_client or http.http_client,
+            # Повторы выполняет RetryPolicy с учетом общего бюджета времени
+            max_retries=0,
         )
         self._prepare_headers()
 
@@ -21,6 +35,15 @@ class OpenRouterService:
         self.all_models = [settings.OPENROUTER_MODEL] + settings.OPENROUTER_FALLBACK_MODELS
         logger.info(f"📋 Загружены модели: {self.all_models}")
 
+    def apply_settings(self, old=None, new=None, changed=None) -> None:
+        """
+        Пересчитывает цепочку моделей и заголовки после перезагрузки настроек.
+        Запросы в обработке продолжают со списком, полученным при старте.
+        """
+        self.all_models = [settings.OPENROUTER_MODEL] + settings.OPENROUTER_FALLBACK_MODELS
+        self._prepare_headers()
+        logger.info(f"📋 Цепочка моделей обновлена: {self.all_models}")
+
     def _prepare_headers(self) -> dict:
         """Подготавливает дополнительные заголовки для OpenRouter."""
         self.extra_headers = {}
@@ -52,11 +75,24 @@ class OpenRouterService:
             self,
             history: List[tuple],
             user_message: str,
-            system_prompt: str = "Ты полезный ассистент. Отвечай на русском языке."
+            system_prompt: str = "Ты полезный ассистент. Отвечай на русском языке.",
+            memories: Optional[List[tuple]] = None,
     ) -> List[dict]:
         
         messages = [{"role": "system", "content": system_prompt}]
 
+        # Релевантные сообщения из более ранних разговоров (долговременная память)
+        if memories:
+            fragments = "\n\n".join(
+                f"{'Пользователь' if role == 'user' else 'Ассистент'}: "
+                f"{content[:settings.MEMORY_SNIPPET_CHARS]}"
+                for role, content in memories
+            )
+            messages.append({
+                "role": "system",
+                "content": f"Фрагменты прошлых разговоров с пользователем, которые могут пригодиться:\n\n{fragments}",
+            })
+
         # Добавляем историю из БД
         for role, content in history:
             # Преобразуем 'user'/'assistant' в формат OpenAI
@@ -76,52 +112,91 @@ class OpenRouterService:
             messages: List[dict],
             max_tokens: int = 500,
             temperature: float = 0.7,
+            models: Optional[List[str]] = None,
     ) -> dict:
-        """Основной метод для получения ответа от модели."""
+        """
+        Основной метод для получения ответа от модели.
+        models - собственная цепочка моделей (например, из профиля бота),
+        по умолчанию используется общая цепочка all_models.
+
+        Модели перебираются по цепочке в пределах общего бюджета времени
+        (REQUEST_DEADLINE). Временные сбои повторяются на той же модели
+        с экспоненциальной паузой, ошибки конкретной модели переводят
+        запрос на следующую, фатальные - прерывают цепочку.
+        """
         last_error = None
         tried_models = []
+        attempts = 0
+        deadline = Deadline(settings.REQUEST_DEADLINE)
+        chain = models or self.all_models
 
-        for model in self.all_models:
+        for model in chain:
             tried_models.append(model)
+            error_kind = None
 
-            try:
-                logger.info(f"🔄 Пробуем модель: {model}")
-
-                response = await self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,  # Используем УЖЕ отформатированные messages
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    extra_headers=self.extra_headers or None,
-                )
-
-                content = response.choices[0].message.content
-                usage = response.usage
-
-                logger.info(f"✅ Успех с моделью {model}!")
-
-                return {
-                    "success": True,
-                    "content": content.strip(),
-                    "model_used": model,
-                    "tokens_used": usage.total_tokens if usage else None,
-                    "fallback_used": model != settings.OPENROUTER_MODEL,
-                    "tried_models": tried_models,
-                    "is_primary": model == settings.OPENROUTER_MODEL,
-                }
-
-            except Exception as e:
-                last_error = e
-                error_str = str(e).lower()
-                logger.warning(f"❌ Ошибка модели {model}: {error_str[:100]}")
+            for attempt in range(retry_policy.max_attempts):
+                attempt_timeout = retry_policy.attempt_timeout(deadline, model)
+                if attempt_timeout is None:
+                    break
 
-                is_critical = any(keyword in error_str for keyword in [
-                    "not available", "quota exceeded", "model not found",
-                    "invalid model", "403", "429"
-                ])
+                attempts += 1
+                # Спан на каждую попытку: видно, на какой модели и попытке ушло время
+                with tracer.span("openrouter.attempt", model=model, attempt=attempt + 1) as span:
+                    try:
+                        logger.info(f"🔄 Пробуем модель: {model} (попытка {attempt + 1}, таймаут {attempt_timeout:.1f} с)")
+
+                        response = await asyncio.wait_for(
+                            self.client.chat.completions.create(
+                                model=model,
+                                messages=messages,  # Используем УЖЕ отформатированные messages
+                                max_tokens=max_tokens,
+                                temperature=temperature,
+                                extra_headers=self.extra_headers or None,
+                                timeout=http.build_timeout(model),
+                            ),
+                            timeout=attempt_timeout,
+                        )
+
+                        content = response.choices[0].message.content
+                        usage = response.usage
+
+                        logger.info(f"✅ Успех с моделью {model}!")
+                        if span is not None and usage:
+                            span.set_attribute("tokens", usage.total_tokens)
+
+                        return {
+                            "success": True,
+                            "content": content.strip(),
+                            "model_used": model,
+                            "tokens_used": usage.total_tokens if usage else None,
+                            "fallback_used": model != chain[0],
+                            "tried_models": tried_models,
+                            "is_primary": model == chain[0],
+                            "attempts": attempts,
+                        }
+
+                    except Exception as e:
+                        last_error = e
+                        error_kind = retry_policy.classify(e)
+                        logger.warning(f"❌ Ошибка модели {model} ({error_kind.value}): {str(e)[:100]}")
+                        if span is not None:
+                            span.set_attribute("error.kind", error_kind.value)
+                            span.set_error(f"{type(e).__name__}: {str(e)[:100]}")
+
+                if error_kind is not ErrorKind.TRANSIENT:
+                    break
 
-                if not is_critical:
+                # Пауза перед повтором, если на нее хватает бюджета
+                delay = retry_policy.backoff(attempt)
+                if attempt + 1 >= retry_policy.max_attempts or delay >= deadline.remaining():
                     break
+                await asyncio.sleep(delay)
+
+            if error_kind is ErrorKind.FATAL:
+                break
+            if deadline.expired() or retry_policy.attempt_timeout(deadline, model) is None:
+                logger.warning(f"⏱ Исчерпан бюджет времени запроса ({settings.REQUEST_DEADLINE} с)")
+                break
 
         logger.error(f"💥 Все модели недоступны. Попробовано: {tried_models}")
 
@@ -129,6 +204,8 @@ class OpenRouterService:
             "success": False,
             "error": str(last_error) if last_error else "Неизвестная ошибка",
             "tried_models": tried_models,
+            "attempts": attempts,
+            "deadline_exceeded": deadline.expired(),
             "content": self._get_friendly_error_message(tried_models, last_error),
         }
 
@@ -136,7 +213,7 @@ class OpenRouterService:
         """Генерирует понятное сообщение об ошибке для пользователя."""
         error_str = str(error).lower() if error else ""
 
-        if "quota" in error_str or "limit" in error_str:
+        if isinstance(error, RateLimitError) or "quota" in error_str or "limit" in error_str:
             return (
                 "⚠️ *Достигнут лимит использования моделей!*\n\n"
                 f"Попробованы модели: {', '.join(tried_models)}\n"
@@ -151,14 +228,13 @@ class OpenRouterService:
             )
 
     async def test_your_models(self) -> dict:
-        """Тестирует конкретные модели."""
-        
+        """Тестирует все модели цепочки параллельно."""
+
         logger.info("🧪 Тестирование ВАШИХ моделей...")
 
         test_messages = [{"role": "user", "content": "Привет! Ответь 'Модель работает'."}]
-        results = {}
 
-        for model in self.all_models:
+        async def test_model(model: str) -> dict:
             try:
                 logger.info(f"Тестируем: {model}")
 
@@ -170,7 +246,7 @@ class OpenRouterService:
                     timeout=10.0
                 )
 
-                results[model] = {
+                return {
                     "status": "✅ РАБОТАЕТ",
                     "response": response.choices[0].message.content,
                     "tokens": response.usage.total_tokens if response.usage else "N/A",
@@ -178,15 +254,19 @@ class OpenRouterService:
 
             except Exception as e:
                 error_msg = str(e)
-                results[model] = {
+                return {
                     "status": "❌ ОШИБКА",
                     "error": error_msg[:150],
-                    # ТЕПЕРЬ МЕТОД СУЩЕСТВУЕТ:
                     "suggestion": self._get_error_suggestion(error_msg, model),
                 }
 
-        return results
+        results = await asyncio.gather(*(test_model(model) for model in self.all_models))
+        return dict(zip(self.all_models, results))
 
 
 # Глобальный экземпляр сервиса
 openrouter_service = OpenRouterService()
+settings.subscribe(
+    openrouter_service.apply_settings,
+    {"OPENROUTER_MODEL", "OPENROUTER_FALLBACK_MODELS", "OPENROUTER_SITE", "OPENROUTER_TITLE"},
+)
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import select, func, delete, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.database import AsyncSessionLocal
+from bot.models import ModelProbeResult
+from bot.services.openrouter import OpenRouterService, openrouter_service
+
+logger = logging.getLogger(__name__)
+
+PROBE_MESSAGES = [{"role": "user", "content": "Привет! Ответь 'Модель работает'."}]
+
+
+class ModelProbeService:
+    """
+    Замеры моделей из цепочки: время до первого токена (TTFT),
+    полное время ответа и скорость генерации.
+    """
+
+    def __init__(self, service: OpenRouterService = openrouter_service) -> None:
+        self.service = service
+
+    async def probe_model(self, model: str, max_tokens: int = 20) -> dict:
+        """Замеряет одну модель потоковым запросом."""
+        started = time.perf_counter()
+        ttft = None
+        chunks = 0
+        completion_tokens = None
+        text = []
+
+        async def consume() -> None:
+            nonlocal ttft, chunks, completion_tokens
+            stream = await self.service.client.chat.completions.create(
+                model=model,
+                messages=PROBE_MESSAGES,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+                extra_headers=self.service.extra_headers or None,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    chunks += 1
+                    text.append(chunk.choices[0].delta.content)
+                if getattr(chunk, "usage", None):
+                    completion_tokens = chunk.usage.completion_tokens
+
+        try:
+            await asyncio.wait_for(consume(), timeout=settings.PROBE_TIMEOUT)
+        except Exception as e:
+            return {
+                "model": model,
+                "success": False,
+                "total_ms": (time.perf_counter() - started) * 1000,
+                "error": str(e)[:150],
+                "suggestion": self.service._get_error_suggestion(str(e), model),
+            }
+
+        total = time.perf_counter() - started
+        # Если провайдер не вернул usage, считаем токены по числу фрагментов
+        tokens = completion_tokens if completion_tokens is not None else chunks
+        generation_time = total - (ttft or 0)
+
+        return {
+            "model": model,
+            "success": True,
+            "response": "".join(text),
+            "ttft_ms": ttft * 1000 if ttft is not None else None,
+            "total_ms": total * 1000,
+            "completion_tokens": tokens,
+            "tokens_per_sec": tokens / generation_time if generation_time > 0 and tokens else None,
+        }
+
+    async def probe_all(self, models: Optional[List[str]] = None) -> List[dict]:
+        """Параллельно замеряет все модели цепочки."""
+        models = models or self.service.all_models
+        logger.info(f"🧪 Замер {len(models)} моделей...")
+        return list(await asyncio.gather(*(self.probe_model(model) for model in models)))
+
+    @staticmethod
+    async def save_results(session: AsyncSession, results: List[dict]) -> None:
+        """Сохраняет замеры и удаляет записи старше окна хранения."""
+        for result in results:
+            session.add(ModelProbeResult(
+                model=result["model"],
+                success=result["success"],
+                ttft_ms=result.get("ttft_ms"),
+                total_ms=result["total_ms"],
+                completion_tokens=result.get("completion_tokens"),
+                tokens_per_sec=result.get("tokens_per_sec"),
+                error=result.get("error"),
+            ))
+
+        retention_start = datetime.utcnow() - timedelta(hours=settings.PROBE_RETENTION_HOURS)
+        await session.execute(
+            delete(ModelProbeResult).where(ModelProbeResult.timestamp < retention_start)
+        )
+        await session.commit()
+
+    @staticmethod
+    async def get_summary(session: AsyncSession, hours: Optional[int] = None) -> List[dict]:
+        """Агрегирует замеры по моделям за последние hours часов."""
+        since = datetime.utcnow() - timedelta(hours=hours or settings.PROBE_RETENTION_HOURS)
+
+        stmt = (
+            select(
+                ModelProbeResult.model,
+                func.count(ModelProbeResult.id).label("probes"),
+                func.sum(ModelProbeResult.success.cast(Integer)).label("successes"),
+                func.avg(ModelProbeResult.ttft_ms).label("avg_ttft_ms"),
+                func.avg(ModelProbeResult.total_ms).label("avg_total_ms"),
+                func.avg(ModelProbeResult.tokens_per_sec).label("avg_tokens_per_sec"),
+            )
+            .where(ModelProbeResult.timestamp >= since)
+            .group_by(ModelProbeResult.model)
+        )
+
+        result = await session.execute(stmt)
+        return [
+            {
+                "model": row.model,
+                "probes": row.probes,
+                "success_rate": (row.successes or 0) / row.probes,
+                "avg_ttft_ms": row.avg_ttft_ms,
+                "avg_total_ms": row.avg_total_ms,
+                "avg_tokens_per_sec": row.avg_tokens_per_sec,
+            }
+            for row in result
+        ]
+
+    def suggest_order(self, summary: List[dict]) -> List[str]:
+        """
+        Предлагает порядок цепочки по данным замеров:
+        сначала надежные модели, среди них - с меньшей задержкой.
+        Модели без замеров остаются в конце в исходном порядке.
+        """
+        measured = {row["model"]: row for row in summary}
+        ranked = sorted(
+            (model for model in self.service.all_models if model in measured),
+            key=lambda model: (
+                -round(measured[model]["success_rate"], 1),
+                measured[model]["avg_ttft_ms"] or float("inf"),
+                measured[model]["avg_total_ms"],
+            ),
+        )
+        return ranked + [model for model in self.service.all_models if model not in measured]
+
+    def format_table(self, summary: List[dict]) -> str:
+        """Форматирует сводку замеров в текстовую таблицу."""
+
+        def fmt(value: Optional[float], digits: int = 0) -> str:
+            return "-" if value is None else f"{value:.{digits}f}"
+
+        lines = [f"{'Модель':<36} {'OK%':>5} {'TTFT':>7} {'Всего':>7} {'ток/с':>6} {'N':>4}"]
+        for row in sorted(summary, key=lambda r: r["avg_total_ms"]):
+            lines.append(
+                f"{row['model'][:36]:<36} {row['success_rate'] * 100:>5.0f} "
+                f"{fmt(row['avg_ttft_ms']):>7} {fmt(row['avg_total_ms']):>7} "
+                f"{fmt(row['avg_tokens_per_sec'], 1):>6} {row['probes']:>4}"
+            )
+
+        lines.append("")
+        lines.append("Рекомендуемый порядок: " + " → ".join(self.suggest_order(summary)))
+        return "\n".join(lines)
+
+
+# Глобальный экземпляр сервиса замеров
+probe_service = ModelProbeService()
+
+
+async def run_scheduled_probe() -> None:
+    """Фоновая задача: замер всех моделей и сохранение результатов."""
+    results = await probe_service.probe_all()
+    async with AsyncSessionLocal() as session:
+        await ModelProbeService.save_results(session, results)
+
+    ok = sum(1 for r in results if r["success"])
+    logger.info(f"🧪 Замер моделей завершен: работают {ok} из {len(results)}")
+
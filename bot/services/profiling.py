@@ -0,0 +1,190 @@
+"""
+Диагностика производительности по запросу администратора.
+Пока ни одна из функций не вызвана, накладных расходов нет:
+поток-сэмплер и tracemalloc запускаются только на время замера.
+"""
+import asyncio
+import linecache
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = Path("profiles")
+
+# Одновременно выполняется только один замер
+_profiling_lock = asyncio.Lock()
+
+# Отслеживаемые структуры в памяти: имя -> функция, возвращающая объект
+_structures: Dict[str, Callable[[], Any]] = {}
+
+
+def register_structure(name: str, getter: Callable[[], Any]) -> None:
+    """Регистрирует структуру в памяти для отчета о размерах."""
+    key, number = name, 2
+    while key in _structures:
+        key = f"{name}#{number}"
+        number += 1
+    _structures[key] = getter
+
+
+def is_busy() -> bool:
+    """Выполняется ли сейчас замер."""
+    return _profiling_lock.locked()
+
+
+def _output_path(prefix: str, suffix: str = "txt") -> Path:
+    PROFILE_DIR.mkdir(exist_ok=True)
+    return PROFILE_DIR / f"{prefix}_{datetime.now():%Y%m%d_%H%M%S}.{suffix}"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+def _sample_thread(thread_id: int, duration: float, interval: float) -> Tuple[Counter, int]:
+    """Снимает стеки потока thread_id с заданным интервалом."""
+    stacks: Counter = Counter()
+    samples = 0
+    deadline = time.monotonic() + duration
+
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stacks[";".join(reversed(labels))] += 1
+            samples += 1
+        time.sleep(interval)
+
+    return stacks, samples
+
+
+async def profile_cpu(duration: float, interval: float = 0.005) -> Path:
+    """
+    Сэмплирующий профиль event loop за duration секунд.
+    Стеки потока с циклом снимаются из отдельного потока, поэтому сам цикл
+    не останавливается. Результат - свернутые стеки (формат flamegraph.pl)
+    и топ функций по собственному и суммарному времени.
+    """
+    async with _profiling_lock:
+        thread_id = threading.get_ident()
+        stacks, samples = await asyncio.to_thread(_sample_thread, thread_id, duration, interval)
+
+    own: Counter = Counter()
+    total: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for label in set(frames):
+            total[label] += count
+
+    path = _output_path("cpu")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(f"# Сэмплов: {samples}, длительность: {duration} с, интервал: {interval * 1000:.0f} мс\n\n")
+        file.write("# Топ по собственному времени\n")
+        for label, count in own.most_common(30):
+            file.write(f"{count / max(samples, 1) * 100:6.1f}%  {label}\n")
+        file.write("\n# Топ по суммарному времени\n")
+        for label, count in total.most_common(30):
+            file.write(f"{count / max(samples, 1) * 100:6.1f}%  {label}\n")
+        file.write("\n# Свернутые стеки (flamegraph.pl)\n")
+        for stack, count in stacks.most_common():
+            file.write(f"{stack} {count}\n")
+
+    logger.info(f"🔬 CPU-профиль сохранен: {path} ({samples} сэмплов)")
+    return path
+
+
+async def profile_memory(duration: float, limit: int = 30) -> Path:
+    """
+    Топ аллокаций за duration секунд через tracemalloc.
+    Трассировка включается только на время замера (если не была включена ранее).
+    """
+    async with _profiling_lock:
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(10)
+        try:
+            await asyncio.sleep(duration)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+    path = _output_path("memory")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(f"# Отслежено: {current / 1024:.1f} КБ, пик: {peak / 1024:.1f} КБ за {duration} с\n\n")
+        file.write("# Топ по строкам\n")
+        for stat in snapshot.statistics("lineno")[:limit]:
+            frame = stat.traceback[0]
+            line = linecache.getline(frame.filename, frame.lineno).strip()
+            file.write(f"{stat.size / 1024:10.1f} КБ {stat.count:8} шт.  {frame.filename}:{frame.lineno}  {line}\n")
+        file.write("\n# Топ-5 по стеку вызовов\n")
+        for stat in snapshot.statistics("traceback")[:5]:
+            file.write(f"\n{stat.size / 1024:.1f} КБ, {stat.count} шт.\n")
+            file.write("\n".join(stat.traceback.format()) + "\n")
+
+    logger.info(f"🔬 Профиль памяти сохранен: {path}")
+    return path
+
+
+def deep_sizeof(obj: Any, max_objects: int = 200_000) -> int:
+    """Приблизительный полный размер объекта вместе с вложенными объектами."""
+    seen = set()
+    stack = [obj]
+    size = 0
+
+    while stack and len(seen) < max_objects:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+        elif hasattr(current, "__dict__") and not isinstance(current, type):
+            stack.append(vars(current))
+
+    return size
+
+
+def structure_sizes() -> List[dict]:
+    """Размеры зарегистрированных структур в памяти."""
+    report = []
+    for name, getter in _structures.items():
+        obj = getter()
+        report.append({
+            "name": name,
+            "items": len(obj) if hasattr(obj, "__len__") else None,
+            "bytes": deep_sizeof(obj),
+        })
+    return sorted(report, key=lambda row: -row["bytes"])
+
+
+def format_structure_sizes(report: List[dict]) -> str:
+    lines = [f"{'Структура':<40} {'Элементов':>10} {'КБ':>10}"]
+    for row in report:
+        items = "-" if row["items"] is None else row["items"]
+        lines.append(f"{row['name'][:40]:<40} {items:>10} {row['bytes'] / 1024:>10.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,410 @@
+"""
+Запись и воспроизведение HTTP-трафика к OpenRouter.
+
+RecordingTransport оборачивает транспорт общего httpx-клиента (его же
+использует AsyncOpenAI) и пишет каждый запрос строкой JSON в HTTP_RECORD_FILE
+(.gz - со сжатием): тело запроса, статус, время до заголовков ответа,
+части тела с отметками времени от начала запроса (для стриминга - каждое
+SSE-событие) и ошибки транспорта. С HTTP_RECORD_REDACT (по умолчанию) тексты
+сообщений запроса и ответа модели заменяются их длиной; ключ запроса
+считается до этого, а разбиение ответа на события и их время сохраняются.
+
+ReplayTransport отдает записанные ответы без сети с исходными задержками,
+умноженными на speed (0 - без задержек). Запрос сопоставляется с записью
+по ключу тела, затем по модели и режиму (потоковый или нет), затем по пути;
+записи одной группы выдаются по кругу. Ошибки воспроизводятся тем же классом
+исключения httpx, а запрос, отмененный клиентом по таймауту, - зависанием до таймаута клиента.
+Тот же поиск записей использует сервер воспроизведения (benchmarks/replay.py).
+"""
+import asyncio
+import base64
+import copy
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Меняется при несовместимом изменении формата записей
+RECORD_VERSION = 1
+
+# Заголовки ответа, которые нужны для воспроизведения
+KEPT_HEADERS = ("content-type",)
+
+
+def request_key(path: str, body: bytes) -> str:
+    """Ключ запроса: путь и тело в каноническом виде (порядок полей JSON не важен)."""
+    try:
+        canonical = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    except ValueError:
+        canonical = body
+    return hashlib.sha1(path.encode("utf-8") + b"\n" + canonical).hexdigest()
+
+
+def _parse_body(body: bytes) -> Any:
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return body.decode("utf-8", errors="replace")
+
+
+def redact_body(body: Any) -> Any:
+    """Заменяет тексты сообщений их длиной, остальные параметры запроса сохраняются."""
+    if not isinstance(body, dict) or not isinstance(body.get("messages"), list):
+        return body
+    redacted = copy.deepcopy(body)
+    for message in redacted["messages"]:
+        if isinstance(message, dict) and isinstance(message.get("content"), str):
+            message["content"] = f"<redacted:{len(message['content'])}>"
+    return redacted
+
+
+# Поля сообщения и дельты, в которых модель возвращает текст
+RESPONSE_TEXT_FIELDS = ("content", "reasoning")
+
+
+def redact_response(body: Any) -> Any:
+    """Заменяет тексты ответа модели (choices[].message / choices[].delta) их длиной."""
+    if not isinstance(body, dict) or not isinstance(body.get("choices"), list):
+        return body
+    for choice in body["choices"]:
+        for part in (choice.get("message"), choice.get("delta")) if isinstance(choice, dict) else ():
+            if not isinstance(part, dict):
+                continue
+            for field in RESPONSE_TEXT_FIELDS:
+                if isinstance(part.get(field), str):
+                    part[field] = f"<redacted:{len(part[field])}>"
+    return body
+
+
+def _redact_json(data: bytes) -> bytes:
+    try:
+        body = json.loads(data)
+    except ValueError:
+        return data
+    return json.dumps(redact_response(body), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class ResponseRedactor:
+    """
+    Обезличивание тела ответа по частям. Поток SSE обрабатывается по строкам:
+    часть записывается, как только в ней закончилась строка события, поэтому
+    события и их время сохраняются. Обычный ответ - JSON целиком - обезличивается
+    после чтения.
+    """
+
+    def __init__(self, sse: bool) -> None:
+        self.sse = sse
+        self._pending = b""
+
+    def _redact_line(self, line: bytes) -> bytes:
+        if not line.startswith(b"data:") or line[5:].strip() == b"[DONE]":
+            return line
+        ending = b"\r" if line.endswith(b"\r") else b""
+        return b"data: " + _redact_json(line[5:].strip()) + ending
+
+    def feed(self, chunk: bytes) -> bytes:
+        self._pending += chunk
+        if not self.sse:
+            return b""
+        complete, newline, self._pending = self._pending.rpartition(b"\n")
+        if not newline:
+            self._pending = complete + self._pending
+            return b""
+        return b"\n".join(self._redact_line(line) for line in complete.split(b"\n")) + b"\n"
+
+    def finish(self) -> bytes:
+        tail, self._pending = self._pending, b""
+        if not tail:
+            return b""
+        return self._redact_line(tail) if self.sse else _redact_json(tail)
+
+
+def encode_chunk(offset_ms: float, chunk: bytes) -> list:
+    """Часть тела: [мс от начала запроса, текст] или [мс, base64, "b64"] для не-UTF-8."""
+    try:
+        return [round(offset_ms, 1), chunk.decode("utf-8")]
+    except UnicodeDecodeError:
+        return [round(offset_ms, 1), base64.b64encode(chunk).decode("ascii"), "b64"]
+
+
+def decode_chunk(item: list) -> Tuple[float, bytes]:
+    if len(item) > 2 and item[2] == "b64":
+        return item[0], base64.b64decode(item[1])
+    return item[0], item[1].encode("utf-8")
+
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+class TrafficRecorder:
+    """Запись обменов в файл JSON Lines (со сжатием, если имя оканчивается на .gz)."""
+
+    def __init__(self, path: str, redact: bool = True) -> None:
+        self.path = Path(path)
+        self.redact = redact
+        self.recorded = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def start(self, request: httpx.Request) -> dict:
+        try:
+            body = request.content
+        except httpx.RequestNotRead:
+            body = b""
+        parsed = _parse_body(body)
+        return {
+            "v": RECORD_VERSION,
+            "ts": round(time.time(), 3),
+            "method": request.method,
+            "path": request.url.path,
+            "key": request_key(request.url.path, body),
+            "model": parsed.get("model") if isinstance(parsed, dict) else None,
+            "stream": bool(parsed.get("stream")) if isinstance(parsed, dict) else False,
+            "body": redact_body(parsed) if self.redact else parsed,
+            "status": None,
+            "headers": {},
+            "ttfb_ms": None,
+            "chunks": [],
+            "error": None,
+            "duration_ms": None,
+        }
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                opener = gzip.open if self.path.suffix == ".gz" else open
+                self._file = opener(self.path, "at", encoding="utf-8")
+            self._file.write(line)
+            self.recorded += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if self.recorded:
+            logger.info(f"📼 Записано обменов с OpenRouter: {self.recorded} ({self.path})")
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Тело ответа, которое по мере чтения сохраняет части с отметками времени."""
+
+    def __init__(
+            self,
+            inner: httpx.AsyncByteStream,
+            record: dict,
+            started: float,
+            recorder: TrafficRecorder,
+            redactor: Optional[ResponseRedactor] = None,
+    ) -> None:
+        self.inner = inner
+        self.record = record
+        self.started = started
+        self.recorder = recorder
+        self.redactor = redactor
+        self._written = False
+
+    def _append(self, data: bytes) -> None:
+        if data:
+            self.record["chunks"].append(encode_chunk(_elapsed_ms(self.started), data))
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.inner:
+                self._append(self.redactor.feed(chunk) if self.redactor else chunk)
+                yield chunk
+        except BaseException as e:
+            self.record["error"] = {
+                "type": type(e).__name__, "message": str(e)[:200], "after_ms": round(_elapsed_ms(self.started), 1),
+            }
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            await self.inner.aclose()
+        finally:
+            if not self._written:
+                self._written = True
+                if self.redactor:
+                    self._append(self.redactor.finish())
+                self.record["duration_ms"] = round(_elapsed_ms(self.started), 1)
+                self.recorder.write(self.record)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Транспорт, записывающий запросы к url_prefix и ответы на них."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, recorder: TrafficRecorder, url_prefix: str) -> None:
+        self.inner = inner
+        self.recorder = recorder
+        self.url_prefix = url_prefix
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not str(request.url).startswith(self.url_prefix):
+            return await self.inner.handle_async_request(request)
+
+        started = time.perf_counter()
+        record = self.recorder.start(request)
+        try:
+            response = await self.inner.handle_async_request(request)
+        except BaseException as e:
+            # Отмена (таймаут клиента) тоже записывается: при воспроизведении это зависание
+            record["error"] = {"type": type(e).__name__, "message": str(e)[:200], "after_ms": round(_elapsed_ms(started), 1)}
+            record["duration_ms"] = record["error"]["after_ms"]
+            self.recorder.write(record)
+            raise
+
+        record["status"] = response.status_code
+        record["headers"] = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+        record["ttfb_ms"] = round(_elapsed_ms(started), 1)
+        redactor = None
+        if self.recorder.redact:
+            redactor = ResponseRedactor(sse="text/event-stream" in response.headers.get("content-type", ""))
+        stream = _RecordingStream(response.stream, record, started, self.recorder, redactor)
+        try:
+            # Тело уже прочитано внутренним транспортом (например, httpx.MockTransport)
+            content = response.content
+        except httpx.ResponseNotRead:
+            response.stream = stream
+        else:
+            stream._append(redactor.feed(content) if redactor else content)
+            await stream.aclose()
+        return response
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+        self.recorder.close()
+
+
+def load_records(path: str) -> List[dict]:
+    """Читает записи из файла JSON Lines (.gz - сжатого)."""
+    opener = gzip.open if str(path).endswith(".gz") else open
+    records = []
+    with opener(path, "rt", encoding="utf-8") as file:
+        for number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"⚠️ Строка {number} записи {path} повреждена и пропущена")
+                continue
+            if record.get("v") == RECORD_VERSION:
+                records.append(record)
+    return records
+
+
+class ReplayStore:
+    """Поиск записи для запроса: по ключу тела, затем по модели и режиму, затем по пути."""
+
+    def __init__(self, records: List[dict]) -> None:
+        self.records = records
+        self._cycles: Dict[tuple, Iterator[dict]] = {}
+        groups: Dict[tuple, List[dict]] = {}
+        for record in records:
+            for group in (
+                    ("key", record["key"]),
+                    ("model", record["path"], record.get("model"), record.get("stream", False)),
+                    ("path", record["path"]),
+            ):
+                groups.setdefault(group, []).append(record)
+        self._groups = groups
+
+    @classmethod
+    def load(cls, path: str) -> "ReplayStore":
+        store = cls(load_records(path))
+        logger.info(f"📼 Загружено записей для воспроизведения: {len(store.records)} ({path})")
+        return store
+
+    def _next(self, group: tuple) -> Optional[dict]:
+        if group not in self._groups:
+            return None
+        if group not in self._cycles:
+            self._cycles[group] = itertools.cycle(self._groups[group])
+        return next(self._cycles[group])
+
+    def match(self, path: str, body: bytes) -> Optional[dict]:
+        parsed = _parse_body(body)
+        model, stream = (parsed.get("model"), bool(parsed.get("stream"))) if isinstance(parsed, dict) else (None, False)
+        return (
+            self._next(("key", request_key(path, body)))
+            or self._next(("model", path, model, stream))
+            or self._next(("path", path))
+        )
+
+
+async def sleep_until(started: float, offset_ms: Optional[float], speed: float) -> None:
+    """Ждет момента offset_ms (умноженного на speed) от начала запроса по time.perf_counter()."""
+    if not offset_ms or speed <= 0:
+        return
+    delay = started + offset_ms * speed / 1000 - time.perf_counter()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def replay_exception(error: dict, request: httpx.Request) -> Exception:
+    """Исключение httpx того же класса, что было при записи."""
+    cls = getattr(httpx, error["type"], None)
+    if not (isinstance(cls, type) and issubclass(cls, httpx.RequestError)):
+        cls = httpx.ReadError
+    return cls(error.get("message", ""), request=request)
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, record: dict, started: float, speed: float, request: httpx.Request) -> None:
+        self.record = record
+        self.started = started
+        self.speed = speed
+        self.request = request
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for item in self.record["chunks"]:
+            offset, chunk = decode_chunk(item)
+            await sleep_until(self.started, offset, self.speed)
+            yield chunk
+        error = self.record.get("error")
+        if error:
+            await sleep_until(self.started, error.get("after_ms"), self.speed)
+            raise replay_exception(error, self.request)
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Транспорт, отвечающий записанными ответами с исходными (или масштабированными) задержками."""
+
+    def __init__(self, store: ReplayStore, speed: float = 1.0) -> None:
+        self.store = store
+        self.speed = speed
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        body = await request.aread()
+        record = self.store.match(request.url.path, body)
+        if record is None:
+            return httpx.Response(404, json={"error": {"message": "Нет записи для запроса"}}, request=request)
+
+        error = record.get("error")
+        if error and record.get("status") is None:
+            if error["type"] == "CancelledError":
+                # Клиент не дождался ответа: ждем, пока сработает его таймаут
+                await asyncio.Event().wait()
+            await sleep_until(started, error.get("after_ms"), self.speed)
+            raise replay_exception(error, request)
+
+        await sleep_until(started, record.get("ttfb_ms"), self.speed)
+        return httpx.Response(
+            record["status"],
+            headers=record.get("headers") or {},
+            stream=_ReplayStream(record, started, self.speed, request),
+            request=request,
+        )
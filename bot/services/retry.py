@@ -0,0 +1,118 @@
+import asyncio
+import random
+import time
+from enum import Enum
+from typing import Optional
+import openai
+from bot.config import settings
+from bot.services.http_client import get_total_timeout
+
+
+class ErrorKind(str, Enum):
+    """Класс ошибки, определяющий дальнейшее поведение цепочки моделей."""
+
+    TRANSIENT = "transient"    # Временный сбой: повторяем ту же модель с паузой
+    NEXT_MODEL = "next_model"  # Проблема конкретной модели: переходим к следующей
+    FATAL = "fatal"            # Повтор бессмысленен: прекращаем попытки
+
+
+class Deadline:
+    """Сквозной бюджет времени на обработку одного запроса пользователя."""
+
+    def __init__(self, budget: float) -> None:
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        """Оставшееся время в секундах (не меньше нуля)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class RetryPolicy:
+    """
+    Политика повторов для цепочки моделей:
+    классификация ошибок по типам openai, экспоненциальная пауза с джиттером
+    и таймауты попыток, вычисляемые из оставшегося бюджета.
+    """
+
+    def __init__(
+            self,
+            max_attempts: Optional[int] = None,
+            backoff_base: Optional[float] = None,
+            backoff_max: Optional[float] = None,
+            min_attempt_timeout: Optional[float] = None,
+    ) -> None:
+        # Явно не заданные параметры читаются из настроек при каждом обращении,
+        # чтобы перечитанные настройки применялись без перезапуска
+        self._max_attempts = max_attempts
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._min_attempt_timeout = min_attempt_timeout
+
+    @property
+    def max_attempts(self) -> int:
+        return self._max_attempts or settings.RETRY_MAX_ATTEMPTS
+
+    @property
+    def backoff_base(self) -> float:
+        return settings.RETRY_BACKOFF_BASE if self._backoff_base is None else self._backoff_base
+
+    @property
+    def backoff_max(self) -> float:
+        return settings.RETRY_BACKOFF_MAX if self._backoff_max is None else self._backoff_max
+
+    @property
+    def min_attempt_timeout(self) -> float:
+        if self._min_attempt_timeout is None:
+            return settings.RETRY_MIN_ATTEMPT_TIMEOUT
+        return self._min_attempt_timeout
+
+    @staticmethod
+    def classify(error: BaseException) -> ErrorKind:
+        """Определяет класс ошибки по типу исключения."""
+
+        # Сетевые сбои и таймауты (APITimeoutError - подкласс APIConnectionError)
+        if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+            return ErrorKind.TRANSIENT
+
+        if isinstance(error, openai.AuthenticationError):
+            return ErrorKind.FATAL
+
+        # 403/404/429 и некорректный запрос к модели - пробуем следующую модель
+        if isinstance(error, (
+                openai.RateLimitError,
+                openai.PermissionDeniedError,
+                openai.NotFoundError,
+                openai.BadRequestError,
+                openai.UnprocessableEntityError,
+        )):
+            return ErrorKind.NEXT_MODEL
+
+        if isinstance(error, openai.APIStatusError):
+            if error.status_code >= 500:
+                return ErrorKind.TRANSIENT
+            # 402 (нет средств) и прочие ошибки конкретного провайдера
+            return ErrorKind.NEXT_MODEL
+
+        return ErrorKind.FATAL
+
+    def backoff(self, attempt: int) -> float:
+        """Пауза перед повтором: экспоненциальная с полным джиттером."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def attempt_timeout(self, deadline: Deadline, model: str) -> Optional[float]:
+        """
+        Таймаут очередной попытки: таймаут модели, урезанный до остатка бюджета.
+        Возвращает None, если оставшегося времени не хватит на осмысленную попытку.
+        """
+        timeout = min(get_total_timeout(model), deadline.remaining())
+        if timeout < self.min_attempt_timeout:
+            return None
+        return timeout
+
+
+# Глобальная политика повторов
+retry_policy = RetryPolicy()
@@ -0,0 +1,239 @@
+"""
+Маршрутизация запросов по уровням моделей.
+
+Перед вызовом chat_completion запрос классифицируется дешевыми локальными
+эвристиками (длина, блоки кода, письменность, глубина истории) и получает
+уровень: light - короткие реплики вроде «спасибо» (быстрая маленькая модель),
+heavy - код, длинные тексты и большой контекст (крупная модель),
+standard - все остальное (основная цепочка профиля). У каждого уровня своя
+цепочка резервных моделей.
+
+Каждое решение вместе с результатом запроса пишется строкой JSON в
+ROUTER_LOG_FILE для последующей настройки порогов.
+"""
+import json
+import logging
+import re
+from datetime import datetime
+from enum import Enum
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel
+from bot.config import settings
+from bot.profiles import BotProfile
+
+logger = logging.getLogger(__name__)
+
+
+class Tier(str, Enum):
+    """Уровень модели для запроса."""
+
+    LIGHT = "light"
+    STANDARD = "standard"
+    HEAVY = "heavy"
+
+
+# Реплики, на которые хватает самой маленькой модели при любой глубине диалога
+TRIVIAL_PHRASES = {
+    "спасибо", "спс", "благодарю", "привет", "здравствуй", "здравствуйте", "пока",
+    "ок", "окей", "ага", "понял", "поняла", "понятно", "хорошо", "отлично", "супер", "круто",
+    "thanks", "thank you", "thx", "hi", "hello", "hey", "ok", "okay", "bye", "cool", "great",
+}
+
+# Начала слов, которые обычно означают трудоемкую задачу
+HEAVY_STEMS = (
+    "проанализ", "анализир", "ревью", "отрефактор", "рефактор", "оптимизир", "докаж", "выведи формул",
+    "реши задач", "напиши код", "напиши функц", "напиши скрипт", "напиши программ", "отлад", "подробн",
+    "review", "refactor", "optimiz", "prove", "debug", "analyz", "implement", "step by step",
+)
+
+_FENCE_RE = re.compile(r"```")
+_CODE_LINE_RE = re.compile(
+    r"^\s*(def |class |import |from \S+ import |function |const |let |var |#include|public |private |"
+    r"return\b|if \(|for \(|while \(|SELECT |INSERT |UPDATE |CREATE )|[;{}]\s*$"
+)
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES_RE = re.compile(r"\s+")
+
+# Грубая оценка числа токенов: для смеси кириллицы и латиницы ~3 символа на токен
+CHARS_PER_TOKEN = 3
+
+# Лимит ответа для уровня без собственной цепочки: как до маршрутизации
+DEFAULT_MAX_TOKENS = 600
+
+
+class RouteFeatures(BaseModel):
+    """Признаки запроса, по которым выбирается уровень."""
+
+    chars: int
+    context_tokens: int
+    history_depth: int
+    code: bool
+    script: str  # cyrillic, latin, mixed или other
+
+
+class RouteDecision(BaseModel):
+    """Решение маршрутизатора для одного запроса."""
+
+    tier: Tier
+    reason: str
+    models: List[str]
+    max_tokens: int
+    features: RouteFeatures
+
+
+def _normalize(text: str) -> str:
+    return _SPACES_RE.sub(" ", _PUNCTUATION_RE.sub(" ", text.lower())).strip()
+
+
+def detect_script(text: str) -> str:
+    """Преобладающая письменность текста: cyrillic, latin, mixed или other."""
+    cyrillic = latin = other = 0
+    for char in text:
+        if not char.isalpha():
+            continue
+        if "а" <= char.lower() <= "я" or char in "ёЁ":
+            cyrillic += 1
+        elif char.isascii():
+            latin += 1
+        else:
+            other += 1
+
+    letters = cyrillic + latin + other
+    if letters == 0:
+        return "latin"
+    if other / letters > 0.3:
+        return "other"
+    if cyrillic / letters > 0.7:
+        return "cyrillic"
+    if latin / letters > 0.7:
+        return "latin"
+    return "mixed"
+
+
+def has_code(text: str) -> bool:
+    """Блок кода в ``` или несколько строк, похожих на код."""
+    if _FENCE_RE.search(text):
+        return True
+    code_lines = sum(1 for line in text.splitlines() if _CODE_LINE_RE.search(line))
+    return code_lines >= 2
+
+
+def extract_features(text: str, history: List[Tuple[str, str]]) -> RouteFeatures:
+    context_chars = len(text) + sum(len(content) for _, content in history)
+    return RouteFeatures(
+        chars=len(text),
+        context_tokens=context_chars // CHARS_PER_TOKEN,
+        history_depth=len(history),
+        code=has_code(text),
+        script=detect_script(text),
+    )
+
+
+def classify(text: str, features: RouteFeatures) -> Tuple[Tier, str]:
+    """
+    Выбирает уровень по признакам. Правила проверяются по порядку,
+    первое сработавшее определяет уровень и причину.
+    """
+    if _normalize(text) in TRIVIAL_PHRASES:
+        return Tier.LIGHT, "trivial"
+    if features.code:
+        return Tier.HEAVY, "code"
+    if features.chars >= settings.ROUTER_HEAVY_MIN_CHARS:
+        return Tier.HEAVY, "long"
+    if features.context_tokens >= settings.ROUTER_HEAVY_CONTEXT_TOKENS:
+        return Tier.HEAVY, "context"
+
+    lowered = text.lower()
+    if any(stem in lowered for stem in HEAVY_STEMS):
+        return Tier.HEAVY, "task"
+
+    # Короткий вопрос в начале диалога; в длинном диалоге даже короткая
+    # реплика («а почему?») требует понимания контекста
+    if (
+        features.chars <= settings.ROUTER_LIGHT_MAX_CHARS
+        and features.history_depth < settings.ROUTER_DEEP_HISTORY
+        and features.script != "other"
+    ):
+        return Tier.LIGHT, "short"
+    return Tier.STANDARD, "default"
+
+
+class ModelRouter:
+    """Выбор цепочки моделей для запроса и журнал решений."""
+
+    def __init__(self, log_file: Optional[str] = None) -> None:
+        self.log_file = settings.ROUTER_LOG_FILE if log_file is None else log_file
+        self._handler: Optional[RotatingFileHandler] = None
+
+    @staticmethod
+    def chain_for(profile: BotProfile, tier: Tier) -> List[str]:
+        """
+        Цепочка моделей уровня: из профиля бота, затем из MODEL_TIERS.
+        Уровень без настроенных моделей использует основную цепочку профиля.
+        """
+        return profile.model_tiers.get(tier.value) or settings.MODEL_TIERS.get(tier.value) or profile.model_chain
+
+    @staticmethod
+    def max_tokens_for(profile: BotProfile, tier: Tier) -> int:
+        """
+        Лимит ответа уровня из MODEL_TIER_MAX_TOKENS - только для уровня
+        с настроенной цепочкой, иначе запрос идет как без маршрутизации.
+        """
+        if profile.model_tiers.get(tier.value) or settings.MODEL_TIERS.get(tier.value):
+            return settings.MODEL_TIER_MAX_TOKENS.get(tier.value, DEFAULT_MAX_TOKENS)
+        return DEFAULT_MAX_TOKENS
+
+    def route(self, profile: BotProfile, text: str, history: List[Tuple[str, str]]) -> RouteDecision:
+        features = extract_features(text, history)
+        tier, reason = classify(text, features)
+        decision = RouteDecision(
+            tier=tier,
+            reason=reason,
+            models=self.chain_for(profile, tier),
+            max_tokens=self.max_tokens_for(profile, tier),
+            features=features,
+        )
+        logger.debug(f"🧭 Уровень {tier.value} ({reason}): {decision.models[0]}")
+        return decision
+
+    def _get_handler(self) -> Optional[RotatingFileHandler]:
+        # Отдельный файл с ротацией, минуя корневой логгер: только JSON-строки
+        if not self.log_file:
+            return None
+        if self._handler is None:
+            path = Path(self.log_file)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._handler = RotatingFileHandler(path, maxBytes=10_485_760, backupCount=3, encoding="utf-8")
+            self._handler.setFormatter(logging.Formatter("%(message)s"))
+        return self._handler
+
+    def record(self, decision: RouteDecision, response: dict, elapsed: float, bot_id: int = 0) -> None:
+        """Записывает решение и результат запроса строкой JSON."""
+        handler = self._get_handler()
+        if handler is None:
+            return
+
+        entry: Dict[str, object] = {
+            "ts": datetime.utcnow().isoformat(timespec="seconds"),
+            "bot_id": bot_id,
+            "tier": decision.tier.value,
+            "reason": decision.reason,
+            **decision.features.model_dump(),
+            "model_used": response.get("model_used"),
+            "success": response.get("success", False),
+            "fallback_used": response.get("fallback_used", False),
+            "tokens_used": response.get("tokens_used"),
+            "latency_ms": round(elapsed * 1000),
+        }
+        handler.handle(logging.makeLogRecord({"msg": json.dumps(entry, ensure_ascii=False), "levelno": logging.INFO}))
+
+    def close(self) -> None:
+        if self._handler is not None:
+            self._handler.close()
+            self._handler = None
+
+
+# Глобальный экземпляр маршрутизатора
+model_router = ModelRouter()
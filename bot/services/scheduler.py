@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """Планировщик периодических фоновых задач в общем event loop."""
+
+    def __init__(self) -> None:
+        self._jobs: Dict[str, tuple] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def add_job(
+            self,
+            name: str,
+            func: Callable[[], Awaitable[None]],
+            interval: float,
+            run_immediately: bool = False,
+    ) -> None:
+        """
+        Регистрирует периодическую задачу.
+
+        Args:
+            name: Уникальное имя задачи (для логов)
+            func: Асинхронная функция без аргументов
+            interval: Интервал между запусками в секундах
+            run_immediately: Выполнить первый запуск сразу после старта
+        """
+        self._jobs[name] = (func, interval, run_immediately)
+
+    def start(self) -> None:
+        """Запускает все зарегистрированные задачи."""
+        for name, (func, interval, run_immediately) in self._jobs.items():
+            if name not in self._tasks:
+                self._tasks[name] = asyncio.create_task(
+                    self._run(name, func, interval, run_immediately), name=f"job:{name}"
+                )
+                logger.info(f"⏰ Запущена фоновая задача {name} (каждые {interval:.0f} с)")
+
+    async def stop(self) -> None:
+        """Останавливает все запущенные задачи."""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    @staticmethod
+    async def _run(name: str, func, interval: float, run_immediately: bool) -> None:
+        if not run_immediately:
+            await asyncio.sleep(interval)
+
+        while True:
+            try:
+                await func()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Ошибка одной итерации не должна останавливать задачу
+                logger.exception(f"Ошибка фоновой задачи {name}")
+            await asyncio.sleep(interval)
+
+
+# Глобальный планировщик
+scheduler = Scheduler()
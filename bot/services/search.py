@@ -0,0 +1,115 @@
+import re
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.storage import EpochMillis, RoleType
+
+# Маркеры подсветки в сниппетах (заменяются на HTML после экранирования)
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Кандидаты берутся от новых к старым и ограничены SEARCH_CANDIDATE_LIMIT,
+# поэтому время запроса не растет с размером таблицы: FTS5 прекращает обход
+# индекса, набрав нужное число совпадений, и ранжирует только их.
+# Владелец и бот проверяются по dialog_history до LIMIT: иначе сообщения других
+# ботов того же пользователя расходуют лимит кандидатов, а токенизатор FTS5
+# отбрасывает знак минуса, и колонка user_id индекса у группы -N совпадает с пользователем N.
+SEARCH_SQL = text(f"""
+    SELECT c.id, c.role, c.timestamp, c.snippet
+    FROM (
+        SELECT m.id, m.role, m.timestamp, dialog_history_fts.rank AS rank,
+               snippet(dialog_history_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 16) AS snippet
+        FROM dialog_history_fts
+        JOIN dialog_history AS m ON m.id = dialog_history_fts.rowid
+        WHERE dialog_history_fts MATCH :match AND m.user_id = :user_id AND m.bot_id = :bot_id
+        ORDER BY dialog_history_fts.rowid DESC
+        LIMIT :candidates
+    ) AS c
+    ORDER BY c.rank
+    LIMIT :limit OFFSET :offset
+""").columns(role=RoleType(), timestamp=EpochMillis())
+
+
+class SearchResult(NamedTuple):
+    """Одно найденное сообщение."""
+
+    message_id: int
+    role: str
+    timestamp: Optional[datetime]
+    snippet: str
+
+
+class SearchService:
+    """Полнотекстовый поиск по истории диалогов пользователя (SQLite FTS5)."""
+
+    @staticmethod
+    def build_match_query(user_id: int, query: str) -> Optional[str]:
+        """
+        Преобразует пользовательский запрос в безопасное выражение MATCH.
+        Каждое слово ищется по префиксу, все слова обязательны.
+
+        Returns:
+            Выражение MATCH или None, если в запросе нет слов
+        """
+        tokens = _TOKEN_RE.findall(query.lower())[:settings.SEARCH_MAX_TERMS]
+        if not tokens:
+            return None
+
+        terms = " ".join(f'"{token}"*' for token in tokens)
+        return f'user_id : "{int(user_id)}" AND content : ({terms})'
+
+    @staticmethod
+    async def search(
+            session: AsyncSession,
+            user_id: int,
+            query: str,
+            page: int = 0,
+            page_size: Optional[int] = None,
+            bot_id: int = 0,
+    ) -> Tuple[List[SearchResult], bool]:
+        """
+        Ищет сообщения пользователя, ранжируя их по релевантности (bm25).
+
+        Args:
+            session: Асинхронная сессия БД
+            user_id: ID пользователя Telegram
+            query: Текст запроса
+            page: Номер страницы (с нуля)
+            page_size: Размер страницы (по умолчанию из настроек)
+            bot_id: Пространство имен бота
+
+        Returns:
+            Список результатов страницы и признак наличия следующей страницы
+        """
+        match = SearchService.build_match_query(user_id, query)
+        if match is None:
+            return [], False
+
+        page_size = page_size or settings.SEARCH_PAGE_SIZE
+
+        # Запрашиваем на одну запись больше, чтобы узнать о следующей странице
+        result = await session.execute(SEARCH_SQL, {
+            "match": match,
+            "user_id": user_id,
+            "bot_id": bot_id,
+            "candidates": settings.SEARCH_CANDIDATE_LIMIT,
+            "limit": page_size + 1,
+            "offset": page * page_size,
+        })
+        rows = result.fetchall()
+
+        results = [
+            SearchResult(
+                message_id=row.id,
+                role=row.role,
+                timestamp=row.timestamp,
+                snippet=row.snippet,
+            )
+            for row in rows[:page_size]
+        ]
+        return results, len(rows) > page_size
+
@@ -0,0 +1,169 @@
+"""
+Снимки состояния в памяти для «теплого» перезапуска.
+
+Кэши, которые иначе пришлось бы заново наполнять запросами к SQLite и
+модели (лимиты ThrottlingMiddleware, FSM-состояния MemoryStorage,
+активные ветки диалогов, inline-ответы, недавние ключи идемпотентности),
+периодически и при остановке сохраняются в один сжатый JSON-файл.
+При запуске снимок загружается, если он той же версии и не старше
+SNAPSHOT_MAX_AGE секунд. Каждый раздел восстанавливается независимо:
+ошибка в одном разделе не мешает остальным.
+
+Разделы регистрируются парой функций dump() -> JSON-совместимые данные
+и load(data). Время в разделах хранится как Unix-время (time.time()),
+потому что time.monotonic() после перезапуска начинается заново.
+
+Разделы с clean_only=True (указатели на активные ветки диалогов) устаревший
+кэш сделал бы неверными, а не просто холодными, поэтому они восстанавливаются
+только из снимка, записанного при штатной остановке. Загруженный снимок
+удаляется, чтобы после аварийного завершения не восстановить его повторно.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+from bot.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Меняется при несовместимом изменении формата разделов
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotService:
+    """Сохранение и восстановление зарегистрированных разделов состояния."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = Path(path or settings.SNAPSHOT_FILE)
+        self._sections: Dict[str, Tuple[Callable[[], Any], Callable[[Any], None], bool]] = {}
+
+    def register(
+            self,
+            name: str,
+            dump: Callable[[], Any],
+            load: Callable[[Any], None],
+            clean_only: bool = False,
+    ) -> None:
+        self._sections[name] = (dump, load, clean_only)
+
+    def build(self, clean: bool = False) -> dict:
+        """
+        Собирает снимок зарегистрированных разделов.
+        clean - снимок при штатной остановке (после него состояние не меняется).
+        """
+        sections = {}
+        for name, (dump, _, _) in self._sections.items():
+            try:
+                sections[name] = dump()
+            except Exception as e:
+                logger.warning(f"⚠️ Раздел снимка {name} не сохранен: {e}")
+        return {"version": SNAPSHOT_VERSION, "created_at": time.time(), "clean": clean, "sections": sections}
+
+    def save(self, clean: bool = False) -> int:
+        return self.write(self.build(clean))
+
+    def write(self, snapshot: dict) -> int:
+        """
+        Записывает снимок атомарно (временный файл и переименование),
+        поэтому остановка во время записи не портит предыдущий снимок.
+        Может выполняться в отдельном потоке: build() уже скопировал данные.
+
+        Returns:
+            Размер файла в байтах
+        """
+        raw = json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        data = gzip.compress(raw, compresslevel=6)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+        return len(data)
+
+    def restore(self) -> Dict[str, bool]:
+        """
+        Загружает снимок и восстанавливает разделы.
+
+        Returns:
+            Раздел -> восстановлен ли он (пустой словарь, если снимок не подошел)
+        """
+        if not self.path.exists():
+            return {}
+
+        try:
+            snapshot = json.loads(gzip.decompress(self.path.read_bytes()))
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Снимок состояния поврежден и пропущен: {e}")
+            return {}
+        finally:
+            self.path.unlink(missing_ok=True)
+
+        if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+            logger.warning("⚠️ Снимок состояния другой версии, запуск без него")
+            return {}
+
+        age = time.time() - float(snapshot.get("created_at", 0))
+        if age < 0 or age > settings.SNAPSHOT_MAX_AGE:
+            logger.info(f"⌛ Снимок состояния устарел ({age:.0f} с), запуск без него")
+            return {}
+
+        restored = {}
+        clean = snapshot.get("clean") is True
+        sections = snapshot.get("sections") or {}
+        for name, (_, load, clean_only) in self._sections.items():
+            if name not in sections or (clean_only and not clean):
+                continue
+            try:
+                load(sections[name])
+                restored[name] = True
+            except Exception as e:
+                logger.warning(f"⚠️ Раздел снимка {name} не восстановлен: {e}")
+                restored[name] = False
+
+        logger.info(f"♻️ Состояние восстановлено из снимка ({age:.0f} с): {sorted(restored)}")
+        return restored
+
+
+def dump_memory_storage(storage: MemoryStorage) -> list:
+    """FSM-состояния MemoryStorage aiogram: [[поля StorageKey], state, data]."""
+    records = []
+    for key, record in list(storage.storage.items()):
+        if record.state is None and not record.data:
+            continue
+        try:
+            json.dumps(record.data)
+        except (TypeError, ValueError):
+            continue  # Данные, которые нельзя сохранить в JSON, пропускаются
+        fields = [key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny]
+        records.append([fields, record.state, dict(record.data)])
+    return records
+
+
+def load_memory_storage(storage: MemoryStorage, records: list) -> None:
+    for fields, state, data in records:
+        bot_id, chat_id, user_id, thread_id, business_connection_id, destiny = fields
+        key = StorageKey(
+            bot_id=bot_id, chat_id=chat_id, user_id=user_id, thread_id=thread_id,
+            business_connection_id=business_connection_id, destiny=destiny,
+        )
+        storage.storage[key] = MemoryStorageRecord(data=data, state=state)
+
+
+async def run_scheduled_snapshot() -> None:
+    """Фоновая задача: периодический снимок состояния."""
+    # Разделы копируются в event loop, сжатие и запись - в отдельном потоке
+    size = await asyncio.to_thread(snapshot_service.write, snapshot_service.build())
+    logger.debug(f"💾 Снимок состояния сохранен ({size} байт)")
+
+
+# Глобальный экземпляр сервиса
+snapshot_service = SnapshotService()
@@ -0,0 +1,236 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import settings
+from bot.database import AsyncSessionLocal
+from bot.models import StatsRollup, StatsActiveUser
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ("hour", "day")
+
+
+def bucket_start(period: str, moment: datetime) -> datetime:
+    """Начало часа или дня, к которому относится момент времени."""
+    if period == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class StatsService:
+    """
+    Статистика использования бота.
+    Агрегаты обновляются инкрементально на пути записи, поэтому
+    чтение сводки не зависит от объема истории диалогов. Каждый бот
+    видит только свои агрегаты (пространство имен bot_id).
+    """
+
+    @staticmethod
+    async def _increment(
+            session: AsyncSession,
+            bot_id: int,
+            period: str,
+            bucket: datetime,
+            metric: str,
+            amount: int = 1,
+    ) -> None:
+        stmt = insert(StatsRollup).values(bot_id=bot_id, period=period, bucket=bucket, metric=metric, value=amount)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StatsRollup.bot_id, StatsRollup.period, StatsRollup.bucket, StatsRollup.metric],
+            set_={"value": StatsRollup.value + stmt.excluded.value},
+        )
+        await session.execute(stmt)
+
+    @staticmethod
+    async def record_message(
+            session: AsyncSession,
+            user_id: int,
+            role: str,
+            bot_id: int = 0,
+            moment: Optional[datetime] = None,
+    ) -> None:
+        """
+        Учитывает новое сообщение. Не делает commit: вызывается
+        в той же транзакции, что и запись сообщения в историю.
+
+        Args:
+            user_id: Автор сообщения (в группах - участник, а не чат)
+        """
+        moment = moment or datetime.utcnow()
+
+        for period in PERIODS:
+            bucket = bucket_start(period, moment)
+            await StatsService._increment(session, bot_id, period, bucket, f"messages:{role}")
+
+            if role != "user":
+                continue
+
+            # Уникальный пользователь: счетчик растет только при первой отметке в периоде
+            result = await session.execute(
+                insert(StatsActiveUser)
+                .values(bot_id=bot_id, period=period, bucket=bucket, user_id=user_id)
+                .on_conflict_do_nothing()
+            )
+            if result.rowcount:
+                await StatsService._increment(session, bot_id, period, bucket, "active_users")
+
+    @staticmethod
+    async def record_completion(
+            session: AsyncSession,
+            response: dict,
+            bot_id: int = 0,
+            moment: Optional[datetime] = None,
+    ) -> None:
+        """Учитывает результат chat_completion: успехи и отказы моделей, резервные ответы."""
+        moment = moment or datetime.utcnow()
+        model_used = response.get("model_used") if response.get("success") else None
+
+        for period in PERIODS:
+            bucket = bucket_start(period, moment)
+            await StatsService._increment(
+                session, bot_id, period, bucket, "completions:success" if model_used else "completions:failure"
+            )
+            if response.get("fallback_used"):
+                await StatsService._increment(session, bot_id, period, bucket, "completions:fallback")
+
+            for model in response.get("tried_models", []):
+                outcome = "success" if model == model_used else "failure"
+                await StatsService._increment(session, bot_id, period, bucket, f"model_{outcome}:{model}")
+
+        await session.commit()
+
+    @staticmethod
+    async def prune(session: AsyncSession, now: Optional[datetime] = None) -> Tuple[int, int]:
+        """
+        Удаляет агрегаты старше STATS_RETENTION_DAYS и отметки активных
+        пользователей за завершенные периоды: счетчик active_users по ним
+        уже посчитан, а новых отметок в прошлый период не бывает.
+
+        Returns:
+            (удалено агрегатов, удалено отметок)
+        """
+        now = now or datetime.utcnow()
+        threshold = bucket_start("day", now) - timedelta(days=settings.STATS_RETENTION_DAYS)
+
+        rollups = marks = 0
+        for period in PERIODS:
+            result = await session.execute(
+                delete(StatsRollup).where(StatsRollup.period == period, StatsRollup.bucket < threshold)
+            )
+            rollups += result.rowcount
+            result = await session.execute(
+                delete(StatsActiveUser).where(
+                    StatsActiveUser.period == period,
+                    StatsActiveUser.bucket < bucket_start(period, now),
+                )
+            )
+            marks += result.rowcount
+        await session.commit()
+        return rollups, marks
+
+    @staticmethod
+    async def _load(
+            session: AsyncSession,
+            bot_id: int,
+            period: str,
+            since: datetime,
+    ) -> Dict[datetime, Dict[str, int]]:
+        stmt = (
+            select(StatsRollup.bucket, StatsRollup.metric, StatsRollup.value)
+            .where(StatsRollup.bot_id == bot_id, StatsRollup.period == period, StatsRollup.bucket >= since)
+            .order_by(StatsRollup.bucket)
+        )
+        buckets: Dict[datetime, Dict[str, int]] = {}
+        for row in await session.execute(stmt):
+            buckets.setdefault(row.bucket, {})[row.metric] = row.value
+        return buckets
+
+    @staticmethod
+    async def get_dashboard(session: AsyncSession, bot_id: int = 0, days: int = 7) -> dict:
+        """Сводка для администратора по боту: сегодня, по часам за сутки и по дням."""
+        now = datetime.utcnow()
+        today = bucket_start("day", now)
+
+        hourly = await StatsService._load(session, bot_id, "hour", bucket_start("hour", now) - timedelta(hours=23))
+        daily = await StatsService._load(session, bot_id, "day", today - timedelta(days=days - 1))
+        current = daily.get(today, {})
+
+        completions = current.get("completions:success", 0) + current.get("completions:failure", 0)
+        models: Dict[str, Dict[str, int]] = {}
+        for metric, value in current.items():
+            kind, _, model = metric.partition(":")
+            if kind in ("model_success", "model_failure"):
+                counts = models.setdefault(model, {"successes": 0, "failures": 0})
+                counts["successes" if kind == "model_success" else "failures"] = value
+
+        return {
+            "generated_at": now.isoformat(timespec="seconds"),
+            "bot_id": bot_id,
+            "today": {
+                "active_users": current.get("active_users", 0),
+                "messages_user": current.get("messages:user", 0),
+                "messages_assistant": current.get("messages:assistant", 0),
+                "completions": completions,
+                "failures": current.get("completions:failure", 0),
+                "fallbacks": current.get("completions:fallback", 0),
+                "fallback_rate": round(current.get("completions:fallback", 0) / completions, 3) if completions else 0.0,
+            },
+            "hourly": [
+                {
+                    "hour": bucket.isoformat(timespec="minutes"),
+                    "active_users": metrics.get("active_users", 0),
+                    "messages_user": metrics.get("messages:user", 0),
+                    "messages_assistant": metrics.get("messages:assistant", 0),
+                }
+                for bucket, metrics in hourly.items()
+            ],
+            "daily": [
+                {
+                    "day": bucket.date().isoformat(),
+                    "active_users": metrics.get("active_users", 0),
+                    "messages_user": metrics.get("messages:user", 0),
+                    "messages_assistant": metrics.get("messages:assistant", 0),
+                }
+                for bucket, metrics in daily.items()
+            ],
+            "models": [
+                {"model": model, **counts}
+                for model, counts in sorted(models.items(), key=lambda item: -item[1]["successes"])
+            ],
+        }
+
+    @staticmethod
+    def format_dashboard(dashboard: dict) -> str:
+        """Текстовое представление сводки для Telegram."""
+        today = dashboard["today"]
+        lines = [
+            "📊 Статистика за сегодня (UTC)",
+            f"Активных пользователей: {today['active_users']}",
+            f"Сообщений: {today['messages_user']} от пользователей, {today['messages_assistant']} ответов",
+            f"Запросов к моделям: {today['completions']} (ошибок: {today['failures']})",
+            f"Доля резервных моделей: {today['fallback_rate'] * 100:.1f}%",
+            "",
+            "Сообщения по часам:",
+        ]
+        for row in dashboard["hourly"][-12:]:
+            lines.append(f"  {row['hour'][11:16]}  {row['messages_user']:>5}  👤 {row['active_users']}")
+
+        if dashboard["models"]:
+            lines.append("")
+            lines.append("Модели (успех / отказ):")
+            for row in dashboard["models"]:
+                lines.append(f"  {row['model']}: {row['successes']} / {row['failures']}")
+
+        return "\n".join(lines)
+
+
+async def run_scheduled_stats_prune() -> None:
+    """Фоновая задача: удаление устаревших агрегатов статистики."""
+    async with AsyncSessionLocal() as session:
+        rollups, marks = await StatsService.prune(session)
+
+    if rollups or marks:
+        logger.info(f"🧹 Статистика: удалено агрегатов {rollups}, отметок активных пользователей {marks}")
@@ -0,0 +1,259 @@
+"""
+Легковесная трассировка обработки обновлений.
+
+Спаны совместимы по формату с OpenTelemetry (OTLP/JSON): у каждого
+trace_id, span_id, родитель, время начала и конца в наносекундах,
+атрибуты и статус. Текущий спан хранится в contextvars, поэтому
+вложенность сохраняется через await и в порожденных задачах.
+
+Выборка хвостовая (tail-based): решение принимается, когда завершается
+корневой спан обновления. Медленные (TRACE_SLOW_MS) и завершившиеся
+ошибкой трассы сохраняются всегда, остальные - с вероятностью
+TRACE_SAMPLE_RATE. Сохраненные трассы выгружаются пачками фоновой задачей:
+строкой OTLP/JSON в TRACE_FILE (формат file exporter коллектора) и/или
+POST-запросом в коллектор (TRACE_COLLECTOR_URL, например
+http://localhost:4318/v1/traces).
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional
+from bot.config import settings
+from bot.services.profiling import register_structure
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "tg-chatbot"
+
+# Коды статуса OTLP
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Span:
+    """Один спан трассы."""
+
+    __slots__ = (
+        "trace", "name", "span_id", "parent_span_id", "start_ns", "end_ns",
+        "attributes", "status", "status_message",
+    )
+
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"], attributes: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = message[:200]
+        self.trace.failed = True
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1_000_000
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status, "message": self.status_message} if self.status else {},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+class Trace:
+    """Спаны одной трассы до решения о выборке."""
+
+    __slots__ = ("trace_id", "spans", "failed", "dropped")
+
+    def __init__(self) -> None:
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self.failed = False
+        self.dropped = 0
+
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Создание спанов, хвостовая выборка и пакетная выгрузка трасс."""
+
+    def __init__(self) -> None:
+        # Сохраненные выборкой трассы, ожидающие выгрузки (старые вытесняются)
+        self._queue: Deque[Trace] = deque(maxlen=settings.TRACE_QUEUE_SIZE)
+        self.exported = 0
+        self.sampled_out = 0
+        register_structure("Tracer._queue", lambda: self._queue)
+
+    @property
+    def enabled(self) -> bool:
+        return settings.TRACING_ENABLED
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current_span.get()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+        """
+        Контекстный менеджер спана. Без текущего спана начинается новая трасса
+        (корневой спан), при выходе из корневого спана принимается решение о выборке.
+        Исключение помечает спан ошибкой и пробрасывается дальше.
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        parent = _current_span.get()
+        trace = parent.trace if parent is not None else Trace()
+        span = Span(trace, name, parent, attributes)
+        if len(trace.spans) < settings.TRACE_MAX_SPANS:
+            trace.spans.append(span)
+        else:
+            trace.dropped += 1
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except asyncio.CancelledError:
+            span.set_attribute("cancelled", True)
+            raise
+        except Exception as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            if parent is None:
+                self._finish(trace, span)
+
+    def _finish(self, trace: Trace, root: Span) -> None:
+        """Хвостовая выборка: медленные и ошибочные трассы сохраняются всегда."""
+        keep = (
+            trace.failed
+            or root.duration_ms >= settings.TRACE_SLOW_MS
+            or random.random() < settings.TRACE_SAMPLE_RATE
+        )
+        if not keep:
+            self.sampled_out += 1
+            return
+
+        if trace.dropped:
+            root.set_attribute("trace.dropped_spans", trace.dropped)
+        self._queue.append(trace)
+
+    def build_payload(self, traces: List[Trace]) -> dict:
+        """Тело ExportTraceServiceRequest в формате OTLP/JSON."""
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [span.to_otlp() for trace in traces for span in trace.spans],
+                }],
+            }],
+        }
+
+    async def flush(self) -> int:
+        """
+        Выгружает накопленные трассы пачками по TRACE_BATCH_SIZE.
+
+        Returns:
+            Количество выгруженных трасс
+        """
+        exported = 0
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(settings.TRACE_BATCH_SIZE, len(self._queue)))]
+            payload = self.build_payload(batch)
+
+            if settings.TRACE_FILE:
+                line = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+                await asyncio.to_thread(_append_line, Path(settings.TRACE_FILE), line)
+
+            if settings.TRACE_COLLECTOR_URL:
+                try:
+                    await _post_to_collector(payload)
+                except Exception as e:
+                    logger.warning(f"⚠️ Коллектор трасс недоступен: {e}")
+
+            exported += len(batch)
+
+        self.exported += exported
+        return exported
+
+
+def _append_line(path: Path, line: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(line + "\n")
+
+
+async def _post_to_collector(payload: dict) -> None:
+    from bot.services.http_client import http_client
+
+    response = await http_client.post(settings.TRACE_COLLECTOR_URL, json=payload, timeout=5.0)
+    response.raise_for_status()
+
+
+def traced(name: str):
+    """Декоратор: выполняет асинхронную функцию внутри спана с заданным именем."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def run_trace_export() -> None:
+    """Фоновая задача: выгрузка сохраненных трасс."""
+    exported = await tracer.flush()
+    if exported:
+        logger.debug(f"🧵 Выгружено трасс: {exported}")
+
+
+# Глобальный трассировщик
+tracer = Tracer()
@@ -0,0 +1,141 @@
+"""
+Компактное представление строк истории в SQLite.
+
+- role хранится как маленькое целое (SMALLINT) вместо строки;
+- timestamp - целое число миллисекунд Unix-времени (UTC) вместо текста DATETIME;
+- content длиннее порога сжимается zstd (если установлен пакет zstandard) или zlib.
+
+Для кода приложения типы прозрачны: ORM по-прежнему работает со строками
+ролей, datetime и str. Для SQL внутри SQLite (триггеры и представление
+полнотекстового индекса) на каждом соединении регистрируется функция
+history_text(content), возвращающая распакованный текст.
+"""
+import zlib
+from datetime import datetime, timedelta
+from typing import Optional, Union
+from sqlalchemy import BigInteger, SmallInteger, Text, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.types import TypeDecorator
+from bot.config import settings
+
+try:
+    import zstandard
+except ImportError:  # Необязательная зависимость: без нее используется zlib
+    zstandard = None
+
+ROLE_CODES = {"user": 1, "assistant": 2}
+ROLE_NAMES = {code: name for name, code in ROLE_CODES.items()}
+
+# Первый байт сжатого значения определяет алгоритм
+CODEC_ZLIB = b"\x01"
+CODEC_ZSTD = b"\x02"
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_ms(value: datetime) -> int:
+    """datetime (наивный, UTC) -> миллисекунды Unix-времени."""
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+
+def from_epoch_ms(value: int) -> datetime:
+    """Миллисекунды Unix-времени -> наивный datetime (UTC)."""
+    return EPOCH + timedelta(milliseconds=value)
+
+
+def encode_content(text: str) -> Union[str, bytes]:
+    """
+    Сжимает текст длиннее HISTORY_COMPRESS_THRESHOLD байт.
+    Короткие тексты и тексты, которые не уменьшаются, хранятся как есть (TEXT).
+    """
+    raw = text.encode("utf-8")
+    if len(raw) < settings.HISTORY_COMPRESS_THRESHOLD:
+        return text
+
+    if settings.HISTORY_COMPRESSION == "zstd" and zstandard is not None:
+        packed = CODEC_ZSTD + zstandard.ZstdCompressor(level=3).compress(raw)
+    else:
+        packed = CODEC_ZLIB + zlib.compress(raw, 6)
+
+    return packed if len(packed) < len(raw) else text
+
+
+def decode_content(value: Union[str, bytes, None]) -> Optional[str]:
+    """Возвращает исходный текст из хранимого значения (TEXT или сжатый BLOB)."""
+    if value is None or isinstance(value, str):
+        return value
+
+    value = bytes(value)
+    codec, payload = value[:1], value[1:]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Для чтения истории, сжатой zstd, установите пакет zstandard")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    raise ValueError(f"Неизвестный формат сжатия: {codec!r}")
+
+
+class RoleType(TypeDecorator):
+    """Роль сообщения: 'user'/'assistant' в Python, SMALLINT в БД."""
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return ROLE_CODES[value]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return ROLE_NAMES[value]
+
+
+class EpochMillis(TypeDecorator):
+    """Время: datetime (UTC) в Python, миллисекунды Unix-времени (BIGINT) в БД."""
+
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return to_epoch_ms(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return from_epoch_ms(value)
+
+
+class CompressedText(TypeDecorator):
+    """
+    Текст со сжатием больших значений.
+    SQLite хранит тип каждого значения отдельно, поэтому в одной колонке
+    лежат и короткие строки (TEXT), и сжатые значения (BLOB).
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_content(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_content(value)
+
+
+def register_sqlite_functions(dbapi_connection) -> None:
+    """Регистрирует history_text() на соединении SQLite."""
+    dbapi_connection.create_function("history_text", 1, decode_content, deterministic=True)
+
+
+@event.listens_for(Engine, "connect")
+def _on_connect(dbapi_connection, connection_record) -> None:
+    # Функция нужна триггерам и представлению полнотекстового индекса на любом соединении
+    if hasattr(dbapi_connection, "create_function"):
+        register_sqlite_functions(dbapi_connection)
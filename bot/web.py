@@ -0,0 +1,109 @@
+import hmac
+import logging
+from typing import Optional
+from aiohttp import web
+from bot.config import settings
+from bot.database import AsyncSessionLocal
+from bot.profiles import get_default_profile, get_profiles
+from bot.services.http_client import get_pool_stats
+from bot.services.stats import StatsService
+from bot.services.load import load_monitor
+from bot.services import profiling
+
+logger = logging.getLogger(__name__)
+
+
+@web.middleware
+async def auth_middleware(request: web.Request, handler):
+    """Проверяет токен доступа, если он задан в WEB_AUTH_TOKEN."""
+    if settings.WEB_AUTH_TOKEN:
+        expected = f"Bearer {settings.WEB_AUTH_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            raise web.HTTPUnauthorized()
+    return await handler(request)
+
+
+def _bot_id(request: web.Request) -> int:
+    """Пространство имен бота из ?bot_id= (по умолчанию - первый запущенный бот)."""
+    if "bot_id" in request.query:
+        try:
+            return int(request.query["bot_id"])
+        except ValueError:
+            raise web.HTTPBadRequest(text="bot_id должен быть числом")
+    profiles = get_profiles()
+    return profiles[0].bot_id if profiles else get_default_profile().bot_id
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    """GET /stats?bot_id=N - сводка статистики бота из агрегатов."""
+    bot_id = _bot_id(request)
+    async with AsyncSessionLocal() as session:
+        dashboard = await StatsService.get_dashboard(session, bot_id=bot_id)
+    dashboard["http_pool"] = get_pool_stats()
+    dashboard["event_loop"] = load_monitor.stats()
+    return web.json_response(dashboard)
+
+
+def _duration(request: web.Request) -> float:
+    try:
+        value = float(request.query.get("seconds", 10))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds должен быть числом")
+    return min(max(value, 1.0), 60.0)
+
+
+async def handle_debug_profile(request: web.Request) -> web.Response:
+    """GET /debug/profile?seconds=N - CPU-профиль event loop."""
+    if profiling.is_busy():
+        raise web.HTTPConflict(text="Уже выполняется другой замер")
+    path = await profiling.profile_cpu(_duration(request))
+    return web.FileResponse(path)
+
+
+async def handle_debug_memory(request: web.Request) -> web.Response:
+    """GET /debug/memory?seconds=N - топ аллокаций tracemalloc."""
+    if profiling.is_busy():
+        raise web.HTTPConflict(text="Уже выполняется другой замер")
+    path = await profiling.profile_memory(_duration(request))
+    return web.FileResponse(path)
+
+
+async def handle_debug_sizes(request: web.Request) -> web.Response:
+    """GET /debug/sizes - размеры структур в памяти."""
+    return web.json_response(profiling.structure_sizes())
+
+
+def create_app() -> web.Application:
+    """Создает aiohttp-приложение со служебными эндпоинтами."""
+    app = web.Application(middlewares=[auth_middleware])
+    app.router.add_get("/stats", handle_stats)
+    app.router.add_get("/debug/profile", handle_debug_profile)
+    app.router.add_get("/debug/memory", handle_debug_memory)
+    app.router.add_get("/debug/sizes", handle_debug_sizes)
+    return app
+
+
+class WebServer:
+    """Небольшой HTTP-сервер для служебных эндпоинтов (статистика и отладка)."""
+
+    def __init__(self) -> None:
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        if not settings.WEB_PORT:
+            return
+
+        self._runner = web.AppRunner(create_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, settings.WEB_HOST, settings.WEB_PORT)
+        await site.start()
+        logger.info(f"🌐 HTTP-эндпоинты доступны на http://{settings.WEB_HOST}:{settings.WEB_PORT}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Глобальный экземпляр сервера
+web_server = WebServer()
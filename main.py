@@ -1,14 +1,38 @@
 import asyncio
 import logging
+import signal
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.fsm.storage.memory import MemoryStorage
 from bot.config import settings
 from bot.database import init_db, close_db
 from bot.middlewares.throttling import ThrottlingMiddleware
+from bot.middlewares.profile import BotProfileMiddleware
+from bot.middlewares.idempotency import IdempotencyMiddleware
+from bot.middlewares.groups import GroupFilterMiddleware
+from bot.middlewares.tracing import TracingMiddleware
+from bot.middlewares.load import LoadSheddingMiddleware
+from bot.profiles import load_profiles, register_profile
 from bot.database import get_session
 from aiogram import BaseMiddleware
 from bot.logging_config import setup_logging
-from bot.handlers import commands, messages
+from bot.handlers import admin, commands, messages, search, threads, inline, documents
+from bot.services.http_client import warmup_http_client, close_http_client, get_pool_stats
+from bot.services.probe import run_scheduled_probe
+from bot.services.conversations import run_scheduled_reclaim
+from bot.services.limits import run_scheduled_rollover
+from bot.services.stats import run_scheduled_stats_prune
+from bot.services.memory import memory_service
+from bot.services.routing import model_router
+from bot.services.tracing import tracer, run_trace_export
+from bot.services.load import load_monitor
+from bot.services.snapshot import (
+    snapshot_service, run_scheduled_snapshot, dump_memory_storage, load_memory_storage,
+)
+from bot.services.idempotency import run_idempotency_cleanup
+from bot.services.scheduler import scheduler
+from bot.web import web_server
+from bot.services.profiling import register_structure
 import os
 
 # Настройка логирования
@@ -36,52 +60,148 @@ async def main() -> None:
         logger.error(f"❌ Ошибка инициализации БД: {e}")
         return
 
-    # 2. Создание объектов бота и диспетчера
-    bot = Bot(token=settings.BOT_TOKEN)
+    # 2. Создание ботов и общего диспетчера.
+    # Все боты используют одну HTTP-сессию Telegram, один пул БД и один HTTP-клиент OpenRouter
+    profiles = load_profiles()
+    telegram_session = AiohttpSession()
+    bots = []
+    for profile in profiles:
+        bot = Bot(token=profile.token, session=telegram_session)
+        register_profile(bot.id, profile)
+        bots.append(bot)
+
     storage = MemoryStorage()  # Для простоты используем память
     dp = Dispatcher(storage=storage)
+    register_structure("MemoryStorage", lambda: storage.storage)
 
     # 3. Настройка middleware
+    # Сообщения групп, обращенные не к боту, отбрасываются раньше любой работы с БД
+    dp.update.outer_middleware(GroupFilterMiddleware())
+    # Корневой спан трассы обновления (после фильтра: проигнорированные сообщения не трассируются)
+    dp.update.outer_middleware(TracingMiddleware())
+    # При перегрузке event loop сообщения для модели сразу получают ответ «занято»
+    dp.update.outer_middleware(LoadSheddingMiddleware())
+    # Профиль бота, получившего обновление (история и лимиты разделены по ботам)
+    dp.update.outer_middleware(BotProfileMiddleware())
+    # Повторно доставленные обновления отбрасываются до сессии БД и вызова модели
+    dp.update.outer_middleware(IdempotencyMiddleware())
+
     # Middleware для внедрения сессии БД
     class DBSessionMiddleware(BaseMiddleware):
         async def __call__(self, handler, event, data):
-            async for session in get_session():
-                data["session"] = session
-                return await handler(event, data)
+            with tracer.span("db.session"):
+                async for session in get_session():
+                    data["session"] = session
+                    return await handler(event, data)
 
     dp.message.middleware(DBSessionMiddleware())
     dp.callback_query.middleware(DBSessionMiddleware())
+    dp.inline_query.middleware(DBSessionMiddleware())
 
-    # Middleware для ограничения запросов
-    dp.message.middleware(ThrottlingMiddleware())
-    dp.callback_query.middleware(ThrottlingMiddleware())
+    # Middleware для ограничения запросов (один экземпляр: общий кэш счетчиков)
+    throttling = ThrottlingMiddleware()
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
+    dp.inline_query.middleware(throttling)
+    settings.subscribe(throttling.reset_cache, {"TEXT_DAILY_LIMIT", "GROUP_DAILY_LIMIT"})
+
+    # Теплый перезапуск: кэши и FSM-состояния из снимка предыдущего запуска
+    if settings.SNAPSHOT_ENABLED:
+        snapshot_service.register("throttling", throttling.dump_state, throttling.load_state)
+        snapshot_service.register(
+            "fsm", lambda: dump_memory_storage(storage), lambda records: load_memory_storage(storage, records)
+        )
+        snapshot_service.restore()
 
     # 4. Регистрация роутеров
+    dp.include_router(admin.router)
     dp.include_router(commands.router)
+    dp.include_router(search.router)
+    dp.include_router(threads.router)
+    dp.include_router(inline.router)
+    dp.include_router(documents.router)
     dp.include_router(messages.router)
     # dp.include_router(buttons.router)
 
-    # 5. Получаем информацию о боте
-    bot_info = await bot.get_me()
-    logger.info(f"🤖 Бот @{bot_info.username} готов к работе!")
+    # 5. Получаем информацию о ботах и прогреваем соединение с OpenRouter
+    for bot, profile in zip(bots, profiles):
+        bot_info = await bot.me()  # Кэшируется: имя бота нужно фильтру упоминаний в группах
+        logger.info(f"🤖 Бот @{bot_info.username} ({profile.name}) готов к работе!")
+    await warmup_http_client()
+
+    # 6. Фоновые задачи (первый замер моделей выполняется сразу, не блокируя старт)
+    if settings.PROBE_INTERVAL > 0:
+        scheduler.add_job("model_probe", run_scheduled_probe, settings.PROBE_INTERVAL, run_immediately=True)
+    if settings.HISTORY_RECLAIM_INTERVAL > 0:
+        scheduler.add_job("history_reclaim", run_scheduled_reclaim, settings.HISTORY_RECLAIM_INTERVAL)
+    scheduler.add_job("idempotency_cleanup", run_idempotency_cleanup, 3600)
+    scheduler.add_job("stats_prune", run_scheduled_stats_prune, 3600)
+    if settings.LIMIT_ROLLOVER_INTERVAL > 0:
+        scheduler.add_job("limit_rollover", run_scheduled_rollover, settings.LIMIT_ROLLOVER_INTERVAL)
+    if settings.SNAPSHOT_ENABLED and settings.SNAPSHOT_INTERVAL > 0:
+        scheduler.add_job("state_snapshot", run_scheduled_snapshot, settings.SNAPSHOT_INTERVAL)
+    if tracer.enabled:
+        scheduler.add_job("trace_export", run_trace_export, settings.TRACE_EXPORT_INTERVAL)
+    if settings.SETTINGS_WATCH_INTERVAL > 0:
+        scheduler.add_job("settings_watch", run_settings_watch, settings.SETTINGS_WATCH_INTERVAL)
+    scheduler.start()
+    load_monitor.start()
+    install_reload_signal()
+    await web_server.start()
 
-    # 6. Запуск поллинга
+    # 7. Запуск поллинга
     try:
         await dp.start_polling(
-            bot,
+            *bots,
             allowed_updates=dp.resolve_used_update_types(),
             handle_signals=True,  # Обработка сигналов завершения
         )
     finally:
-        # 7. Корректное завершение работы
-        await bot.close()
+        # 8. Корректное завершение работы
+        await web_server.stop()
+        await scheduler.stop()
+        await load_monitor.stop()
+        await tracer.flush()
+        await memory_service.save_all()
+        if settings.SNAPSHOT_ENABLED:
+            logger.info(f"💾 Снимок состояния сохранен ({snapshot_service.save(clean=True)} байт)")
+        model_router.close()
+        await telegram_session.close()
+        logger.info(f"📊 Пул HTTP-соединений: {get_pool_stats()}")
+        await close_http_client()
         await close_db()
         logger.info("✅ Бот завершил работу")
 
 
+async def run_settings_watch() -> None:
+    """Фоновая задача: перезагрузка настроек при изменении .env."""
+    settings.reload_if_changed()
+
+
+def install_reload_signal() -> None:
+    """SIGHUP перечитывает настройки (kill -HUP <pid>), не прерывая обработку."""
+    if not hasattr(signal, "SIGHUP"):
+        return  # Windows
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, settings.reload)
+
+
+def create_event_loop_runner() -> asyncio.Runner:
+    """Runner основного цикла: uvloop, если он включен и установлен."""
+    if settings.USE_UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("⚠️ USE_UVLOOP включен, но uvloop не установлен. Используется asyncio")
+        else:
+            logger.info("⚡ Основной цикл работает на uvloop")
+            return asyncio.Runner(loop_factory=uvloop.new_event_loop)
+    return asyncio.Runner()
+
+
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        with create_event_loop_runner() as runner:
+            runner.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e:
@@ -62,4 +62,488 @@ async def test_clear_history(db_session):
 
     # Проверяем, что база пуста
     after_clear = await HistoryService.get_recent_history(db_session, 123)
-    assert len(after_clear) == 0
\ No newline at end of file
+    assert len(after_clear) == 0
+
+@pytest.mark.asyncio
+async def test_search_history(db_session):
+    """Тест полнотекстового поиска по истории."""
+    from unittest.mock import patch
+    from bot.config import settings
+    from bot.services.search import SearchService, HIGHLIGHT_START
+
+    await HistoryService.add_message(db_session, 123, "user", "Расскажи про асинхронность в Python")
+    await HistoryService.add_message(db_session, 123, "assistant", "Асинхронность в Python строится на asyncio")
+    await HistoryService.add_message(db_session, 123, "user", "А что насчет Rust?")
+    await HistoryService.add_message(db_session, 456, "user", "Python у другого пользователя")
+
+    results, has_more = await SearchService.search(db_session, 123, "python асинхрон")
+    assert len(results) == 2
+    assert has_more is False
+    assert all(HIGHLIGHT_START in r.snippet for r in results)
+
+    # Постраничный вывод
+    first_page, has_more = await SearchService.search(db_session, 123, "python", page_size=1)
+    assert len(first_page) == 1
+    assert has_more is True
+
+    # Чужие сообщения и спецсимволы FTS5 не влияют на результат
+    assert len((await SearchService.search(db_session, 456, "асинхронность"))[0]) == 0
+    assert (await SearchService.search(db_session, 123, '" * ( )'))[0] == []
+
+    # Группа -123 не видна пользователю 123 и наоборот (FTS5 отбрасывает минус)
+    await HistoryService.add_message(db_session, -123, "user", "Python в группе")
+    assert [r.message_id for r in (await SearchService.search(db_session, 123, "группе"))[0]] == []
+    group_results, _ = await SearchService.search(db_session, -123, "python")
+    assert len(group_results) == 1 and "группе" in group_results[0].snippet
+
+    # Сообщения другого бота не расходуют лимит кандидатов
+    await HistoryService.add_message(db_session, 123, "user", "Python для бота 7", bot_id=7)
+    with patch.object(settings, "SEARCH_CANDIDATE_LIMIT", 1):
+        assert len((await SearchService.search(db_session, 123, "python"))[0]) == 1
+        assert len((await SearchService.search(db_session, 123, "python", bot_id=7))[0]) == 1
+
+    # Удаленные сообщения исчезают из индекса
+    await HistoryService.clear_user_history(db_session, 123)
+    assert (await SearchService.search(db_session, 123, "python"))[0] == []
+
+
+@pytest.mark.asyncio
+async def test_export_history(db_session, tmp_path):
+    """Тест потоковой выгрузки истории порциями."""
+    import gzip
+    import json
+    from unittest.mock import patch
+    from bot.services.export import HistoryExporter
+
+    for i in range(5):
+        await HistoryService.add_message(db_session, 321, "user", f"Сообщение {i}")
+    await HistoryService.add_message(db_session, 654, "user", "Чужое сообщение")
+
+    # Порции меньше объема истории: проверяем переход по ключу
+    rows = [row async for row in HistoryExporter.iter_messages(db_session, 321, chunk_size=2)]
+    assert [row.content for row in rows] == [f"Сообщение {i}" for i in range(5)]
+
+    path, count = await HistoryExporter.export_to_file(db_session, 321, "jsonl", tmp_path / "h.jsonl.gz")
+    assert count == 5
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        records = [json.loads(line) for line in file]
+    assert records[0]["content"] == "Сообщение 0"
+    assert records[-1]["role"] == "user"
+
+    path, count = await HistoryExporter.export_to_file(db_session, 321, "md", tmp_path / "h.md.gz")
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        assert "Сообщение 4" in file.read()
+
+    # Ошибка чтения посреди выгрузки удаляет недописанный файл
+    async def broken(*args, **kwargs):
+        yield rows[0]
+        raise RuntimeError("соединение потеряно")
+
+    with patch.object(HistoryExporter, "iter_messages", broken):
+        with pytest.raises(RuntimeError):
+            await HistoryExporter.export_to_file(db_session, 321, "jsonl", tmp_path / "broken.jsonl.gz")
+    assert not (tmp_path / "broken.jsonl.gz").exists()
+
+
+@pytest.mark.asyncio
+async def test_stats_rollups(db_session):
+    """Тест инкрементальных агрегатов статистики."""
+    from bot.services.stats import StatsService
+
+    await HistoryService.add_message(db_session, 1, "user", "Привет")
+    await HistoryService.add_message(db_session, 1, "user", "Еще вопрос")
+    await HistoryService.add_message(db_session, 2, "user", "Здравствуйте")
+    await HistoryService.add_message(db_session, 1, "assistant", "Ответ")
+
+    await StatsService.record_completion(db_session, {
+        "success": True, "model_used": "fallback/model", "fallback_used": True,
+        "tried_models": ["primary/model", "fallback/model"],
+    })
+    await StatsService.record_completion(db_session, {
+        "success": False, "tried_models": ["primary/model"],
+    })
+
+    dashboard = await StatsService.get_dashboard(db_session)
+    today = dashboard["today"]
+
+    assert today["active_users"] == 2
+    assert today["messages_user"] == 3
+    assert today["messages_assistant"] == 1
+    assert today["completions"] == 2
+    assert today["fallback_rate"] == 0.5
+    assert dashboard["hourly"][-1]["active_users"] == 2
+
+    models = {row["model"]: row for row in dashboard["models"]}
+    assert models["primary/model"] == {"model": "primary/model", "successes": 0, "failures": 2}
+    assert models["fallback/model"]["successes"] == 1
+    assert "Активных пользователей: 2" in StatsService.format_dashboard(dashboard)
+
+    # В группе активными считаются авторы, а не чат; другой бот ведет свою статистику
+    await HistoryService.add_message(db_session, -100500, "user", "Вопрос", author_id=3)
+    await HistoryService.add_message(db_session, -100500, "user", "Еще вопрос", author_id=4)
+    await HistoryService.add_message(db_session, 5, "user", "Другому боту", bot_id=7)
+    await StatsService.record_completion(db_session, {"success": True, "model_used": "other/model"}, bot_id=7)
+
+    today = (await StatsService.get_dashboard(db_session))["today"]
+    assert today["active_users"] == 4 and today["messages_user"] == 5 and today["completions"] == 2
+    other = await StatsService.get_dashboard(db_session, bot_id=7)
+    assert other["today"]["active_users"] == 1 and other["today"]["completions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stats_prune(db_session):
+    """Тест удаления устаревших агрегатов и отметок активных пользователей."""
+    from datetime import datetime, timedelta
+    from sqlalchemy import func, select
+    from bot.models import StatsActiveUser, StatsRollup
+    from bot.services.stats import StatsService
+
+    now = datetime(2026, 3, 10, 12, 30)
+    await StatsService.record_message(db_session, 1, "user", moment=now - timedelta(days=40))
+    await StatsService.record_message(db_session, 1, "user", moment=now - timedelta(hours=2))
+    await StatsService.record_message(db_session, 2, "user", moment=now)
+    await db_session.commit()
+
+    rollups, marks = await StatsService.prune(db_session, now=now)
+
+    # Агрегаты 40-дневной давности удалены (по часу и дню), свежие остаются
+    assert rollups == 4
+    buckets = set(await db_session.scalars(select(StatsRollup.bucket).where(StatsRollup.period == "day")))
+    assert buckets == {datetime(2026, 3, 10)}
+
+    # Остаются только отметки текущего часа и дня: повторный визит в них не учитывается
+    assert marks == 3
+    assert await db_session.scalar(select(func.count()).select_from(StatsActiveUser)) == 3
+    await StatsService.record_message(db_session, 2, "user", moment=now)
+    active = await db_session.scalar(select(StatsRollup.value).where(
+        StatsRollup.period == "day", StatsRollup.bucket == datetime(2026, 3, 10), StatsRollup.metric == "active_users"))
+    assert active == 2
+
+
+@pytest.mark.asyncio
+async def test_history_namespaced_per_bot(db_session):
+    """Тест разделения истории между ботами в общей БД."""
+    await HistoryService.add_message(db_session, 123, "user", "Бот А", bot_id=1)
+    await HistoryService.add_message(db_session, 123, "user", "Бот Б", bot_id=2)
+
+    assert await HistoryService.get_recent_history(db_session, 123, bot_id=1) == [("user", "Бот А")]
+    assert await HistoryService.get_recent_history(db_session, 123, bot_id=2) == [("user", "Бот Б")]
+
+    assert await HistoryService.clear_user_history(db_session, 123, bot_id=1) == 1
+    assert await HistoryService.get_message_count(db_session, 123, bot_id=2) == 1
+
+
+@pytest.mark.asyncio
+async def test_migrations_add_missing_columns(tmp_path):
+    """Тест миграции базы, созданной до появления новых колонок."""
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from bot.migrations import run_migrations, get_columns
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.sqlite'}")
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "CREATE TABLE dialog_history (id INTEGER PRIMARY KEY, user_id BIGINT NOT NULL, "
+            "role VARCHAR(20) NOT NULL, content TEXT NOT NULL, timestamp DATETIME)"
+        ))
+        await conn.execute(text("INSERT INTO dialog_history (user_id, role, content) VALUES (1, 'user', 'Старое')"))
+
+        await run_migrations(conn)
+        # Повторный запуск не должен ничего ломать
+        await run_migrations(conn)
+
+        assert "bot_id" in await get_columns(conn, "dialog_history")
+        result = await conn.execute(text("SELECT bot_id FROM dialog_history"))
+        assert result.scalar() == 0
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_migrate_stats_namespaces(tmp_path):
+    """Тест миграции статистики: прежние агрегаты переходят в пространство имен 0."""
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from bot.migrations import get_columns, migrate_stats_namespaces
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.sqlite'}")
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "CREATE TABLE stats_rollup (period VARCHAR(5), bucket DATETIME, metric VARCHAR(255), "
+            "value INTEGER NOT NULL, PRIMARY KEY (period, bucket, metric))"
+        ))
+        await conn.execute(text(
+            "CREATE TABLE stats_active_users (period VARCHAR(5), bucket DATETIME, user_id BIGINT, "
+            "PRIMARY KEY (period, bucket, user_id))"
+        ))
+        await conn.execute(text(
+            "INSERT INTO stats_rollup VALUES ('day', '2026-03-10 00:00:00.000000', 'messages:user', 3)"
+        ))
+
+        assert await migrate_stats_namespaces(conn) == 2
+        assert await migrate_stats_namespaces(conn) == 0
+
+        assert "bot_id" in await get_columns(conn, "stats_active_users")
+        result = await conn.execute(text("SELECT bot_id, metric, value FROM stats_rollup"))
+        assert result.all() == [(0, "messages:user", 3)]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_compact_storage(db_session):
+    """Тест компактного хранения: роль числом, время в мс, сжатие длинного текста."""
+    from sqlalchemy import text
+    from bot.services.search import SearchService
+
+    long_answer = "Длинный ответ ассистента про квантовые компьютеры. " * 100
+    await HistoryService.add_message(db_session, 777, "user", "Коротко")
+    await HistoryService.add_message(db_session, 777, "assistant", long_answer)
+    await db_session.commit()
+
+    result = await db_session.execute(text(
+        "SELECT role, typeof(timestamp) AS ts_type, typeof(content) AS content_type, length(content) AS size "
+        "FROM dialog_history WHERE user_id = 777 ORDER BY id"
+    ))
+    short, long = result.fetchall()
+    assert (short.role, short.ts_type, short.content_type) == (1, "integer", "text")
+    assert (long.role, long.content_type) == (2, "blob")
+    assert long.size < len(long_answer.encode("utf-8")) / 5
+
+    # ORM и полнотекстовый поиск видят исходный текст
+    assert await HistoryService.get_recent_history(db_session, 777) == [
+        ("user", "Коротко"), ("assistant", long_answer)
+    ]
+    results, _ = await SearchService.search(db_session, 777, "квантовые")
+    assert [item.role for item in results] == ["assistant"]
+
+
+@pytest.mark.asyncio
+async def test_migrate_compact_history(tmp_path):
+    """Тест переноса истории из старого формата с сохранением поиска."""
+    from datetime import datetime
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from bot.migrations import run_migrations, get_column_types
+    from bot.services.search import SearchService
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'legacy.sqlite'}")
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "CREATE TABLE dialog_history (id INTEGER PRIMARY KEY, user_id BIGINT NOT NULL, "
+            "bot_id BIGINT NOT NULL DEFAULT 0, role VARCHAR(20) NOT NULL, content TEXT NOT NULL, timestamp DATETIME)"
+        ))
+        await conn.execute(text(
+            "INSERT INTO dialog_history (user_id, role, content, timestamp) VALUES "
+            "(5, 'user', 'Расскажи про сжатие', '2026-01-02 03:04:05.678000'), "
+            "(5, 'assistant', :answer, '2026-01-02 03:04:06.000000')"
+        ), {"answer": "Алгоритм zstd сжимает данные. " * 50})
+
+        await run_migrations(conn)
+        await run_migrations(conn)
+
+        types = await get_column_types(conn, "dialog_history")
+        assert (types["role"], types["timestamp"]) == ("SMALLINT", "BIGINT")
+
+    async with async_sessionmaker(engine)() as session:
+        history = await HistoryService.get_recent_history(session, 5)
+        assert [role for role, _ in history] == ["user", "assistant"]
+        assert history[1][1] == "Алгоритм zstd сжимает данные. " * 50
+
+        results, _ = await SearchService.search(session, 5, "алгоритм")
+        assert len(results) == 1
+        assert results[0].timestamp == datetime(2026, 1, 2, 3, 4, 6)
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_conversation_epochs(db_session):
+    """Тест сброса контекста через эпохи, восстановления и фоновой очистки."""
+    from bot.services.conversations import ConversationService
+
+    first = await ConversationService.get_current(db_session, 321)
+    await HistoryService.add_message(db_session, 321, "user", "Первый диалог", conversation_id=first)
+
+    second = await ConversationService.start_new(db_session, 321)
+    assert second != first
+    assert await HistoryService.get_recent_history(db_session, 321, conversation_id=second) == []
+    await HistoryService.add_message(db_session, 321, "user", "Второй диалог", conversation_id=second)
+
+    # Третья эпоха: первая больше не восстанавливается и удаляется фоновой задачей
+    third = await ConversationService.start_new(db_session, 321)
+    assert await ConversationService.reclaim(db_session, batch_size=1) == 1
+    assert await HistoryService.get_message_count(db_session, 321) == 1
+
+    assert await ConversationService.restore(db_session, 321) == second
+    assert await ConversationService.get_current(db_session, 321) == second
+    assert await HistoryService.get_recent_history(db_session, 321, conversation_id=second) == [
+        ("user", "Второй диалог")
+    ]
+    # Повторное восстановление меняет эпохи обратно
+    assert await ConversationService.restore(db_session, 321) == third
+    assert await ConversationService.restore(db_session, 999) is None
+
+
+@pytest.mark.asyncio
+async def test_reclaim_queue_backfill(tmp_path):
+    """Тест: сброшенные эпохи базы без очереди очистки ставятся в очередь при ее создании."""
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from bot.models import Base, RetiredConversation
+    from bot.services.conversations import ConversationService
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'legacy.sqlite'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(lambda sync_conn: RetiredConversation.__table__.drop(sync_conn))
+
+    async with async_sessionmaker(engine)() as session:
+        for conversation_id in (0, 1, 2, 3):
+            await HistoryService.add_message(session, 8, "user", f"Эпоха {conversation_id}", conversation_id=conversation_id)
+        await session.execute(text(
+            "INSERT INTO user_states (user_id, bot_id, conversation_id, previous_conversation_id, next_conversation_id) "
+            "VALUES (8, 0, 3, 2, 4)"
+        ))
+        await session.commit()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with async_sessionmaker(engine)() as session:
+        assert await ConversationService.reclaim(session) == 2
+        assert await HistoryService.get_message_count(session, 8) == 2
+        assert await ConversationService.reclaim(session) == 0
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_conversation_threads(db_session):
+    """Тест именованных веток: переключение и защита от фоновой очистки."""
+    from bot.services.conversations import ConversationService
+    from bot.handlers.threads import find_thread
+
+    work = await ConversationService.get_current(db_session, 654)
+    await HistoryService.add_message(db_session, 654, "user", "Рабочий вопрос", conversation_id=work)
+    await ConversationService.rename(db_session, 654, "Работа")
+
+    study = await ConversationService.start_new(db_session, 654)
+    await HistoryService.add_message(db_session, 654, "user", "Учебный вопрос", conversation_id=study)
+    await ConversationService.rename(db_session, 654, "Учеба")
+
+    # Две эпохи назад: обычный диалог удалился бы, но ветка сохраняется
+    await ConversationService.start_new(db_session, 654)
+    await ConversationService.start_new(db_session, 654)
+    assert await ConversationService.reclaim(db_session) == 0
+
+    threads = await ConversationService.list_threads(db_session, 654)
+    assert [thread.title for thread in threads] == ["Работа", "Учеба"]
+    assert find_thread(threads, "учеба").conversation_id == study
+    assert find_thread(threads, "1").conversation_id == work
+    assert find_thread(threads, "3") is None
+
+    assert await ConversationService.switch(db_session, 654, work)
+    assert await ConversationService.get_current(db_session, 654) == work
+    assert await HistoryService.get_recent_history(db_session, 654, conversation_id=work) == [
+        ("user", "Рабочий вопрос")
+    ]
+    assert not await ConversationService.switch(db_session, 654, 12345)
+
+
+@pytest.mark.asyncio
+async def test_data_layer_benchmark_smoke(tmp_path):
+    """Тест генератора данных и набора бенчмарков на маленькой базе."""
+    from benchmarks.data_layer import DataLayerBenchmark, build_db, count_rows, compare
+
+    path = tmp_path / "bench.sqlite"
+    await build_db(path, rows=400, users=20)
+    assert count_rows(path) == 400
+
+    results = await DataLayerBenchmark(path, users=20, rounds=3, warmup=1).run()
+    by_name = {item["name"]: item for item in results}
+    assert by_name["history.get_recent_history"]["stats"]["rounds"] == 3
+
+    # Запросы истории и лимитов должны идти по индексам
+    for name in ("history.get_recent_history", "throttling.check_limit"):
+        plans = by_name[name]["extra_info"]["query_plans"]
+        assert plans and not any(plan["full_scan"] for plan in plans)
+
+    slower = {"benchmarks": [{"name": "history.add_message", "stats": {"mean": 1.0}}]}
+    previous = {"benchmarks": [{"name": "history.add_message", "stats": {"mean": 0.5}}]}
+    assert compare(slower, previous, threshold=0.1) == [("history.add_message", 1.0)]
+
+
+@pytest.mark.asyncio
+async def test_usage_counters(db_session, monkeypatch):
+    """Тест счетчиков дневного лимита: учет в транзакции истории, сброс окна, свой лимит и очистка."""
+    from datetime import datetime, timedelta
+    from bot.config import settings
+    from bot.middlewares.throttling import ThrottlingMiddleware
+    from bot.models import UsageCounter
+    from bot.services.limits import UsageService, reset_time, window_bounds
+
+    for _ in range(3):
+        await HistoryService.add_message(db_session, 31, "user", "вопрос")
+    await HistoryService.add_message(db_session, 31, "assistant", "ответ")
+
+    usage = await UsageService.get(db_session, 31)
+    assert usage.count == 3 and usage.limit_override is None
+    assert usage.reset_at - datetime.utcnow() > timedelta(hours=23)
+
+    # Индивидуальный лимит ниже использованного блокирует пользователя
+    throttling = ThrottlingMiddleware()
+    await UsageService.set_override(db_session, 31, 2)
+    assert await throttling._check_limit(31, db_session) == (False, 3)
+    throttling.forget(31)
+    await UsageService.set_override(db_session, 31, None)
+    assert await throttling._check_limit(31, db_session) == (True, 3)
+
+    # Истекшее окно начинается заново при следующем запросе
+    counter = await db_session.get(UsageCounter, (0, 31))
+    counter.window_start = datetime.utcnow() - timedelta(hours=25)
+    await db_session.commit()
+    assert (await UsageService.get(db_session, 31)).count == 0
+    await HistoryService.add_message(db_session, 31, "user", "новый день")
+    assert (await UsageService.get(db_session, 31)).count == 1
+
+    # Фоновая задача обнуляет истекшие окна и удаляет давно неактивных
+    await UsageService.set_override(db_session, 32, 500)
+    await UsageService.increment(db_session, 33, now=datetime.utcnow() - timedelta(days=30))
+    await db_session.commit()
+    reset, pruned = await UsageService.rollover(db_session)
+    assert (reset, pruned) == (1, 1)
+    assert await db_session.get(UsageCounter, (0, 33)) is None
+    assert (await UsageService.get(db_session, 32)).limit_override == 500
+
+    # Календарный режим: окно с полуночи по LIMIT_TIMEZONE до следующей полуночи
+    monkeypatch.setattr(settings, "LIMIT_RESET_MODE", "calendar")
+    monkeypatch.setattr(settings, "LIMIT_TIMEZONE", "Europe/Moscow")
+    threshold, start = window_bounds(datetime(2026, 3, 10, 22, 30))  # 01:30 11 марта по Москве
+    assert threshold == start == datetime(2026, 3, 10, 21, 0)
+    assert reset_time(start) == datetime(2026, 3, 11, 21, 0)
+
+
+@pytest.mark.asyncio
+async def test_usage_counters_backfill(db_session):
+    """Тест заполнения пустой таблицы счетчиков по истории текущего окна."""
+    from datetime import datetime, timedelta
+    from sqlalchemy import delete
+    from bot.migrations import backfill_usage_counters
+    from bot.models import DialogHistory, UsageCounter
+    from bot.services.limits import UsageService
+
+    now = datetime.utcnow()
+    db_session.add_all([
+        DialogHistory(user_id=41, role="user", content="старое", timestamp=now - timedelta(hours=30)),
+        DialogHistory(user_id=41, role="user", content="раз", timestamp=now - timedelta(hours=5)),
+        DialogHistory(user_id=41, role="assistant", content="ответ", timestamp=now - timedelta(hours=5)),
+        DialogHistory(user_id=41, role="user", content="два", timestamp=now - timedelta(hours=1)),
+    ])
+    await db_session.execute(delete(UsageCounter))
+    await db_session.commit()
+
+    connection = await db_session.connection()
+    assert await backfill_usage_counters(connection) == 1
+    assert await backfill_usage_counters(connection) == 0  # Таблица уже заполнена
+
+    usage = await UsageService.get(db_session, 41)
+    assert usage.count == 2
+    # Окно открыто первым запросом за последние 24 часа
+    assert timedelta(hours=18) < usage.reset_at - now < timedelta(hours=20)
@@ -1,6 +1,6 @@
 import pytest
 from unittest.mock import AsyncMock
-from aiogram.types import Message, User
+from aiogram.types import Chat, Message, User
 from bot.handlers.commands import cmd_start, cmd_help
 
 
@@ -9,6 +9,7 @@ async def test_start_command():
     """Тест команды /start."""
     mock_message = AsyncMock(spec=Message)
     mock_message.from_user = User(id=123, first_name="Test", is_bot=False)
+    mock_message.chat = Chat(id=123, type="private")
     mock_message.answer = AsyncMock()
 
     mock_session = AsyncMock()
@@ -35,4 +36,44 @@ async def test_help_command():
     assert mock_message.answer.called
     call_args = mock_message.answer.call_args
     assert "/start" in call_args[0][0]
-    assert "/help" in call_args[0][0]
\ No newline at end of file
+    assert "/help" in call_args[0][0]
+
+@pytest.mark.asyncio
+async def test_new_request_button_in_group():
+    """Кнопка «Новый запрос» в группе сбрасывает контекст чата, а не автора."""
+    from unittest.mock import patch
+    from bot.handlers.messages import handle_new_request
+
+    mock_message = AsyncMock(spec=Message)
+    mock_message.from_user = User(id=123, first_name="Test", is_bot=False)
+    mock_message.chat = Chat(id=-100500, type="supergroup")
+    mock_message.answer = AsyncMock()
+
+    with patch("bot.handlers.messages.ConversationService.start_new", new=AsyncMock()) as start_new:
+        await handle_new_request(mock_message, AsyncMock())
+
+    assert start_new.call_args[0][1] == -100500
+
+
+@pytest.mark.asyncio
+async def test_history_commands_private_only_in_group():
+    """/search и /export в группе не открывают общую историю чата участникам."""
+    from unittest.mock import patch
+    from aiogram.filters import CommandObject
+    from bot.handlers.commands import cmd_export
+    from bot.handlers.search import cmd_search
+
+    mock_message = AsyncMock(spec=Message)
+    mock_message.from_user = User(id=123, first_name="Test", is_bot=False)
+    mock_message.chat = Chat(id=-100500, type="supergroup")
+    mock_message.answer = AsyncMock()
+
+    with patch("bot.handlers.search.SearchService.search", new=AsyncMock()) as search, \
+            patch("bot.handlers.commands.HistoryExporter.export_to_file", new=AsyncMock()) as export:
+        await cmd_search(mock_message, AsyncMock(), AsyncMock(), CommandObject(command="search", args="пароль"))
+        await cmd_export(mock_message, AsyncMock(), CommandObject(command="export", args=None))
+
+    assert not search.called and not export.called
+    assert not mock_message.answer_document.called
+    assert mock_message.answer.call_count == 2
+    assert all("личном чате" in call.args[0] for call in mock_message.answer.call_args_list)
@@ -1,7 +1,8 @@
 import pytest
+from datetime import datetime
 from unittest.mock import AsyncMock, Mock
 from bot.middlewares.throttling import ThrottlingMiddleware
-from aiogram.types import Message, User
+from aiogram.types import Chat, Message, User
 
 
 @pytest.mark.asyncio
@@ -12,12 +13,13 @@ async def test_throttling_middleware():
     mock_message = AsyncMock(spec=Message)
     mock_message.text = "Тестовое сообщение"
     mock_message.from_user = User(id=123, first_name="Test", is_bot=False)
+    mock_message.chat = Chat(id=123, type="private")
     mock_message.answer = AsyncMock()
 
     # Мок сессии БД
     mock_session = AsyncMock()
     mock_result = Mock()
-    mock_result.scalar.return_value = 10
+    mock_result.one_or_none.return_value = (10, datetime.utcnow(), None)  # count, window_start, limit_override
     mock_session.execute = AsyncMock(return_value=mock_result)
 
 
@@ -39,12 +41,13 @@ async def test_throttling_middleware_limit_exceeded():
     mock_message = AsyncMock(spec=Message)
     mock_message.text = "Тестовое сообщение"
     mock_message.from_user = User(id=456, first_name="Test2", is_bot=False)
+    mock_message.chat = Chat(id=456, type="private")
     mock_message.answer = AsyncMock()
 
     # Мок: возвращаем 200 запросов (больше лимита 200)
     mock_session = AsyncMock()
     mock_result = Mock()
-    mock_result.scalar.return_value = 201  # Превышает TEXT_DAILY_LIMIT=200
+    mock_result.one_or_none.return_value = (201, datetime.utcnow(), None)  # Превышает TEXT_DAILY_LIMIT=200
     mock_session.execute = AsyncMock(return_value=mock_result)
 
     mock_handler = AsyncMock()
@@ -55,4 +58,209 @@ async def test_throttling_middleware_limit_exceeded():
     # При превышении лимита handler НЕ должен вызываться
     assert not mock_handler.called
     # Проверяем, что отправили сообщение о лимите
-    assert mock_message.answer.called
\ No newline at end of file
+    assert mock_message.answer.called
+
+
+@pytest.mark.asyncio
+async def test_throttling_middleware_zero_override():
+    """Тест: индивидуальный лимит 0 блокирует пользователя и показывается в сообщении."""
+    middleware = ThrottlingMiddleware()
+
+    mock_message = AsyncMock(spec=Message)
+    mock_message.text = "Тестовое сообщение"
+    mock_message.from_user = User(id=789, first_name="Test3", is_bot=False)
+    mock_message.chat = Chat(id=789, type="private")
+    mock_message.answer = AsyncMock()
+
+    mock_session = AsyncMock()
+    mock_result = Mock()
+    mock_result.one_or_none.return_value = (0, datetime.utcnow(), 0)  # Администратор назначил /limit 789 0
+    mock_session.execute = AsyncMock(return_value=mock_result)
+
+    mock_handler = AsyncMock()
+    await middleware(mock_handler, mock_message, {"session": mock_session})
+
+    assert not mock_handler.called
+    assert "0 из 0 доступных" in mock_message.answer.call_args.args[0]
+
+@pytest.mark.asyncio
+async def test_idempotency_middleware_drops_redelivery(engine):
+    """Тест: повторно доставленное обновление не доходит до обработчика, в том числе после перезапуска."""
+    from datetime import datetime
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from aiogram.types import Update
+    from bot.middlewares.idempotency import IdempotencyMiddleware
+    from bot.services.idempotency import IdempotencyStore
+
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+    message = Message(
+        message_id=77, date=datetime.now(), chat=Chat(id=555, type="private"),
+        from_user=User(id=555, first_name="Test", is_bot=False), text="Привет",
+    )
+    update = Update(update_id=1001, message=message)
+    data = {"bot": Mock(id=42)}
+
+    middleware = IdempotencyMiddleware(IdempotencyStore(max_size=10), session_factory=factory)
+    handler = AsyncMock()
+    await middleware(handler, update, data)
+    await middleware(handler, update, data)
+    assert handler.call_count == 1
+
+    # Новый процесс: пустой кэш в памяти, ключ находится в SQLite
+    restarted = IdempotencyMiddleware(IdempotencyStore(max_size=10), session_factory=factory)
+    await restarted(handler, update, data)
+    assert handler.call_count == 1
+
+    async with factory() as session:
+        assert await IdempotencyStore.cleanup(session, ttl=-1) >= 1
+
+
+@pytest.mark.asyncio
+async def test_idempotency_middleware_redelivers_after_failure(engine):
+    """Тест: обновление, обработка которого упала или прервалась, обрабатывается при повторной доставке."""
+    from datetime import datetime
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from aiogram.types import Update
+    from bot.middlewares.idempotency import IdempotencyMiddleware
+    from bot.services.idempotency import IdempotencyStore
+
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+    message = Message(
+        message_id=78, date=datetime.now(), chat=Chat(id=556, type="private"),
+        from_user=User(id=556, first_name="Test", is_bot=False), text="Привет",
+    )
+    update = Update(update_id=1002, message=message)
+    data = {"bot": Mock(id=42)}
+    middleware = IdempotencyMiddleware(IdempotencyStore(max_size=10), session_factory=factory)
+
+    # Ошибка обработчика снимает захват
+    failing = AsyncMock(side_effect=RuntimeError("сбой"))
+    with pytest.raises(RuntimeError):
+        await middleware(failing, update, data)
+    handler = AsyncMock()
+    await middleware(handler, update, data)
+    await middleware(handler, update, data)
+    assert handler.call_count == 1
+
+    # Процесс остановился посреди обработки: захват без отметки о завершении
+    store = IdempotencyStore(max_size=10)
+    async with factory() as session:
+        assert await store.claim(session, "upd:42:1003")
+        assert not await store.claim(session, "upd:42:1003")
+        # Брошенный захват старше таймаута доступен повторной доставке
+        assert await store.claim(session, "upd:42:1003", timeout=-1)
+        await store.complete(session, "upd:42:1003")
+        assert not await store.claim(session, "upd:42:1003", timeout=-1)
+
+
+@pytest.mark.asyncio
+async def test_group_filter_middleware():
+    """Тест: в группе до обработчиков доходят только обращения к боту, сообщения без них не трогают БД."""
+    from datetime import datetime
+    from aiogram.types import Update, MessageEntity
+    from bot.filters import dialog_owner, strip_bot_mention
+    from bot.middlewares.groups import GroupFilterMiddleware
+
+    bot = Mock(id=42)
+    bot.me = AsyncMock(return_value=User(id=42, first_name="Bot", is_bot=True, username="TestBot"))
+    group = Chat(id=-100500, type="supergroup")
+    author = User(id=7, first_name="Anna", is_bot=False)
+
+    def update(text, **kwargs):
+        message = Message(message_id=1, date=datetime.now(), chat=group, from_user=author, text=text, **kwargs)
+        return Update(update_id=1, message=message)
+
+    bot_message = Message(
+        message_id=0, date=datetime.now(), chat=group,
+        from_user=User(id=42, first_name="Bot", is_bot=True), text="Ответ",
+    )
+    cases = [
+        (update("просто болтовня"), False),
+        (update("пишите на a@b.c"), False),
+        (update("@OtherBot привет"), False),
+        (update("/start@OtherBot"), False),
+        (update("/help"), True),
+        (update("/new@TestBot"), True),
+        (update("а ты что думаешь?", reply_to_message=bot_message), True),
+        (update("@testbot что нового?", entities=[MessageEntity(type="mention", offset=0, length=8)]), True),
+    ]
+
+    middleware = GroupFilterMiddleware()
+    for event, expected in cases:
+        handler = AsyncMock()
+        await middleware(handler, event, {"bot": bot})
+        assert handler.called == expected, event.message.text
+
+    # Личные сообщения проходят без проверок
+    private = Message(
+        message_id=2, date=datetime.now(), chat=Chat(id=7, type="private"), from_user=author, text="привет",
+    )
+    handler = AsyncMock()
+    await middleware(handler, Update(update_id=2, message=private), {"bot": bot})
+    assert handler.called
+
+    assert dialog_owner(group, author) == -100500
+    assert dialog_owner(private.chat, author) == 7
+    assert strip_bot_mention("@TestBot, что нового?", "testbot") == "что нового?"
+
+
+@pytest.mark.asyncio
+async def test_load_shedding_middleware(monkeypatch):
+    """Тест: при перегрузке сообщения для модели отклоняются без обработки, команды проходят."""
+    from datetime import datetime
+    from aiogram.types import Update, CallbackQuery
+    from bot.config import settings
+    from bot.middlewares.load import LoadSheddingMiddleware, BUSY_TEXT
+    from bot.services.load import LoadMonitor
+
+    monkeypatch.setattr(settings, "LOAD_SHED_LAG_MS", 100.0)
+    monkeypatch.setattr(settings, "LOAD_DEFER_TIMEOUT", 0.05)
+    monkeypatch.setattr(settings, "LOOP_LAG_INTERVAL", 0.01)
+
+    monitor = LoadMonitor()
+    for lag in (5.0, 8.0, 3.0):
+        monitor.record_lag(lag)
+    assert not monitor.overloaded
+
+    user = User(id=9, first_name="Test", is_bot=False)
+    chat = Chat(id=9, type="private")
+
+    def update(text):
+        return Update(update_id=1, message=Message(
+            message_id=1, date=datetime.now(), chat=chat, from_user=user, text=text,
+        ))
+
+    bot = Mock(id=42)
+    bot.send_message = AsyncMock()
+    bot.answer_callback_query = AsyncMock()
+    middleware = LoadSheddingMiddleware(monitor)
+
+    handler = AsyncMock()
+    await middleware(handler, update("вопрос"), {"bot": bot})
+    assert handler.called and monitor.in_flight == 0
+
+    # Перегрузка: сообщение отклонено, пользователь уведомлен один раз за паузу
+    for _ in range(10):
+        monitor.record_lag(2000.0)
+    assert monitor.overloaded
+
+    handler = AsyncMock()
+    await middleware(handler, update("вопрос"), {"bot": bot})
+    await middleware(handler, update("еще вопрос"), {"bot": bot})
+    assert not handler.called
+    bot.send_message.assert_awaited_once_with(9, BUSY_TEXT)
+
+    await middleware(handler, update("/help"), {"bot": bot})
+    assert handler.call_count == 1
+
+    # Кнопка откладывается и при сохраняющейся перегрузке получает ответ «занято»
+    callback = Update(update_id=2, callback_query=CallbackQuery(
+        id="cb", from_user=user, chat_instance="x", data="search:2",
+    ))
+    await middleware(handler, callback, {"bot": bot})
+    assert handler.call_count == 1
+    bot.answer_callback_query.assert_awaited_once()
+
+    assert monitor.shed == 3 and monitor.deferred == 1
+    stats = monitor.stats()
+    assert stats["lag_ms"]["max"] == 2000.0 and stats["lag_ms"]["p50"] >= 5.0
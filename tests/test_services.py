@@ -49,4 +49,602 @@ async def test_chat_completion(mock_openai):
     )
 
     assert result["success"] == True
-    assert "Тестовый ответ" in result["content"]
\ No newline at end of file
+    assert "Тестовый ответ" in result["content"]
+
+def test_http_timeouts_per_model():
+    """Тест таймаутов HTTP-клиента с переопределением для модели."""
+    from bot.config import settings
+    from bot.services.http_client import build_timeout, get_total_timeout, get_pool_stats
+
+    overrides = {"slow/model": {"connect": 1.5, "read": 120, "total": 150}}
+    with patch.object(settings, "OPENROUTER_MODEL_TIMEOUTS", overrides):
+        timeout = build_timeout("slow/model")
+        assert timeout.connect == 1.5
+        assert timeout.read == 120
+        assert get_total_timeout("slow/model") == 150
+
+        default = build_timeout("other/model")
+        assert default.connect == settings.HTTP_CONNECT_TIMEOUT
+        assert get_total_timeout("other/model") == settings.HTTP_TOTAL_TIMEOUT
+
+    stats = get_pool_stats()
+    assert stats["connections"] == 0
+    assert stats["max_connections"] == settings.HTTP_MAX_CONNECTIONS
+
+
+def _api_error(cls, status_code: int):
+    """Создает исключение openai с заданным HTTP-статусом."""
+    import httpx
+
+    request = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+    response = httpx.Response(status_code, request=request)
+    return cls("Ошибка", response=response, body=None)
+
+
+def test_retry_policy_classification():
+    """Тест классификации ошибок по типам openai."""
+    import asyncio
+    import httpx
+    import openai
+    from bot.services.retry import RetryPolicy, ErrorKind
+
+    request = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+
+    assert RetryPolicy.classify(openai.APIConnectionError(request=request)) is ErrorKind.TRANSIENT
+    assert RetryPolicy.classify(asyncio.TimeoutError()) is ErrorKind.TRANSIENT
+    assert RetryPolicy.classify(_api_error(openai.InternalServerError, 502)) is ErrorKind.TRANSIENT
+    assert RetryPolicy.classify(_api_error(openai.RateLimitError, 429)) is ErrorKind.NEXT_MODEL
+    assert RetryPolicy.classify(_api_error(openai.NotFoundError, 404)) is ErrorKind.NEXT_MODEL
+    assert RetryPolicy.classify(_api_error(openai.AuthenticationError, 401)) is ErrorKind.FATAL
+    assert RetryPolicy.classify(ValueError("bug")) is ErrorKind.FATAL
+
+
+def test_retry_policy_follows_settings(monkeypatch):
+    """Тест политики повторов: перечитанные настройки применяются без перезапуска."""
+    from bot.config import settings
+    from bot.services.retry import RetryPolicy, retry_policy
+
+    monkeypatch.setattr(settings, "RETRY_MAX_ATTEMPTS", 5)
+    monkeypatch.setattr(settings, "RETRY_BACKOFF_MAX", 0.0)
+    assert retry_policy.max_attempts == 5
+    assert retry_policy.backoff(3) == 0.0
+
+    # Явно заданные параметры настройки не переопределяют
+    assert RetryPolicy(max_attempts=2).max_attempts == 2
+
+
+@pytest.mark.asyncio
+async def test_chat_completion_retries_transient_then_falls_back():
+    """Тест повтора временной ошибки и перехода на резервную модель."""
+    import openai
+    from bot.services.retry import RetryPolicy
+
+    service = OpenRouterService()
+    service.all_models = ["primary/model", "fallback/model"]
+
+    mock_response = AsyncMock()
+    mock_response.choices = [AsyncMock()]
+    mock_response.choices[0].message.content = "Ответ резервной модели"
+    mock_response.usage = None
+
+    service.client = AsyncMock()
+    service.client.chat.completions.create.side_effect = [
+        _api_error(openai.InternalServerError, 503),
+        _api_error(openai.RateLimitError, 429),
+        mock_response,
+    ]
+
+    policy = RetryPolicy(max_attempts=3, backoff_base=0, backoff_max=0)
+    with patch("bot.services.openrouter.retry_policy", policy):
+        result = await service.chat_completion(messages=[{"role": "user", "content": "Тест"}])
+
+    assert result["success"] is True
+    assert result["model_used"] == "fallback/model"
+    assert result["tried_models"] == ["primary/model", "fallback/model"]
+    assert result["attempts"] == 3
+
+
+@pytest.mark.asyncio
+async def test_probe_models_and_summary(db_session):
+    """Тест параллельного замера моделей и сводки по сохраненным результатам."""
+    from types import SimpleNamespace
+    from bot.services.probe import ModelProbeService
+
+    async def fake_stream():
+        for text in ("Модель", " работает"):
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None
+            )
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(completion_tokens=4))
+
+    async def fake_create(model, **kwargs):
+        if model == "broken/model":
+            raise RuntimeError("model not found")
+        return fake_stream()
+
+    service = OpenRouterService()
+    service.all_models = ["broken/model", "fast/model"]
+    service.client = AsyncMock()
+    service.client.chat.completions.create.side_effect = fake_create
+
+    probe = ModelProbeService(service)
+    results = await probe.probe_all()
+
+    by_model = {r["model"]: r for r in results}
+    assert by_model["fast/model"]["success"] is True
+    assert by_model["fast/model"]["response"] == "Модель работает"
+    assert by_model["fast/model"]["completion_tokens"] == 4
+    assert by_model["broken/model"]["success"] is False
+
+    await ModelProbeService.save_results(db_session, results)
+    summary = await ModelProbeService.get_summary(db_session)
+
+    assert {row["model"] for row in summary} == {"broken/model", "fast/model"}
+    # Рабочая модель должна оказаться первой в рекомендуемом порядке
+    assert probe.suggest_order(summary) == ["fast/model", "broken/model"]
+    assert "fast/model" in probe.format_table(summary)
+
+
+def test_load_bot_profiles(tmp_path):
+    """Тест загрузки профилей нескольких ботов."""
+    import json
+    from bot.config import settings
+    from bot.profiles import load_profiles
+
+    config = tmp_path / "bots.json"
+    config.write_text(json.dumps([
+        {"name": "first", "token": "111:AAA", "models": ["small/model"], "text_daily_limit": 5},
+        {"name": "second", "token": "222:BBB", "system_prompt": "Ты бот второго бренда."},
+    ]), encoding="utf-8")
+
+    with patch.object(settings, "BOTS_CONFIG", str(config)):
+        first, second = load_profiles()
+
+    assert first.bot_id == 111
+    assert first.model_chain == ["small/model"]
+    assert first.daily_limit == 5
+    assert second.bot_id == 222
+    assert second.prompt == "Ты бот второго бренда."
+    assert second.window_limit == settings.CHAT_WINDOW_LIMIT
+    assert second.model_chain == [settings.OPENROUTER_MODEL] + settings.OPENROUTER_FALLBACK_MODELS
+
+
+@pytest.mark.asyncio
+async def test_profiling_hooks(tmp_path, monkeypatch):
+    """Тест CPU-профиля, профиля памяти и отчета о размерах структур."""
+    from bot.services import profiling
+
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    cache = {i: str(i) * 100 for i in range(50)}
+    profiling.register_structure("test_cache", lambda: cache)
+
+    path = await profiling.profile_cpu(0.2, interval=0.01)
+    content = path.read_text(encoding="utf-8")
+    assert path.parent == tmp_path
+    assert "Свернутые стеки" in content
+
+    path = await profiling.profile_memory(0.1)
+    assert "Топ по строкам" in path.read_text(encoding="utf-8")
+
+    report = {row["name"]: row for row in profiling.structure_sizes()}
+    assert report["test_cache"]["items"] == 50
+    assert report["test_cache"]["bytes"] > 50 * 100
+    assert "test_cache" in profiling.format_structure_sizes(list(report.values()))
+
+
+@pytest.mark.asyncio
+async def test_memory_recall(db_session, tmp_path):
+    """Тест долговременной памяти: поиск старых сообщений и сохранение индекса."""
+    pytest.importorskip("numpy")
+    import asyncio
+    from bot.config import settings
+    from bot.services.history import HistoryService
+    from bot.services.memory import MemoryService
+
+    await HistoryService.add_message(db_session, 4242, "user", "Как настроить репликацию PostgreSQL между серверами?")
+    await HistoryService.add_message(db_session, 4242, "assistant", "Для репликации PostgreSQL включите WAL и создайте слот.")
+    await HistoryService.add_message(db_session, 4242, "user", "Посоветуй рецепт борща со свеклой")
+    await HistoryService.add_message(db_session, 4242, "assistant", "Борщ: свекла, капуста, картофель.")
+
+    service = MemoryService(directory=tmp_path)
+    recent = [("user", "Посоветуй рецепт борща со свеклой"), ("assistant", "Борщ: свекла, капуста, картофель.")]
+    memories = await service.recall(
+        db_session, 4242, "А репликация PostgreSQL бывает синхронной?", exclude=recent, top_k=2
+    )
+    assert memories and all("PostgreSQL" in content for _, content in memories)
+
+    # Уже присутствующие в контексте сообщения не дублируются
+    assert await service.recall(db_session, 4242, "рецепт борща", exclude=recent) == []
+
+    await service.save_all()
+    restored = MemoryService(directory=tmp_path)
+    index = await restored._get_index(4242, 0)
+    assert index.size == 4 and index.last_id == (await service._get_index(4242, 0)).last_id
+
+    # Повторная синхронизация тех же сообщений (параллельный recall) не дублирует их
+    for message_id in index.ids[:index.size].tolist():
+        index.add(message_id, "Как настроить репликацию PostgreSQL между серверами?")
+    assert index.size == 4
+
+    # Вытеснение из кэша сохраняет индекс в фоне; повторное обращение до конца
+    # записи получает тот же объект, а после - индекс с диска
+    with patch.object(settings, "MEMORY_CACHE_USERS", 1):
+        await restored._get_index(1, 0)
+        assert await restored._get_index(4242, 0) is index
+        await restored._get_index(1, 0)
+        await asyncio.gather(*restored._writes)
+        assert not restored._evicted
+        reloaded = await restored._get_index(4242, 0)
+        assert reloaded is not index and reloaded.size == 4
+
+    messages = OpenRouterService().format_messages_from_history(
+        [], "Вопрос", system_prompt="Промпт", memories=memories
+    )
+    assert messages[1]["role"] == "system" and "PostgreSQL" in messages[1]["content"]
+
+
+def test_format_reply_markdown_to_html():
+    """Тест преобразования Markdown модели в Telegram HTML и разбиения на части."""
+    from bot.services.formatting import format_reply, markdown_to_html
+
+    assert markdown_to_html("**жирный**, *курсив* и `a < b`") == "<b>жирный</b>, <i>курсив</i> и <code>a &lt; b</code>"
+    # Непарные маркеры и подчеркивания внутри слов остаются текстом
+    assert markdown_to_html("2 * 3 и snake_case_name *без пары") == "2 * 3 и snake_case_name *без пары"
+    assert markdown_to_html("```python\nif a<b:\n```") == '<pre><code class="language-python">if a&lt;b:\n</code></pre>'
+    assert markdown_to_html("[сайт](https://x.io/?a=1&b=2)") == '<a href="https://x.io/?a=1&amp;b=2">сайт</a>'
+
+    chunks = format_reply("**" + "слово " * 1500 + "конец**", limit=4096)
+    assert len(chunks) == 3
+    for chunk in chunks:
+        assert chunk.startswith("<b>") and chunk.endswith("</b>")
+        assert len(chunk) - len("<b></b>") <= 4096
+
+
+@pytest.mark.asyncio
+async def test_inline_answers_debounce_and_cache(monkeypatch):
+    """Тест inline-ответов: вытеснение устаревшего запроса, ожидание той же задачи и кэш."""
+    import asyncio
+    from bot.config import settings
+    from bot.services import inline
+    from bot.services.inline import InlineAnswerService
+
+    monkeypatch.setattr(settings, "INLINE_DEBOUNCE", 0.05)
+    completion = AsyncMock(return_value={"success": True, "content": "Ответ", "model_used": "m"})
+    monkeypatch.setattr(inline.openrouter_service, "chat_completion", completion)
+    record = AsyncMock()
+    monkeypatch.setattr(InlineAnswerService, "_record", record)
+
+    service = InlineAnswerService()
+    first = asyncio.create_task(service.answer(1, "что так", "Промпт", ["m"]))
+    await asyncio.sleep(0)
+    same = asyncio.create_task(service.answer(1, "Что такое  ИИ?", "Промпт", ["m"]))
+    second = asyncio.create_task(service.answer(1, "что такое ии", "Промпт", ["m"]))
+
+    assert await first is None  # Пользователь продолжил печатать
+    results = [await same, await second]
+    assert completion.await_count == 1
+    assert [result["content"] for result in results] == ["Ответ", "Ответ"]
+    record.assert_awaited_once()  # Вопрос учтен один раз
+
+    # Ответ, не успевший к INLINE_TIMEOUT, учитывается самой задачей, а не получателем из кэша
+    monkeypatch.setattr(settings, "INLINE_TIMEOUT", 0.01)
+    pending = await service.answer(2, "медленный вопрос", "Промпт", ["m"])
+    assert pending == {"success": False, "pending": True}
+    await asyncio.sleep(0.1)
+    assert service.get_cached(0, "медленный вопрос") == "Ответ"
+    assert record.await_args[0][:3] == (0, 2, "медленный вопрос")
+
+    assert service.get_cached(0, "ЧТО ТАКОЕ ИИ") == "Ответ"
+    assert service.get_cached(1, "что такое ии") is None  # Другой бот
+
+
+def test_model_router_tiers(tmp_path, monkeypatch):
+    """Тест: классификация запросов по уровням, цепочки уровней и журнал решений."""
+    import json
+    from bot.config import settings
+    from bot.profiles import BotProfile
+    from bot.services.routing import DEFAULT_MAX_TOKENS, ModelRouter, Tier
+
+    monkeypatch.setattr(settings, "MODEL_TIERS", {"light": ["small"], "heavy": ["large", "large-backup"]})
+    profile = BotProfile(name="test", token="1:x", models=["main", "main-backup"])
+    router = ModelRouter(log_file=str(tmp_path / "routing.jsonl"))
+
+    thanks = router.route(profile, "Спасибо!", [("user", "вопрос")] * 30)
+    assert (thanks.tier, thanks.reason, thanks.models) == (Tier.LIGHT, "trivial", ["small"])
+
+    code = router.route(profile, "Почему падает?\n```python\nprint(x)\n```", [])
+    assert (code.tier, code.reason, code.models) == (Tier.HEAVY, "code", ["large", "large-backup"])
+    assert code.max_tokens == settings.MODEL_TIER_MAX_TOKENS["heavy"]
+
+    assert router.route(profile, "Что такое GIL?", []).tier is Tier.LIGHT
+    # Короткий вопрос в глубоком диалоге требует контекста
+    deep = router.route(profile, "А почему так?", [("assistant", "ответ")] * settings.ROUTER_DEEP_HISTORY)
+    assert (deep.tier, deep.models) == (Tier.STANDARD, ["main", "main-backup"])
+    assert deep.max_tokens == DEFAULT_MAX_TOKENS  # Уровень без цепочки
+
+    # Без настроенных уровней лимит ответа не меняется
+    monkeypatch.setattr(settings, "MODEL_TIERS", {})
+    assert router.route(profile, "Напиши эссе про Войну и мир", []).max_tokens == DEFAULT_MAX_TOKENS
+    assert router.route(profile, "x" * settings.ROUTER_HEAVY_MIN_CHARS, []).reason == "long"
+    assert router.route(profile, "Проанализируй этот договор аренды", []).reason == "task"
+
+    router.record(code, {"success": True, "model_used": "large", "tokens_used": 120}, 1.5, bot_id=7)
+    router.close()
+    entry = json.loads((tmp_path / "routing.jsonl").read_text(encoding="utf-8"))
+    assert entry["tier"] == "heavy" and entry["code"] is True
+    assert entry["model_used"] == "large" and entry["latency_ms"] == 1500 and entry["bot_id"] == 7
+
+
+@pytest.mark.asyncio
+async def test_tracing_tail_sampling(tmp_path, monkeypatch):
+    """Тест: вложенные спаны, хвостовая выборка ошибочных трасс и выгрузка в OTLP/JSON."""
+    import asyncio
+    import json
+    from bot.config import settings
+    from bot.services.tracing import Tracer, STATUS_ERROR
+
+    monkeypatch.setattr(settings, "TRACING_ENABLED", True)
+    monkeypatch.setattr(settings, "TRACE_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(settings, "TRACE_SLOW_MS", 60_000)
+    monkeypatch.setattr(settings, "TRACE_FILE", str(tmp_path / "traces.jsonl"))
+    monkeypatch.setattr(settings, "TRACE_COLLECTOR_URL", None)
+    tracer = Tracer()
+
+    # Быстрая успешная трасса отбрасывается
+    with tracer.span("telegram.update"):
+        with tracer.span("db.session"):
+            pass
+    assert tracer.sampled_out == 1
+
+    # Трасса с ошибкой сохраняется целиком
+    with pytest.raises(RuntimeError):
+        with tracer.span("telegram.update", **{"update.id": 5}):
+            with tracer.span("db.session") as session_span:
+                await asyncio.sleep(0)
+                with tracer.span("openrouter.attempt", model="m1"):
+                    raise RuntimeError("boom")
+
+    assert await tracer.flush() == 1
+    payload = json.loads((tmp_path / "traces.jsonl").read_text(encoding="utf-8"))
+    spans = {span["name"]: span for span in payload["resourceSpans"][0]["scopeSpans"][0]["spans"]}
+
+    assert set(spans) == {"telegram.update", "db.session", "openrouter.attempt"}
+    assert len({span["traceId"] for span in spans.values()}) == 1
+    assert spans["openrouter.attempt"]["parentSpanId"] == session_span.span_id
+    assert spans["db.session"]["parentSpanId"] == spans["telegram.update"]["spanId"]
+    assert "parentSpanId" not in spans["telegram.update"]
+    assert spans["openrouter.attempt"]["status"]["code"] == STATUS_ERROR
+    assert {"key": "update.id", "value": {"intValue": "5"}} in spans["telegram.update"]["attributes"]
+
+
+@pytest.mark.asyncio
+async def test_state_snapshot_roundtrip(tmp_path, monkeypatch):
+    """Тест: кэши и FSM-состояния переживают перезапуск, устаревший или неполный снимок отбрасывается."""
+    import gzip
+    import json
+    import time
+    from unittest.mock import Mock
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from bot.config import settings
+    from bot.middlewares.throttling import ThrottlingMiddleware
+    from bot.services.inline import InlineAnswerService
+    from bot.services.snapshot import SnapshotService, dump_memory_storage, load_memory_storage
+
+    def make_service(throttling, storage, inline, pointers):
+        service = SnapshotService(path=str(tmp_path / "snapshot.json.gz"))
+        service.register("throttling", throttling.dump_state, throttling.load_state)
+        service.register("fsm", lambda: dump_memory_storage(storage), lambda data: load_memory_storage(storage, data))
+        service.register("inline_cache", inline.dump_state, inline.load_state)
+        service.register("pointers", lambda: dict(pointers), pointers.update, clean_only=True)
+        return service
+
+    throttling, storage, inline, pointers = ThrottlingMiddleware(), MemoryStorage(), InlineAnswerService(), {"7": 3}
+    from datetime import datetime
+    counter_row = Mock(one_or_none=Mock(return_value=(4, datetime.utcnow(), None)))
+    await throttling._check_limit(7, AsyncMock(execute=AsyncMock(return_value=counter_row)))
+    key = StorageKey(bot_id=1, chat_id=7, user_id=7)
+    await storage.set_data(key, {"search_query": "asyncio"})
+    inline._store((0, "что такое gil"), "Глобальная блокировка интерпретатора")
+
+    make_service(throttling, storage, inline, pointers).save(clean=True)
+
+    # «Новый процесс»: пустые структуры заполняются из снимка
+    restored_parts = ThrottlingMiddleware(), MemoryStorage(), InlineAnswerService(), {}
+    restored = make_service(*restored_parts).restore()
+    assert restored == {"throttling": True, "fsm": True, "inline_cache": True, "pointers": True}
+
+    throttling2, storage2, inline2, pointers2 = restored_parts
+    session = AsyncMock()
+    assert await throttling2._check_limit(7, session) == (True, 4)
+    session.execute.assert_not_called()  # Счетчик взят из снимка, без запроса к БД
+    assert await storage2.get_data(key) == {"search_query": "asyncio"}
+    assert inline2.get_cached(0, "Что такое GIL?") == "Глобальная блокировка интерпретатора"
+    assert pointers2 == {"7": 3}
+
+    # Снимок удаляется после загрузки; периодический снимок не восстанавливает clean_only-разделы
+    service = make_service(ThrottlingMiddleware(), MemoryStorage(), InlineAnswerService(), {})
+    assert service.restore() == {}
+    make_service(throttling, storage, inline, pointers).save(clean=False)
+    assert "pointers" not in make_service(ThrottlingMiddleware(), MemoryStorage(), InlineAnswerService(), {}).restore()
+
+    # Устаревший снимок игнорируется
+    path = tmp_path / "snapshot.json.gz"
+    stale = {"version": 1, "created_at": time.time() - settings.SNAPSHOT_MAX_AGE - 1, "clean": True, "sections": {}}
+    path.write_bytes(gzip.compress(json.dumps(stale).encode()))
+    assert make_service(ThrottlingMiddleware(), MemoryStorage(), InlineAnswerService(), {}).restore() == {}
+
+
+@pytest.mark.asyncio
+async def test_document_attachments(db_session, monkeypatch):
+    """Тест: потоковое извлечение с бюджетами, кэш по file_unique_id и подстановка в историю."""
+    from types import SimpleNamespace
+    from unittest.mock import Mock
+    from bot.config import settings
+    from bot.services.attachments import AttachmentService, TextExtractor, UnsupportedDocument
+    from bot.services.history import HistoryService
+
+    # Кодировка: UTF-8 с символом, разрезанным границей части, и cp1251
+    extractor = TextExtractor(max_bytes=1000, max_chars=1000)
+    data = "Привет, мир".encode("utf-8")
+    assert extractor.feed(data[:3]) and extractor.feed(data[3:])
+    assert extractor.finish() == "Привет, мир"
+    extractor = TextExtractor(max_bytes=1000, max_chars=1000)
+    extractor.feed("Отчет".encode("cp1251"))
+    assert extractor.finish() == "Отчет"
+    with pytest.raises(UnsupportedDocument):
+        TextExtractor(max_bytes=1000, max_chars=1000).feed(b"PK\x03\x04\x00\x00")
+
+    # Бюджет символов прерывает скачивание: читается только первая часть
+    monkeypatch.setattr(settings, "ATTACHMENT_MAX_TOKENS", 10)
+    chunks_read = []
+
+    async def stream_content(**kwargs):
+        for number in range(100):
+            chunks_read.append(number)
+            yield b"x" * kwargs["chunk_size"]
+
+    bot = Mock(token="1:x")
+    bot.get_file = AsyncMock(return_value=SimpleNamespace(file_path="documents/file.txt"))
+    bot.session.stream_content = stream_content
+    document = SimpleNamespace(file_id="f1", file_unique_id="u1", file_name="notes.txt", file_size=10_000_000)
+
+    attachment, cached = await AttachmentService.get_or_extract(db_session, bot, document)
+    assert not cached and attachment.truncated
+    assert attachment.text == "x" * 30
+    assert chunks_read == [0]
+
+    # Повторная отправка того же файла не скачивает его
+    _, cached = await AttachmentService.get_or_extract(db_session, bot, document)
+    assert cached and bot.get_file.await_count == 1
+
+    with pytest.raises(UnsupportedDocument):
+        await AttachmentService.get_or_extract(
+            db_session, bot, SimpleNamespace(file_id="f2", file_unique_id="u2", file_name="photo.jpg", file_size=10)
+        )
+
+    # В истории текст подставляется только для последнего вложения
+    second = SimpleNamespace(file_id="f3", file_unique_id="u3", file_name="plan.md", file_size=5)
+    bot.session.stream_content = lambda **kwargs: _chunks(b"step 1")
+    plan, _ = await AttachmentService.get_or_extract(db_session, bot, second)
+
+    await HistoryService.add_message(db_session, 42, "user", "", attachment_id=attachment.id)
+    await HistoryService.add_message(db_session, 42, "user", "что в плане?", attachment_id=plan.id)
+    history = await HistoryService.get_recent_history(db_session, 42)
+    assert "x" * 30 not in history[0][1] and "notes.txt" in history[0][1]
+    assert history[1][1].startswith("что в плане?") and "step 1" in history[1][1]
+
+    history = await HistoryService.get_recent_history(db_session, 42, expand_attachments=False)
+    assert "step 1" not in history[1][1]
+
+    # Очистка не трогает вложения, на которые ссылается история
+    assert await AttachmentService.cleanup(db_session, max_age_days=-1) == 0
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def test_settings_hot_reload(tmp_path):
+    """Тест перезагрузки настроек: подписчики, атомарная проверка и поля, требующие перезапуска."""
+    import os
+    from bot.config import Settings, SettingsProxy
+
+    env_file = tmp_path / ".env"
+    env_file.write_text("TEXT_DAILY_LIMIT=50\nOPENROUTER_FALLBACK_MODELS=[\"a/one\"]\nMEMORY_DIR=data/memory\n")
+    proxy = SettingsProxy(lambda: Settings(_env_file=str(env_file)), env_file=str(env_file))
+    assert proxy.TEXT_DAILY_LIMIT == 50
+
+    calls = []
+    proxy.subscribe(lambda old, new, changed: calls.append(("models", sorted(changed))), {"OPENROUTER_FALLBACK_MODELS"})
+    proxy.subscribe(lambda old, new, changed: calls.append(("limits", old.TEXT_DAILY_LIMIT, new.TEXT_DAILY_LIMIT)),
+                    {"TEXT_DAILY_LIMIT"})
+
+    # Без изменения файла перезагрузки нет
+    assert proxy.reload_if_changed() is None
+
+    env_file.write_text("TEXT_DAILY_LIMIT=80\nOPENROUTER_FALLBACK_MODELS=[\"a/one\"]\nMEMORY_DIR=/elsewhere\n")
+    os.utime(env_file, (1, 1))
+    assert proxy.reload_if_changed() == {"TEXT_DAILY_LIMIT"}
+    assert proxy.TEXT_DAILY_LIMIT == 80
+    assert proxy.MEMORY_DIR == "data/memory"  # Применяется только после перезапуска
+    assert calls == [("limits", 50, 80)]
+
+    # Невалидный файл целиком отклоняется, прежние значения остаются
+    before = proxy.current
+    env_file.write_text("TEXT_DAILY_LIMIT=много\nOPENROUTER_FALLBACK_MODELS=[\"b/two\"]\n")
+    assert proxy.reload() is None
+    assert proxy.current is before and proxy.OPENROUTER_FALLBACK_MODELS == ["a/one"]
+
+    env_file.write_text("TEXT_DAILY_LIMIT=80\nOPENROUTER_FALLBACK_MODELS=[\"b/two\"]\nMEMORY_DIR=data/memory\n")
+    assert proxy.reload() == {"OPENROUTER_FALLBACK_MODELS"}
+    assert calls[-1] == ("models", ["OPENROUTER_FALLBACK_MODELS"])
+
+
+@pytest.mark.asyncio
+async def test_openrouter_record_replay(tmp_path, monkeypatch):
+    """Запись трафика к OpenRouter и воспроизведение без сети: тот же переход на резервную модель."""
+    import gzip
+    import json
+    import httpx
+    from bot.services.recording import RecordingTransport, ReplayStore, ReplayTransport, TrafficRecorder, load_records
+    from bot.config import settings
+
+    monkeypatch.setattr(settings, "RETRY_MAX_ATTEMPTS", 1)
+    completion = {
+        "id": "1", "object": "chat.completion", "created": 0, "model": "model-b",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "Ответ на вопрос"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+    }
+
+    async def sse():
+        event = {"choices": [{"index": 0, "delta": {"content": "Секретный ответ"}}]}
+        data = f"data: {json.dumps(event, ensure_ascii=False)}\n\ndata: [DONE]\n\n".encode()
+        yield data[:20]  # Событие разбито между частями
+        yield data[20:]
+
+    def upstream(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        if body["model"] == "model-a":
+            raise httpx.ConnectError("connection refused", request=request)
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=sse())
+        return httpx.Response(200, json=completion)
+
+    path = tmp_path / "openrouter.jsonl.gz"
+    recorder = TrafficRecorder(str(path))
+    client = httpx.AsyncClient(
+        transport=RecordingTransport(httpx.MockTransport(upstream), recorder, "https://openrouter.ai/api/v1"),
+    )
+    messages = [{"role": "user", "content": "Секретный вопрос"}]
+    recorded = await OpenRouterService(http_client=client).chat_completion(messages, models=["model-a", "model-b"])
+    async with client.stream("POST", "https://openrouter.ai/api/v1/chat/completions",
+                             json={"model": "model-b", "stream": True, "messages": messages}) as response:
+        streamed = [chunk async for chunk in response.aiter_bytes()]
+    await client.aclose()
+
+    assert recorded["model_used"] == "model-b" and recorded["fallback_used"]
+    assert "Секретный ответ" in b"".join(streamed).decode()  # Клиент получает ответ без изменений
+    raw = gzip.decompress(path.read_bytes()).decode()
+    assert "Секретный" not in raw and "Ответ на вопрос" not in raw and "Bearer" not in raw
+    records = load_records(str(path))
+    assert [(r["model"], r["status"], r["error"] and r["error"]["type"]) for r in records] == [
+        ("model-a", None, "ConnectError"), ("model-b", 200, None), ("model-b", 200, None),
+    ]
+    # Тексты ответа заменены длиной, разбиение на события сохранено
+    assert [chunk[1] for chunk in records[2]["chunks"]] == [
+        'data: {"choices":[{"index":0,"delta":{"content":"<redacted:15>"}}]}\n\ndata: [DONE]\n\n',
+    ]
+
+    # Воспроизведение: без сети, без задержек, тот же результат
+    replay = httpx.AsyncClient(transport=ReplayTransport(ReplayStore(records), speed=0))
+    replayed = await OpenRouterService(http_client=replay).chat_completion(messages, models=["model-a", "model-b"])
+    assert {k: replayed[k] for k in ("model_used", "attempts", "tried_models")} == {
+        k: recorded[k] for k in ("model_used", "attempts", "tried_models")
+    }
+    assert replayed["content"] == "<redacted:15>"
+    async with replay.stream("POST", "https://openrouter.ai/api/v1/chat/completions",
+                             json={"model": "model-b", "stream": True, "messages": messages}) as response:
+        assert b"".join([chunk async for chunk in response.aiter_bytes()]).decode() == records[2]["chunks"][0][1]
+    await replay.aclose()